@@ -0,0 +1,93 @@
+# Benchmark of the item representation on the export path
+#
+# Compares the dict-backed LowesProductItem against the slotted ProductRecord
+# built by the spider: memory held per item, time to build the items, and time
+# to export them with the JSON lines feed exporter, which reads both through
+# ItemAdapter.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m benchmarks.item_records
+#     python -m benchmarks.item_records --count 100000
+
+import argparse
+import gc
+import io
+import time
+import tracemalloc
+
+from scrapy.exporters import JsonLinesItemExporter
+
+from lowes_crawler.items import LowesProductItem, ProductRecord
+
+SAMPLE = {
+    "item_id": "1000123456",
+    "url": "https://www.lowes.com/pd/Holiday-Living-24-in-Fall-Wreath/1000123456",
+    "model_number": "W-12345",
+    "brand": "Holiday Living",
+    "price": 39.98,
+    "price_hidden_in_cart": False,
+    "store_number": "0416",
+    "zip_code": "28278",
+    "category": "/pl/fall-decorations/fall-wreaths-garland/1614047588",
+    "date": "2024-11-21T08:04:41.000000Z",
+    "change_type": None,
+}
+
+
+def build_item(i):
+    item = LowesProductItem()
+    for key, value in SAMPLE.items():
+        item[key] = value
+    item["item_id"] = str(1000000000 + i)
+    return item
+
+
+def build_record(i):
+    return ProductRecord(**{**SAMPLE, "item_id": str(1000000000 + i)})
+
+
+def measure(build, count):
+    """
+    Builds `count` items and exports them to JSON lines, and returns (build seconds, export seconds, bytes held per item).
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    items = [build(i) for i in range(count)]
+    build_time = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    exporter = JsonLinesItemExporter(io.BytesIO())
+    exporter.start_exporting()
+    start = time.perf_counter()
+    for item in items:
+        exporter.export_item(item)
+    export_time = time.perf_counter() - start
+    exporter.finish_exporting()
+
+    return build_time, export_time, held / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LowesProductItem against ProductRecord on the export path.")
+    parser.add_argument("--count", type=int, default=1000000, help="Number of items")
+    args = parser.parse_args()
+
+    results = {
+        "item": measure(build_item, args.count),
+        "record": measure(build_record, args.count),
+    }
+
+    print(f"Items: {args.count}")
+    print(f"{'representation':<16}{'build s':>10}{'export s':>11}{'bytes/item':>12}")
+    for name, (build_time, export_time, bytes_per_item) in results.items():
+        print(f"{name:<16}{build_time:>10.2f}{export_time:>11.2f}{bytes_per_item:>12.0f}")
+
+    item_result, record_result = results["item"], results["record"]
+    print(f"Export time: {record_result[1] / item_result[1]:.0%} of LowesProductItem | Memory per item: {record_result[2] / item_result[2]:.0%} of LowesProductItem")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Benchmark of the listing page parser
+#
+# Compares the byte-level itemList extractor used by LowesSpider.parse against
+# the previous approach of decoding every <script> tag and running a DOTALL
+# regex + json.loads over the whole preloaded state.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m benchmarks.listing_parser failures/              # listing pages of the failure archives
+#     python -m benchmarks.listing_parser saved_pages/
+#     python -m benchmarks.listing_parser page1.html page2.html --repeat 50
+
+import argparse
+import json
+import os
+import re
+import time
+import tracemalloc
+
+from parsel import Selector
+
+from lowes_crawler.failures import FAILED_HTML, iter_failures, list_archives
+from lowes_crawler.listing import extract_item_list, iter_item_ids
+
+
+def legacy_item_ids(body):
+    """
+    Extracts the item IDs the way LowesSpider.parse used to: every script text, DOTALL regex and a full json.loads.
+    """
+
+    scripts = Selector(text=body.decode("utf-8")).css("script::text").getall()
+
+    for script in scripts:
+        match = re.search(r"window\['__PRELOADED_STATE__'\]\s*=\s*({.*})", script, re.DOTALL)
+        if match:
+            preloaded_state = json.loads(match.group(1))
+            return [item["product"]["omniItemId"] for item in preloaded_state.get("itemList", [])]
+
+    return []
+
+
+def streaming_item_ids(body):
+    """
+    Extracts the item IDs with the byte-level extractor used by LowesSpider.parse.
+    """
+
+    item_list = extract_item_list(body)
+    return list(iter_item_ids(item_list or []))
+
+
+def load_pages(paths):
+    """
+    Loads the raw bodies of the saved listing pages, expanding folders into the .html files or the archived failed pages they contain.
+    """
+
+    pages = []
+
+    for path in paths:
+        if list_archives(path):
+            pages.extend(data for _, data in iter_failures(path, kind=FAILED_HTML))
+            continue
+
+        if os.path.isdir(path):
+            file_paths = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(".html")]
+        else:
+            file_paths = [path]
+
+        for file_path in file_paths:
+            with open(file_path, "rb") as f:
+                pages.append(f.read())
+
+    return pages
+
+
+def measure(extract, pages, repeat):
+    """
+    Runs an extractor over all pages and returns (seconds per page, peak traced memory in bytes, item ids of each page).
+    """
+
+    results = [extract(page) for page in pages]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract(page)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for page in pages:
+        extract(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed / (repeat * len(pages)), peak, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the listing page parser against saved listing pages.")
+    parser.add_argument("paths", nargs="+", help="Saved listing pages, folders of .html files, or failure archive folders (e.g. failures/)")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of passes over the pages")
+    args = parser.parse_args()
+
+    pages = load_pages(args.paths)
+    if not pages:
+        parser.error("No saved listing pages found.")
+
+    legacy_time, legacy_peak, legacy_results = measure(legacy_item_ids, pages, args.repeat)
+    streaming_time, streaming_peak, streaming_results = measure(streaming_item_ids, pages, args.repeat)
+
+    if legacy_results != streaming_results:
+        print("WARNING: extractors returned different item IDs")
+
+    total_size = sum(len(page) for page in pages)
+    print(f"Pages: {len(pages)} | Average size: {total_size / len(pages) / 1024:.1f} KiB")
+    print(f"{'parser':<12}{'ms/page':>12}{'peak KiB':>12}")
+    print(f"{'legacy':<12}{legacy_time * 1000:>12.2f}{legacy_peak / 1024:>12.1f}")
+    print(f"{'streaming':<12}{streaming_time * 1000:>12.2f}{streaming_peak / 1024:>12.1f}")
+    print(f"Speedup: {legacy_time / streaming_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Offline benchmark of the proxy pool throughput
+#
+# Local HTTP proxies answer every request after a fixed latency, one request at
+# a time, like exits whose request rate is limited by the site. The same crawl
+# runs through ProxyPoolMiddleware with more and more proxies and reports the
+# requests/sec of each pool size, to see how throughput scales with the pool.
+# Every crawl runs in its own process, since the Twisted reactor can only run
+# once per process.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m benchmarks.proxy_pool
+#     python -m benchmarks.proxy_pool --proxies 1 2 4 8 --requests 400 --latency 0.05
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import scrapy
+from scrapy.crawler import CrawlerProcess
+
+
+class SlowProxy:
+    """
+    Local HTTP proxy answering one request at a time, each after `latency` seconds.
+    """
+
+    def __init__(self, latency):
+        lock = threading.Lock()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    time.sleep(latency)
+
+                body = b"{}"
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+class BenchmarkSpider(scrapy.Spider):
+    name = "proxy_pool_benchmark"
+
+    def __init__(self, requests=0, cookiejars=1, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.request_count = int(requests)
+        self.cookiejars = int(cookiejars)
+
+    def start_requests(self):
+        for i in range(self.request_count):
+            cookiejar = f"location-{i % self.cookiejars}"
+            yield scrapy.Request(
+                f"http://www.example.test/{cookiejar}/{i}",
+                cookies={"dbidv2": "original"},
+                meta={"cookiejar": cookiejar},
+                dont_filter=True,
+            )
+
+    def parse(self, response):
+        pass
+
+
+def run_crawl(proxy_count, requests, cookiejars, latency):
+    """
+    Crawls `requests` pages through `proxy_count` local proxies, and returns the requests/sec.
+    """
+
+    proxies = [SlowProxy(latency) for _ in range(proxy_count)]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as proxy_file:
+        proxy_file.write("".join(f"{proxy.url}\n" for proxy in proxies))
+
+    process = CrawlerProcess({
+        "LOG_LEVEL": "ERROR",
+        "TELNETCONSOLE_ENABLED": False,
+        "ROBOTSTXT_OBEY": False,
+        "RETRY_ENABLED": False,
+        "CONCURRENT_REQUESTS": 64,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 64,
+        "DOWNLOADER_MIDDLEWARES": {"lowes_crawler.middlewares.ProxyPoolMiddleware": 600},
+        "PROXY_POOL_FILE": proxy_file.name,
+    })
+
+    start = time.perf_counter()
+    process.crawl(BenchmarkSpider, requests=requests, cookiejars=cookiejars)
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    os.remove(proxy_file.name)
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the proxy pool throughput against local proxies.")
+    parser.add_argument("--proxies", type=int, nargs="+", default=[1, 2, 4, 8], help="Pool sizes to benchmark")
+    parser.add_argument("--requests", type=int, default=400, help="Number of requests of each crawl")
+    parser.add_argument("--cookiejars", type=int, default=32, help="Number of cookie jars (e.g. locations) the requests are spread over")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds each proxy takes to answer a request")
+    parser.add_argument("--run", type=int, help=argparse.SUPPRESS)  # Single crawl, in a child process
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_crawl(args.run, args.requests, args.cookiejars, args.latency)))
+        return
+
+    print(f"Requests: {args.requests} | Cookie jars: {args.cookiejars} | Proxy latency: {args.latency * 1000:.0f} ms, one request at a time")
+    print(f"{'proxies':<10}{'requests/s':>12}{'speedup':>10}")
+
+    baseline = None
+    for proxy_count in args.proxies:
+        command = [
+            sys.executable, "-m", "benchmarks.proxy_pool", "--run", str(proxy_count),
+            "--requests", str(args.requests), "--cookiejars", str(args.cookiejars), "--latency", str(args.latency),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        rate = json.loads(output.strip().splitlines()[-1])
+
+        baseline = baseline or rate
+        print(f"{proxy_count:<10}{rate:>12.1f}{rate / baseline:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
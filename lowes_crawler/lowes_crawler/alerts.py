@@ -0,0 +1,169 @@
+# Streaming price alerts
+#
+# Every scraped price is checked while the crawl runs, in constant time per item:
+# - price changes: the price moved by a large fraction from the item's previous
+#   price at the same location (from the price history store)
+# - outliers: the price is far from the running prices of its brand or its
+#   category, e.g. a $2 refrigerator
+# - pricing errors: a zero price
+#
+# Running statistics are exponentially weighted means and variances of log
+# prices, so they follow price levels across the crawl and take constant memory
+# per brand or category. Only the most recently seen groups are kept.
+
+from collections import OrderedDict
+import math
+
+PRICE_DROP = "price_drop"
+PRICE_INCREASE = "price_increase"
+OUTLIER = "outlier"
+PRICING_ERROR = "pricing_error"
+
+
+class EwmaStats:
+    """
+    Exponentially weighted mean and variance of a stream of values.
+
+    Parameters:
+    - alpha (float): Weight of each new value, between 0 and 1. About the last 2 / alpha values make up the statistics.
+    """
+
+    __slots__ = ("alpha", "count", "mean", "variance")
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.variance = 0.0
+
+    def update(self, value):
+        if self.count == 0:
+            self.mean = value
+        else:
+            delta = value - self.mean
+            self.mean += self.alpha * delta
+            self.variance = (1 - self.alpha) * (self.variance + self.alpha * delta * delta)
+        self.count += 1
+
+    def score(self, value):
+        """
+        Returns the number of standard deviations between a value and the mean, 0 if the values didn't vary yet.
+        """
+
+        std = math.sqrt(self.variance)
+        if std == 0:
+            return 0.0
+        return (value - self.mean) / std
+
+
+class GroupStats:
+    """
+    EwmaStats per group (e.g. per brand), keeping only the `max_groups` most recently updated groups.
+    """
+
+    def __init__(self, alpha, max_groups):
+        self.alpha = alpha
+        self.max_groups = max_groups
+        self.groups = OrderedDict()
+
+    def get(self, group):
+        return self.groups.get(group)
+
+    def update(self, group, value):
+        stats = self.groups.get(group)
+
+        if stats is None:
+            stats = self.groups[group] = EwmaStats(self.alpha)
+            if len(self.groups) > self.max_groups:
+                self.groups.popitem(last=False)
+        else:
+            self.groups.move_to_end(group)
+
+        stats.update(value)
+
+
+class PriceAlertDetector:
+    """
+    Finds the price changes, outliers and pricing errors of scraped items.
+
+    Parameters:
+    - min_change (float): Minimum change from the previous price raising an alert, as a fraction (e.g. 0.3 for 30%).
+    - max_score (float): Number of standard deviations from the brand or category log prices above which a price is an outlier.
+    - min_samples (int): Number of prices of a brand or category needed before its outliers are reported.
+    - alpha (float): Weight of each new price in the running statistics.
+    - max_groups (int): Maximum number of brands and of categories with running statistics.
+    """
+
+    def __init__(self, min_change, max_score, min_samples, alpha, max_groups):
+        self.min_change = min_change
+        self.max_score = max_score
+        self.min_samples = min_samples
+        self.stats = {
+            "brand": GroupStats(alpha, max_groups),
+            "category": GroupStats(alpha, max_groups),
+        }
+
+    def check(self, item, previous=None):
+        """
+        Checks the price of an item and adds it to the running statistics.
+
+        Parameters:
+        - item (ItemAdapter): Scraped item.
+        - previous (tuple): (date, price) of the item's previous price at the same location, None if unknown.
+
+        Returns:
+        list: Alert dicts, empty if the price is as expected.
+        """
+
+        price = item.get("price")
+        if price is None or item.get("change_type") == "removed":
+            return []
+
+        if price <= 0:
+            return [self.build_alert(PRICING_ERROR, item, previous)]
+
+        alerts = []
+
+        if previous is not None and previous[1]:
+            change = (price - previous[1]) / previous[1]
+            if abs(change) >= self.min_change:
+                alerts.append(self.build_alert(PRICE_DROP if change < 0 else PRICE_INCREASE, item, previous, change=round(change, 4)))
+
+        # Prices are compared on a log scale, since they spread over orders of magnitude within a brand or category
+        log_price = math.log(price)
+
+        for group_by, group_stats in self.stats.items():
+            group = item.get(group_by)
+            if not group:
+                continue
+
+            stats = group_stats.get(group)
+            if stats is not None and stats.count >= self.min_samples:
+                score = stats.score(log_price)
+                if abs(score) >= self.max_score:
+                    alerts.append(
+                        self.build_alert(
+                            OUTLIER, item, previous,
+                            group_by=group_by, score=round(score, 2), typical_price=round(math.exp(stats.mean), 2),
+                        )
+                    )
+
+            group_stats.update(group, log_price)
+
+        return alerts
+
+    def build_alert(self, alert_type, item, previous, **details):
+        return {
+            "type": alert_type,
+            "item_id": item.get("item_id"),
+            "store_number": item.get("store_number"),
+            "zip_code": item.get("zip_code"),
+            "brand": item.get("brand"),
+            "category": item.get("category"),
+            "url": item.get("url"),
+            "price": item.get("price"),
+            "previous_price": previous[1] if previous is not None else None,
+            "previous_date": previous[0] if previous is not None else None,
+            "date": item.get("date"),
+            **details,
+        }
@@ -0,0 +1,524 @@
+# Price analytics over the partitioned Parquet dataset
+#
+# Computes the reports of the wreath analysis notebook (duplicates, nulls,
+# price distribution, IQR outliers, items per brand, price range and average
+# price per brand, histogram, most expensive items) across many runs, stores
+# and categories.
+#
+# Every (crawl_date, store_number) partition is scanned once, in record
+# batches and with only the columns needed, into partial aggregates per
+# category that can be merged: counts, sums, min/max, value counts of the
+# prices (enough for exact quantiles and histograms) and the top items. The
+# partials are cached per partition, so a report only scans the partitions that
+# are new or changed since the last report.
+#
+# Incremental recrawls (INCREMENTAL_ENABLED) write different rows:
+# - tombstones of removed products (change_type "removed") only have their ids,
+#   so they are not aggregated as products, only counted as "removed" (under
+#   the "" category, since they have none)
+# - their partitions only hold the new and changed products, not the whole
+#   catalog. Those rows are aggregated and counted as "incremental_rows", so a
+#   report whose rows are mostly incremental describes the changes of those
+#   runs. Report on full crawls to describe the catalog.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m lowes_crawler.analytics
+#     python -m lowes_crawler.analytics --crawl-date 2024-11-21 --store 0416 --by category
+#     python -m lowes_crawler.analytics --by store_number --json
+
+from collections import Counter
+import argparse
+import hashlib
+import json
+import math
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from .parquet import PARTITIONING
+
+COLUMNS = ["item_id", "category", "brand", "price", "change_type"]
+CACHE_VERSION = 2  # Changed when the partial aggregates change, so cached partitions are scanned again
+TOP_ITEMS = 5
+ITEM_COUNTS_MERGE_BATCHES = 16  # Per batch item ID counts merged at once
+UNKNOWN_BRAND = "Unknown"
+
+
+def list_partitions(base_path):
+    """
+    Lists the (crawl_date, store_number) partitions of the dataset and their files.
+
+    Returns:
+    dict: {(crawl_date, store_number): sorted list of Parquet file paths}
+    """
+
+    partitions = {}
+
+    if not os.path.isdir(base_path):
+        return partitions
+
+    for date_folder in sorted(os.listdir(base_path)):
+        if not date_folder.startswith("crawl_date="):
+            continue
+
+        for store_folder in sorted(os.listdir(os.path.join(base_path, date_folder))):
+            if not store_folder.startswith("store_number="):
+                continue
+
+            folder_path = os.path.join(base_path, date_folder, store_folder)
+            files = sorted(os.path.join(folder_path, name) for name in os.listdir(folder_path) if name.endswith(".parquet"))
+
+            if files:
+                partitions[(date_folder.split("=", 1)[1], store_folder.split("=", 1)[1])] = files
+
+    return partitions
+
+
+def get_signature(files):
+    """
+    Returns a signature of the files of a partition, which changes when a file is added, removed or rewritten.
+    """
+
+    parts = [f"v{CACHE_VERSION}"] + [f"{os.path.basename(path)}:{os.path.getsize(path)}:{os.path.getmtime(path)}" for path in files]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def new_partial():
+    return {
+        "rows": 0,
+        "removed": 0,  # Tombstones of removed products, not aggregated
+        "incremental_rows": 0,  # Rows of incremental recrawls (change_type "new" or "changed")
+        "nulls": {"item_id": 0, "brand": 0, "price": 0},
+        "duplicate_item_ids": [],  # Item IDs found more than once in the same partition
+        "brands": {},  # brand -> [rows, price count, price sum, price min, price max]
+        "prices": {},  # price -> count
+        "price_sum_squares": 0.0,
+        "top": [],  # [price, item_id, brand]
+    }
+
+
+def aggregate_batch(batch, partials):
+    """
+    Adds a record batch to the partial aggregates of its categories, with vectorized pyarrow kernels.
+
+    Returns:
+    pyarrow.Table: Number of rows of each (item_id, category) of the batch, to find the duplicates of the partition.
+    """
+
+    table = pa.Table.from_batches([batch])
+    table = table.set_column(table.schema.get_field_index("category"), "category", pc.fill_null(table["category"], ""))
+
+    removed = pc.fill_null(pc.equal(table["change_type"], "removed"), False)
+    removed_count = pc.sum(removed).as_py() or 0
+    if removed_count:
+        for category, count in zip(*(column.to_pylist() for column in pc.value_counts(table.filter(removed)["category"]).flatten())):
+            partials.setdefault(category, new_partial())["removed"] += count
+        table = table.filter(pc.invert(removed))
+
+    item_ids = table.filter(pc.is_valid(table["item_id"]))
+    item_counts = item_ids.group_by(["item_id", "category"]).aggregate([([], "count_all")])
+
+    for category in pc.unique(table["category"]).to_pylist():
+        rows = table.filter(pc.equal(table["category"], category))
+        partial = partials.setdefault(category, new_partial())
+
+        partial["rows"] += rows.num_rows
+        partial["incremental_rows"] += rows.num_rows - rows["change_type"].null_count
+        for column in partial["nulls"]:
+            partial["nulls"][column] += rows[column].null_count
+
+        rows = rows.set_column(rows.schema.get_field_index("brand"), "brand", pc.fill_null(rows["brand"], UNKNOWN_BRAND))
+
+        brand_stats = rows.group_by("brand").aggregate([
+            ([], "count_all"),
+            ("price", "count"),
+            ("price", "sum"),
+            ("price", "min"),
+            ("price", "max"),
+        ])
+        for brand, count, price_count, price_sum, price_min, price_max in zip(*(brand_stats[name].to_pylist() for name in (
+            "brand", "count_all", "price_count", "price_sum", "price_min", "price_max",
+        ))):
+            merge_brand(partial["brands"], brand, [count, price_count, price_sum or 0.0, price_min, price_max])
+
+        prices = rows["price"].drop_null()
+        if len(prices):
+            value_counts = pc.value_counts(prices)
+            for value, count in zip(value_counts.field("values").to_pylist(), value_counts.field("counts").to_pylist()):
+                key = repr(value)
+                partial["prices"][key] = partial["prices"].get(key, 0) + count
+
+            partial["price_sum_squares"] += pc.sum(pc.multiply(prices, prices)).as_py()
+
+            top_indices = pc.select_k_unstable(rows, k=TOP_ITEMS, sort_keys=[("price", "descending")])
+            top_rows = rows.take(top_indices)
+            top = zip(top_rows["price"].to_pylist(), top_rows["item_id"].to_pylist(), top_rows["brand"].to_pylist())
+            partial["top"] = merge_top(partial["top"], [list(row) for row in top if row[0] is not None])
+
+    return item_counts.select(["item_id", "category", "count_all"]).rename_columns(["item_id", "category", "count"])
+
+
+def merge_item_counts(tables):
+    """
+    Merges (item_id, category, count) tables into one, summing the counts of the same item ID and category.
+    """
+
+    merged = pa.concat_tables(tables).group_by(["item_id", "category"]).aggregate([("count", "sum")])
+    return merged.select(["item_id", "category", "count_sum"]).rename_columns(["item_id", "category", "count"])
+
+
+def merge_brand(brands, brand, stats):
+    current = brands.get(brand)
+
+    if current is None:
+        brands[brand] = list(stats)
+        return
+
+    current[0] += stats[0]
+    current[1] += stats[1]
+    current[2] += stats[2]
+    current[3] = min(value for value in (current[3], stats[3]) if value is not None) if current[3] is not None or stats[3] is not None else None
+    current[4] = max(value for value in (current[4], stats[4]) if value is not None) if current[4] is not None or stats[4] is not None else None
+
+
+def merge_top(*tops):
+    rows = [row for top in tops for row in top]
+    return sorted(rows, key=lambda row: row[0], reverse=True)[:TOP_ITEMS]
+
+
+def merge_partials(partials):
+    """
+    Merges partial aggregates into one.
+    """
+
+    merged = new_partial()
+    prices = Counter()
+
+    for partial in partials:
+        merged["rows"] += partial["rows"]
+        merged["removed"] += partial["removed"]
+        merged["incremental_rows"] += partial["incremental_rows"]
+        for column in merged["nulls"]:
+            merged["nulls"][column] += partial["nulls"][column]
+
+        merged["duplicate_item_ids"] = sorted(set(merged["duplicate_item_ids"]) | set(partial["duplicate_item_ids"]))
+
+        for brand, stats in partial["brands"].items():
+            merge_brand(merged["brands"], brand, stats)
+
+        prices.update(partial["prices"])
+        merged["price_sum_squares"] += partial["price_sum_squares"]
+        merged["top"] = merge_top(merged["top"], partial["top"])
+
+    merged["prices"] = dict(prices)
+    return merged
+
+
+def scan_partition(files, batch_size):
+    """
+    Scans the files of a partition in record batches into partial aggregates per category.
+
+    Returns:
+    dict: {category: partial aggregates}
+    """
+
+    partials = {}
+    item_counts = []  # (item_id, category, count) tables, merged every few batches so only the distinct item IDs are kept
+    scanner = ds.dataset(files, format="parquet").scanner(columns=COLUMNS, batch_size=batch_size)
+
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            item_counts.append(aggregate_batch(batch, partials))
+
+            if len(item_counts) >= ITEM_COUNTS_MERGE_BATCHES:
+                item_counts = [merge_item_counts(item_counts)]
+
+    if not item_counts:
+        return partials
+
+    # The same item in several runs or stores is expected, so duplicates are only looked for within the partition
+    item_counts = merge_item_counts(item_counts)
+    totals = item_counts.group_by("item_id").aggregate([("count", "sum")])
+    duplicate_item_ids = totals.filter(pc.greater(totals["count_sum"], 1))["item_id"]
+    duplicates = item_counts.filter(pc.is_in(item_counts["item_id"], value_set=duplicate_item_ids.combine_chunks()))
+
+    for item_id, category in zip(duplicates["item_id"].to_pylist(), duplicates["category"].to_pylist()):
+        partials[category]["duplicate_item_ids"].append(item_id)
+
+    for partial in partials.values():
+        partial["duplicate_item_ids"].sort()
+
+    return partials
+
+
+def load_partials(base_path, cache_path, crawl_dates=None, store_numbers=None, batch_size=65536):
+    """
+    Returns the partial aggregates of the selected partitions, scanning only the partitions missing from the cache or changed.
+
+    Returns:
+    dict: {(crawl_date, store_number): {category: partial aggregates}}
+    """
+
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+    partials = {}
+    cache_changed = False
+
+    for (crawl_date, store_number), files in list_partitions(base_path).items():
+        if crawl_dates and crawl_date not in crawl_dates:
+            continue
+        if store_numbers and store_number not in store_numbers:
+            continue
+
+        cache_key = f"{crawl_date}/{store_number}"
+        signature = get_signature(files)
+        cached = cache.get(cache_key)
+
+        if cached is None or cached["signature"] != signature:
+            cached = {"signature": signature, "categories": scan_partition(files, batch_size)}
+            cache[cache_key] = cached
+            cache_changed = True
+
+        partials[(crawl_date, store_number)] = cached["categories"]
+
+    if cache_path and cache_changed:
+        folder_path = os.path.dirname(cache_path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        temp_path = f"{cache_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(temp_path, cache_path)
+
+    return partials
+
+
+def quantile(values, counts, total, q):
+    """
+    Returns a quantile of a sorted value count table, with the linear interpolation of pandas.Series.quantile.
+    """
+
+    position = (total - 1) * q
+    lower_index, fraction = int(math.floor(position)), position - math.floor(position)
+
+    cumulative = 0
+    lower = upper = None
+
+    for value, count in zip(values, counts):
+        cumulative += count
+        if lower is None and cumulative > lower_index:
+            lower = value
+        if cumulative > lower_index + 1 or (cumulative > lower_index and fraction == 0):
+            upper = value
+            break
+
+    upper = lower if upper is None else upper
+    return lower + (upper - lower) * fraction
+
+
+def build_report(partial, bins=20):
+    """
+    Builds the report of merged partial aggregates.
+
+    Returns:
+    dict: Report with rows, removed, incremental_rows, duplicate_item_ids, nulls, price (describe), outlier_bounds, brands, price_histogram and top_items.
+    """
+
+    price_table = sorted((float(value), count) for value, count in partial["prices"].items())
+    values = [value for value, _ in price_table]
+    counts = [count for _, count in price_table]
+    total = sum(counts)
+
+    report = {
+        "rows": partial["rows"],
+        "removed": partial["removed"],
+        "incremental_rows": partial["incremental_rows"],
+        "duplicate_item_ids": partial["duplicate_item_ids"],
+        "nulls": partial["nulls"],
+        "price": None,
+        "outlier_bounds": None,
+        "brands": {},
+        "price_histogram": [],
+        "top_items": [{"item_id": item_id, "brand": brand, "price": price} for price, item_id, brand in partial["top"]],
+    }
+
+    for brand, (count, price_count, price_sum, price_min, price_max) in sorted(partial["brands"].items(), key=lambda entry: -entry[1][0]):
+        report["brands"][brand] = {
+            "count": count,
+            "min": price_min,
+            "max": price_max,
+            "mean": round(price_sum / price_count, 2) if price_count else None,
+        }
+
+    if not total:
+        return report
+
+    price_sum = sum(value * count for value, count in price_table)
+    mean = price_sum / total
+    variance = (partial["price_sum_squares"] - total * mean * mean) / (total - 1) if total > 1 else 0.0
+
+    q1, median, q3 = (quantile(values, counts, total, q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+
+    report["price"] = {
+        "count": total,
+        "mean": mean,
+        "std": math.sqrt(max(variance, 0.0)),
+        "min": values[0],
+        "25%": q1,
+        "50%": median,
+        "75%": q3,
+        "max": values[-1],
+    }
+    report["outlier_bounds"] = [q1 - 1.5 * iqr, q3 + 1.5 * iqr]
+
+    # Equal width bins over the price range, like matplotlib's hist
+    width = (values[-1] - values[0]) / bins or 1.0
+    histogram = [0] * bins
+    for value, count in price_table:
+        histogram[min(int((value - values[0]) / width), bins - 1)] += count
+
+    report["price_histogram"] = [
+        {"start": values[0] + i * width, "end": values[0] + (i + 1) * width, "count": count}
+        for i, count in enumerate(histogram)
+    ]
+
+    return report
+
+
+def find_outliers(base_path, bounds, crawl_dates=None, store_numbers=None, categories=None):
+    """
+    Reads the items whose price is outside the outlier bounds. The price filter is pushed down to the Parquet scan.
+
+    Returns:
+    pyarrow.Table: item_id, brand and price of the outliers.
+    """
+
+    expression = (ds.field("price") < bounds[0]) | (ds.field("price") > bounds[1])
+
+    if crawl_dates:
+        expression &= ds.field("crawl_date").isin(list(crawl_dates))
+    if store_numbers:
+        expression &= ds.field("store_number").isin(list(store_numbers))
+    if categories:
+        # Items without a category are grouped under ""
+        category_filter = ds.field("category").isin([category for category in categories if category])
+        if "" in categories:
+            category_filter |= ds.field("category").is_null()
+        expression &= category_filter
+
+    dataset = ds.dataset(base_path, format="parquet", partitioning=PARTITIONING)
+    return dataset.to_table(columns=["item_id", "brand", "price"], filter=expression)
+
+
+def get_reports(base_path, cache_path=None, crawl_dates=None, store_numbers=None, by=None, bins=20):
+    """
+    Computes the reports of the selected partitions, as a whole or per group.
+
+    Parameters:
+    - base_path (str): Root folder of the Parquet dataset.
+    - cache_path (str): JSON file caching the partial aggregates of each partition, None to disable the cache.
+    - crawl_dates (list): Crawl dates ("YYYY-MM-DD") to include, or None for all.
+    - store_numbers (list): Store numbers to include, or None for all.
+    - by (str): "crawl_date", "store_number" or "category" to get a report per group, or None for a single report.
+    - bins (int): Number of bins of the price histogram.
+
+    Returns:
+    dict: {group: report}, with a single "all" group if `by` is None.
+    """
+
+    groups = {}
+
+    for (crawl_date, store_number), categories in load_partials(base_path, cache_path, crawl_dates, store_numbers).items():
+        for category, partial in categories.items():
+            group = {"crawl_date": crawl_date, "store_number": store_number, "category": category, None: "all"}[by]
+            groups.setdefault(group, []).append(partial)
+
+    return {group: build_report(merge_partials(partials), bins) for group, partials in sorted(groups.items())}
+
+
+def print_report(name, report):
+    print(f"===== {name} =====")
+    print(f"Rows: {report['rows']}")
+    if report["incremental_rows"] or report["removed"]:
+        print(f"Incremental recrawl rows (new or changed products only): {report['incremental_rows']} | Removed products: {report['removed']}")
+    print(f"Duplicate item_ids: {report['duplicate_item_ids']}")
+    print(f"Null values: {report['nulls']}")
+
+    price = report["price"]
+    if price is None:
+        print("No prices.")
+        return
+
+    print("\nPrice distribution:")
+    for key, value in price.items():
+        print(f"  {key:<6}{value:>12.2f}")
+
+    print(f"\nPrice range: ${price['min']} - ${price['max']}")
+    print(f"Outlier bounds (1.5 IQR): ${report['outlier_bounds'][0]:.2f} - ${report['outlier_bounds'][1]:.2f}")
+
+    print(f"\n{'brand':<40}{'count':>8}{'min':>10}{'max':>10}{'mean':>10}")
+    for brand, stats in report["brands"].items():
+        values = [f"{stats[key]:>10}" if stats[key] is not None else f"{'':>10}" for key in ("min", "max", "mean")]
+        print(f"{brand[:39]:<40}{stats['count']:>8}{''.join(values)}")
+
+    print("\nHistogram of prices:")
+    largest = max(bin["count"] for bin in report["price_histogram"]) or 1
+    for bin in report["price_histogram"]:
+        print(f"  {bin['start']:>9.2f} - {bin['end']:>9.2f} {bin['count']:>7} {'#' * round(40 * bin['count'] / largest)}")
+
+    print(f"\nTop {TOP_ITEMS} most expensive items:")
+    for item in report["top_items"]:
+        print(f"  {item['item_id']:<14}{item['brand'][:40]:<42}{item['price']:>10}")
+
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price analytics over the partitioned Parquet dataset.")
+    parser.add_argument("--path", default="data/lowes/parquet", help="Root folder of the Parquet dataset")
+    parser.add_argument("--cache", default="data/lowes/analytics_cache.json", help="Cache of the per partition aggregates, '' to disable")
+    parser.add_argument("--crawl-date", action="append", help="Crawl date to include (YYYY-MM-DD), can be repeated")
+    parser.add_argument("--store", action="append", help="Store number to include, can be repeated")
+    parser.add_argument("--by", choices=["crawl_date", "store_number", "category"], help="Report per crawl date, store or category")
+    parser.add_argument("--bins", type=int, default=20, help="Number of bins of the price histogram")
+    parser.add_argument("--outliers", action="store_true", help="List the price outliers of every report")
+    parser.add_argument("--json", action="store_true", help="Print the reports as JSON")
+    args = parser.parse_args()
+
+    reports = get_reports(args.path, args.cache or None, args.crawl_date, args.store, args.by, args.bins)
+
+    for name, report in reports.items():
+        if args.outliers and report["outlier_bounds"]:
+            filters = {args.by: [name]} if args.by else {}
+            outliers = find_outliers(
+                args.path,
+                report["outlier_bounds"],
+                crawl_dates=filters.get("crawl_date", args.crawl_date),
+                store_numbers=filters.get("store_number", args.store),
+                categories=filters.get("category"),
+            )
+            report["outliers"] = outliers.to_pylist()
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    for name, report in reports.items():
+        print_report(name, report)
+
+        if "outliers" in report:
+            print(f"Price outliers ({len(report['outliers'])}):")
+            for outlier in report["outliers"]:
+                print(f"  {outlier['item_id']:<14}{(outlier['brand'] or UNKNOWN_BRAND)[:40]:<42}{outlier['price']:>10}")
+            print()
+
+
+if __name__ == "__main__":
+    main()
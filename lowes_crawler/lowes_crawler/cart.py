@@ -0,0 +1,271 @@
+# Cart price resolution for products whose price is hidden in the cart
+#
+# Some products only show "View Lower Price In Cart" in their product details.
+# Their real price is resolved in a secondary stage that runs once the main
+# crawl is done, so that the expensive cart requests never slow it down:
+#
+#   add item 1 -> add item 2 -> ... -> view cart -> clear cart -> next batch
+#
+# Every cart session has its own cookie jar and dbidv2 cookie and is reused for
+# several batches. Sessions run concurrently with each other.
+
+import json
+import uuid
+
+import scrapy
+
+from .items import normalize_price
+from .request_types import CART
+
+# Keys under which cart lines are expected to hold the item id and the price
+CART_ITEM_ID_KEYS = ("omniItemId", "itemId", "itemNumber")
+CART_PRICE_KEYS = ("sellingPrice", "unitPrice", "price")
+
+
+def find_price(node):
+    """
+    Returns the first numeric price found in a cart line or its nested objects (e.g. a "pricing" object), or None.
+    """
+
+    queue = [node]
+
+    while queue:
+        current = queue.pop(0)
+
+        for key in CART_PRICE_KEYS:
+            value = current.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                return float(value)
+
+        queue.extend(value for value in current.values() if isinstance(value, dict))
+
+    return None
+
+
+def extract_cart_prices(data):
+    """
+    Finds the price of every item in a cart response.
+
+    The cart response is walked recursively, and every object that has an item id key and a numeric price
+    (directly or in a nested object) is considered a cart line.
+
+    Parameters:
+    - data (dict | list): Decoded JSON of the cart response.
+
+    Returns:
+    dict: {item_id (str): price (float)}
+    """
+
+    prices = {}
+    stack = [data]
+
+    while stack:
+        node = stack.pop()
+
+        if isinstance(node, dict):
+            item_id = next((node[key] for key in CART_ITEM_ID_KEYS if node.get(key)), None)
+            price = find_price(node) if item_id is not None else None
+
+            if price is not None:
+                prices.setdefault(str(item_id), price)
+            else:
+                stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+
+    return prices
+
+
+class CartPriceMixin:
+    """
+    Spider mixin that resolves the price of items with price_hidden_in_cart through the cart.
+
+    Released items go through the spider's emit_changed_item, so incremental recrawls compare them with their
+    stored state once their price is resolved.
+
+    Settings:
+    - CART_PRICE_ENABLED (bool): Hold items with a hidden price and resolve them at the end of the crawl.
+    - CART_BATCH_SIZE (int): Number of items added to a cart before it is viewed and cleared.
+    - CART_SESSIONS (int): Number of concurrent cart sessions per location.
+    - CART_ADD_URL, CART_VIEW_URL, CART_CLEAR_URL (str): Cart endpoints. The add request is a JSON POST of the
+      item id, quantity, store number and zip code. The clear request is a DELETE.
+    - CART_PRIORITY (int): Priority of cart requests.
+    """
+
+    def setup_cart(self, settings):
+        """
+        Reads the cart settings. Called from the spider's from_crawler.
+        """
+
+        self.cart_enabled = settings.getbool("CART_PRICE_ENABLED")
+        self.cart_batch_size = settings.getint("CART_BATCH_SIZE")
+        self.cart_sessions = settings.getint("CART_SESSIONS")
+        self.cart_add_url = settings.get("CART_ADD_URL")
+        self.cart_view_url = settings.get("CART_VIEW_URL")
+        self.cart_clear_url = settings.get("CART_CLEAR_URL")
+        self.cart_priority = settings.getint("CART_PRIORITY")
+
+        # Location key -> items held until their price is resolved
+        self.cart_pending = {}
+
+    def hold_for_cart(self, item, location):
+        """
+        Holds an item with a hidden price until the cart stage resolves it.
+
+        Returns:
+        bool: True if the item is held, False if cart price resolution is disabled.
+        """
+
+        if not self.cart_enabled:
+            return False
+
+        location_key = self.get_location_key(location)
+        self.cart_pending.setdefault(location_key, (location, []))[1].append(item)
+        self.crawler.stats.inc_value("cart/held_items")
+        return True
+
+    def start_cart_stage(self):
+        """
+        Schedules the first request of every cart session.
+
+        Returns:
+        bool: True if cart requests were scheduled, False if no items are held.
+        """
+
+        if not self.cart_pending:
+            return False
+
+        for location_key, (location, items) in self.cart_pending.items():
+            batches = [items[i:i + self.cart_batch_size] for i in range(0, len(items), self.cart_batch_size)]
+            session_count = min(self.cart_sessions, len(batches))
+
+            self.logger.info(f"Resolving {len(items)} cart prices for {location_key} in {session_count} cart sessions")
+
+            for n in range(session_count):
+                session = {
+                    "cookiejar": f"cart-{location_key}-{n}",
+                    "dbidv2": str(uuid.uuid4()),
+                    "location": location,
+                    "batches": batches[n::session_count],
+                    "step": 0,
+                }
+                self.crawler.engine.crawl(self.build_cart_add_request(session))
+
+        self.cart_pending = {}
+        return True
+
+    def build_cart_request(self, session, url, callback, method="GET", body=None):
+        """
+        Builds a request of a cart session, with its own cookies and cookie jar.
+        """
+
+        return scrapy.Request(
+            url,
+            method=method,
+            body=body,
+            headers={"Accept": "application/json", "Content-Type": "application/json"},
+            cookies={"dbidv2": session["dbidv2"], "sn": session["location"]["store_number"]},
+            callback=callback,
+            errback=self.handle_cart_error,
+            priority=self.cart_priority,
+            dont_filter=True,
+            meta={"cart_session": session, "cookiejar": session["cookiejar"], "request_type": CART},
+        )
+
+    def build_cart_add_request(self, session):
+        """
+        Builds the request adding the current item of the current batch of a session to its cart.
+        """
+
+        item = session["batches"][0][session["step"]]
+        body = json.dumps({
+            "itemId": item.item_id,
+            "quantity": 1,
+            "storeNumber": session["location"]["store_number"],
+            "zipCode": session["location"]["zip_code"],
+        })
+        return self.build_cart_request(session, self.cart_add_url, self.parse_cart_add, method="POST", body=body)
+
+    def parse_cart_add(self, response):
+        """
+        Adds the next item of the batch to the cart, or views the cart once the whole batch is in it.
+        """
+
+        session = response.meta["cart_session"]
+        session["step"] += 1
+
+        if session["step"] < len(session["batches"][0]):
+            yield self.build_cart_add_request(session)
+        else:
+            yield self.build_cart_request(session, self.cart_view_url, self.parse_cart_view)
+
+    def parse_cart_view(self, response):
+        """
+        Reads the prices of the batch from the cart, yields the items, and clears the cart.
+        """
+
+        session = response.meta["cart_session"]
+
+        try:
+            prices = extract_cart_prices(response.json())
+        except (ValueError, AttributeError):
+            self.logger.error(f"Unable to decode cart response for {session['cookiejar']}")
+            prices = {}
+
+        yield from self.release_cart_batch(session, prices)
+        yield self.build_cart_request(session, self.cart_clear_url, self.parse_cart_clear, method="DELETE")
+
+    def parse_cart_clear(self, response):
+        """
+        Starts the next batch of the session once its cart is cleared.
+        """
+
+        session = response.meta["cart_session"]
+        yield from self.next_cart_batch(session)
+
+    def handle_cart_error(self, failure):
+        """
+        Yields the items of a failed batch without a price and moves on to the next batch of the session.
+        """
+
+        session = failure.request.meta["cart_session"]
+        self.logger.error(f"Cart request failed for {session['cookiejar']}: {failure.value}")
+        self.crawler.stats.inc_value("cart/failed_requests")
+
+        if failure.request.callback == self.parse_cart_clear:
+            yield from self.next_cart_batch(session)
+            return
+
+        yield from self.release_cart_batch(session, {})
+        # Clear what may have been added before the failure
+        yield self.build_cart_request(session, self.cart_clear_url, self.parse_cart_clear, method="DELETE")
+
+    def release_cart_batch(self, session, prices):
+        """
+        Yields the items of the current batch, with the price found in the cart if any.
+        """
+
+        for item in session["batches"][0]:
+            price = prices.get(item.item_id)
+
+            if price is not None:
+                item.price = normalize_price(price)
+                self.crawler.stats.inc_value("cart/resolved_items")
+            else:
+                self.crawler.stats.inc_value("cart/unresolved_items")
+
+            yield from self.emit_changed_item(item, session["location"])
+
+        # The items were released, so a later failure of the session must not release them again
+        session["batches"][0] = []
+
+    def next_cart_batch(self, session):
+        """
+        Moves a session to its next batch and yields the request adding its first item.
+        """
+
+        session["batches"].pop(0)
+        session["step"] = 0
+
+        if session["batches"]:
+            yield self.build_cart_add_request(session)
@@ -0,0 +1,291 @@
+# Crawl checkpoints, to resume a long run where it stopped
+#
+# The frontier of the crawl is kept in a SQLite database in the checkpoint
+# folder: every listing/category page and every (item_id, store_number,
+# zip_code) product scheduled, and whether it was completed. Scraped items are
+# appended to an items.jl file in the same folder.
+#
+# Both are committed together every few seconds: the items file is flushed to
+# disk first and its size is stored with the completed keys. When a run is
+# resumed, the items file is truncated to that size, so items written after the
+# last checkpoint are dropped and their products requested again. Every item
+# ends up exactly once in items.jl, even after a crash.
+#
+# The spider arguments of the crawl (-a) are stored with the checkpoint, so a
+# resumed run crawls the same locations and start URLs.
+#
+# Products that can't be output (dropped by validation, failed extraction or
+# failed requests) are marked as failed, so resumed runs don't request them
+# again. Their failures are in the failure archive.
+
+import json
+import os
+import sqlite3
+import time
+
+from itemadapter import ItemAdapter
+
+
+def read_spider_args(folder):
+    """
+    Returns the spider arguments stored in the checkpoint of a folder, {} if there is no checkpoint or no arguments.
+    """
+
+    database_path = os.path.join(folder, "checkpoint.db")
+    if not os.path.exists(database_path):
+        return {}
+
+    connection = sqlite3.connect(database_path)
+    try:
+        row = connection.execute("SELECT value FROM checkpoint WHERE key = 'spider_args'").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # Checkpoint created before its crawl wrote anything
+    finally:
+        connection.close()
+
+    return json.loads(row[0]) if row else {}
+
+
+class CrawlCheckpoint:
+    """
+    Frontier of a crawl (pages and products, pending or completed) and its crash-safe item output.
+
+    Parameters:
+    - folder (str): Checkpoint folder, holding checkpoint.db and items.jl.
+    - interval (float): Minimum number of seconds between two checkpoints.
+    """
+
+    def __init__(self, folder, interval):
+        self.folder = folder
+        self.interval = interval
+        self.connection = None
+        self.items_file = None
+        self.last_checkpoint = time.monotonic()
+        self.commit_hooks = []  # Called after every checkpoint, e.g. to commit stores that must follow the checkpoint
+
+    @property
+    def items_path(self):
+        return os.path.join(self.folder, "items.jl")
+
+    def open(self, resume=False):
+        """
+        Opens the checkpoint, creating its folder and database if they don't exist.
+
+        Parameters:
+        - resume (bool): Continue the crawl of an existing checkpoint.
+
+        Raises:
+        ValueError: If a new crawl is started in the folder of an existing checkpoint, or if there is nothing to resume.
+        """
+
+        database_path = os.path.join(self.folder, "checkpoint.db")
+        exists = os.path.exists(database_path)
+
+        if resume and not exists:
+            raise ValueError(f"No checkpoint to resume in {self.folder}.")
+        if not resume and exists:
+            raise ValueError(f"A checkpoint already exists in {self.folder}. Resume it with `scrapy resume {self.folder}` or delete it.")
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self.connection = sqlite3.connect(database_path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                callback TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                meta TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS products (
+                item_id TEXT NOT NULL,
+                store_number TEXT NOT NULL,
+                zip_code TEXT NOT NULL,
+                category TEXT,
+                done INTEGER NOT NULL DEFAULT 0, -- 0: pending, 1: completed, 2: failed
+                PRIMARY KEY (item_id, store_number, zip_code)
+            );
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            """
+        )
+        self.connection.commit()
+
+        # Drop the items written after the last checkpoint, their products are still pending
+        items_size = int(self.get_value("items_size") or 0)
+        with open(self.items_path, "ab") as items_file:
+            items_file.truncate(items_size)
+
+        self.items_file = open(self.items_path, "ab")
+
+    def close(self):
+        """
+        Writes a last checkpoint and closes the checkpoint.
+        """
+
+        if self.connection is not None:
+            self.checkpoint()
+            self.items_file.close()
+            self.connection.close()
+            self.connection = None
+
+    def get_value(self, key):
+        row = self.connection.execute("SELECT value FROM checkpoint WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_spider_args(self, spider_args):
+        """
+        Stores the spider arguments of the crawl, to restore them when it is resumed (see read_spider_args).
+
+        Parameters:
+        - spider_args (dict): Spider arguments given with -a, e.g. {"locations": "0416:28278"}.
+        """
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checkpoint (key, value) VALUES ('spider_args', ?)",
+            (json.dumps(spider_args),),
+        )
+        self.connection.commit()
+
+    def checkpoint(self):
+        """
+        Flushes the items file to disk and commits the frontier with the size of the items file.
+        """
+
+        self.items_file.flush()
+        os.fsync(self.items_file.fileno())
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checkpoint (key, value) VALUES ('items_size', ?)",
+            (str(self.items_file.tell()),),
+        )
+        self.connection.commit()
+        self.last_checkpoint = time.monotonic()
+
+        for commit_hook in self.commit_hooks:
+            commit_hook()
+
+    def _written(self):
+        if time.monotonic() - self.last_checkpoint >= self.interval:
+            self.checkpoint()
+
+    def add_page(self, url, callback, priority, meta):
+        """
+        Records a scheduled listing or category page. Pages already recorded are left unchanged.
+
+        Parameters:
+        - url (str): URL of the page.
+        - callback (str): Name of the spider method parsing the page.
+        - priority (int): Priority of the request.
+        - meta (dict): JSON serializable request metadata needed to parse the page (category, depth, ...).
+        """
+
+        self.connection.execute(
+            "INSERT OR IGNORE INTO pages (url, callback, priority, meta) VALUES (?, ?, ?, ?)",
+            (url, callback, priority, json.dumps(meta)),
+        )
+        self._written()
+
+    def complete_page(self, url):
+        """
+        Marks a page as completed, once all the requests found in it were scheduled.
+        """
+
+        self.connection.execute("UPDATE pages SET done = 1 WHERE url = ?", (url,))
+        self._written()
+
+    def add_product(self, item_id, location, category=None):
+        """
+        Records a scheduled product at a location.
+
+        Returns:
+        bool: True if the product was not recorded yet, False if it was scheduled before (possibly in the run that is resumed).
+        """
+
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO products (item_id, store_number, zip_code, category) VALUES (?, ?, ?, ?)",
+            (item_id, location["store_number"], location["zip_code"], category),
+        )
+        self._written()
+        return cursor.rowcount == 1
+
+    def has_product(self, item_id, location):
+        """
+        Returns whether a product at a location was scheduled, in this run or in the run that is resumed.
+        """
+
+        cursor = self.connection.execute(
+            "SELECT 1 FROM products WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (item_id, location["store_number"], location["zip_code"]),
+        )
+        return cursor.fetchone() is not None
+
+    def complete_product(self, item_id, store_number, zip_code):
+        """
+        Marks a product at a location as completed, i.e. written to the items file or not needing output (unchanged).
+        """
+
+        self.connection.execute(
+            "UPDATE products SET done = 1 WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (item_id, store_number, zip_code),
+        )
+        self._written()
+
+    def fail_product(self, item_id, store_number, zip_code):
+        """
+        Marks a product at a location as failed, i.e. dropped or not extractable, so it isn't requested again when resuming.
+        """
+
+        self.connection.execute(
+            "UPDATE products SET done = 2 WHERE item_id = ? AND store_number = ? AND zip_code = ? AND done = 0",
+            (item_id, store_number, zip_code),
+        )
+        self._written()
+
+    def write_item(self, item):
+        """
+        Appends an item to the items file and marks its product as completed.
+        """
+
+        adapter = ItemAdapter(item)
+        self.items_file.write(json.dumps(adapter.asdict(), ensure_ascii=False).encode("utf-8") + b"\n")
+        self.complete_product(adapter.get("item_id"), adapter.get("store_number"), adapter.get("zip_code"))
+
+    def iter_pending_pages(self):
+        """
+        Yields the pages that were not completed, as (url, callback, priority, meta) tuples.
+        """
+
+        cursor = self.connection.execute("SELECT url, callback, priority, meta FROM pages WHERE done = 0")
+
+        for url, callback, priority, meta in cursor.fetchall():
+            yield url, callback, priority, json.loads(meta)
+
+    def iter_pending_products(self):
+        """
+        Yields the products that were not completed, grouped by location and category.
+
+        Yields:
+        tuple: (location dict, category, list of item IDs)
+        """
+
+        cursor = self.connection.execute(
+            "SELECT store_number, zip_code, category, item_id FROM products WHERE done = 0 ORDER BY store_number, zip_code, category"
+        )
+
+        group_key, item_ids = None, []
+
+        for store_number, zip_code, category, item_id in cursor.fetchall():
+            if (store_number, zip_code, category) != group_key:
+                if item_ids:
+                    yield {"store_number": group_key[0], "zip_code": group_key[1]}, group_key[2], item_ids
+                group_key, item_ids = (store_number, zip_code, category), []
+
+            item_ids.append(item_id)
+
+        if item_ids:
+            yield {"store_number": group_key[0], "zip_code": group_key[1]}, group_key[2], item_ids
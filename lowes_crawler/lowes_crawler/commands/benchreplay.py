@@ -0,0 +1,100 @@
+# Offline benchmark of the whole spider against a recorded replay archive
+#
+# Usage (from the lowes_crawler folder):
+#     scrapy crawl lowes -s REPLAY_MODE=record            # record an archive once
+#     scrapy benchreplay data/lowes/replay.db             # benchmark against it
+
+import resource
+import sys
+import tempfile
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+
+
+class Command(ScrapyCommand):
+    """
+    Runs a spider at maximum speed against a replay archive and reports its throughput.
+
+    Reports pages/sec, items/sec, peak RSS and the CPU time of each spider callback.
+    Network related middlewares (retries, proxies, adaptive concurrency, download delays, per-class download slots)
+    are disabled, and every output (feeds, Parquet dataset, price history, alerts, failures, category tree) is written
+    to a temporary folder, so a benchmark never touches the data of real crawls.
+    """
+
+    requires_project = True
+    default_settings = {"LOG_LEVEL": "WARNING"}
+
+    def syntax(self):
+        return "[options] <archive>"
+
+    def short_desc(self):
+        return "Benchmark the spider offline against a recorded replay archive"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--spider", default="lowes", help="name of the spider to benchmark (default: lowes)")
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+
+        if len(args) != 1:
+            raise UsageError("The replay archive is required.")
+
+        self.output_dir = tempfile.mkdtemp(prefix="benchreplay_")
+
+        self.settings.setdict({
+            "REPLAY_MODE": "replay",
+            "REPLAY_ARCHIVE": args[0],
+            "DOWNLOAD_DELAY": 0,
+            "RANDOMIZE_DOWNLOAD_DELAY": False,
+            "CONCURRENT_REQUESTS": 64,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": 64,
+            "ADAPTIVE_CONCURRENCY_ENABLED": False,
+            "PROXY_POOL_FILE": None,
+            "DOWNLOAD_SLOTS": {},
+            "RETRY_ENABLED": False,
+            "RETRY_DEFERRED_ENABLED": False,
+            "INCREMENTAL_ENABLED": False,
+            "HTTPCACHE_ENABLED": False,
+            "CHECKPOINT_DIR": None,
+            "SEEN_FILTER_PATH": None,
+            "FEEDS": {f"{self.output_dir}/%(name)s.json": {"format": "json"}},
+            "PARQUET_BASE_PATH": f"{self.output_dir}/parquet",
+            "PRICE_HISTORY_PATH": f"{self.output_dir}/price_history.db",
+            "ALERTS_PATH": f"{self.output_dir}/alerts.jl",
+            "FAILURES_DIR": f"{self.output_dir}/failures",
+            "DISCOVERY_CACHE_PATH": f"{self.output_dir}/category_tree.json",
+        }, priority="cmdline")
+
+    def run(self, args, opts):
+        crawler = self.crawler_process.create_crawler(opts.spider)
+        self.crawler_process.crawl(crawler)
+
+        started = time.perf_counter()
+        self.crawler_process.start()
+        elapsed = time.perf_counter() - started
+
+        stats = crawler.stats.get_stats()
+        pages = stats.get("response_received_count", 0)
+        items = stats.get("item_scraped_count", 0)
+
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+        print(f"Elapsed: {elapsed:.2f}s")
+        print(f"Pages: {pages} ({pages / elapsed:.1f} pages/sec)")
+        print(f"Items: {items} ({items / elapsed:.1f} items/sec)")
+        print(f"Missing from archive: {stats.get('replay/missing', 0)}")
+        print(f"Peak RSS: {peak_rss_mb:.1f} MB")
+
+        for key in sorted(stats):
+            if key.startswith("callback_cpu/"):
+                callback_name = key.split("/", 1)[1]
+                calls = stats.get(f"callback_calls/{callback_name}", 0)
+                per_call = stats[key] / calls * 1000 if calls else 0
+                print(f"CPU time in {callback_name}: {stats[key]:.3f}s ({calls} calls, {per_call:.2f} ms/call)")
+
+        print(f"Output: {self.output_dir}")
@@ -0,0 +1,48 @@
+# Resume a checkpointed crawl where it stopped
+#
+# Usage (from the lowes_crawler folder):
+#     scrapy crawl lowes -s CHECKPOINT_DIR=data/lowes/checkpoint     # start a checkpointed crawl
+#     scrapy resume data/lowes/checkpoint                            # continue it after a crash or a ban
+
+from scrapy.commands import BaseRunSpiderCommand
+from scrapy.exceptions import UsageError
+
+from ..checkpoint import read_spider_args
+
+
+class Command(BaseRunSpiderCommand):
+    """
+    Resumes the crawl of a checkpoint folder, requesting only the pages and products that were still pending.
+
+    Items are appended to the checkpoint's items.jl. The spider arguments of the crawl (-a) are restored from the
+    checkpoint, and arguments given to resume override them. Settings given with -s (e.g. DISCOVERY_ENABLED) should
+    match the ones of the crawl that is resumed.
+    """
+
+    requires_project = True
+
+    def syntax(self):
+        return "[options] <checkpoint_dir>"
+
+    def short_desc(self):
+        return "Resume a checkpointed crawl where it stopped"
+
+    def add_options(self, parser):
+        super().add_options(parser)
+        parser.add_argument("--spider", default="lowes", help="name of the spider to resume (default: lowes)")
+
+    def process_options(self, args, opts):
+        super().process_options(args, opts)
+
+        if len(args) != 1:
+            raise UsageError("The checkpoint folder is required.")
+
+        self.settings.setdict({
+            "CHECKPOINT_DIR": args[0],
+            "CHECKPOINT_RESUME": True,
+        }, priority="cmdline")
+
+    def run(self, args, opts):
+        spider_args = {**read_spider_args(args[0]), **opts.spargs}
+        self.crawler_process.crawl(opts.spider, **spider_args)
+        self.crawler_process.start()
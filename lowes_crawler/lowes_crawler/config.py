@@ -0,0 +1,199 @@
+# Crawl configuration: start URLs and locations to price
+#
+# The configuration is read from config.json in the project folder (next to
+# scrapy.cfg) wherever the crawl is started from, and validated once per
+# process. Values can be overridden for a single run, e.g. for one worker
+# process per location:
+#
+#     scrapy crawl lowes -a locations=0416:28278,1234:12345 -a start_urls=https://www.lowes.com/pl/...
+#     LOWES_LOCATIONS=0416:28278 scrapy crawl lowes
+#     scrapy crawl lowes -a config=other_config.json
+#
+# Command line arguments take precedence over environment variables, which take
+# precedence over the config file.
+
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_PATH = os.path.join(PROJECT_DIR, "config.json")
+DEFAULT_LOCATION = {"store_number": "0416", "zip_code": "28278"}
+
+# Environment variables overriding the config file
+CONFIG_ENV = "LOWES_CONFIG"
+START_URLS_ENV = "LOWES_START_URLS"
+LOCATIONS_ENV = "LOWES_LOCATIONS"
+
+_config_files = {}
+
+
+class ConfigError(ValueError):
+    """
+    Raised when the configuration is malformed.
+    """
+
+
+def read_config_file(path):
+    """
+    Reads and caches a config file, so it is only parsed once per process.
+
+    Raises:
+    ConfigError: If the file can't be read or is not a JSON object.
+    """
+
+    path = os.path.abspath(path)
+
+    if path not in _config_files:
+        try:
+            with open(path, "r") as file:
+                config = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ConfigError(f"Unable to read config file {path}: {e}")
+
+        if not isinstance(config, dict):
+            raise ConfigError(f"Config file {path} must contain a JSON object.")
+
+        _config_files[path] = config
+
+    return _config_files[path]
+
+
+def parse_location_list(value):
+    """
+    Parses locations given as "store_number:zip_code" pairs separated by commas (e.g. "0416:28278,1234:12345").
+    """
+
+    locations = []
+
+    for pair in value.split(","):
+        if not pair.strip():
+            continue
+        store_number, _, zip_code = pair.strip().partition(":")
+        locations.append({"store_number": store_number, "zip_code": zip_code})
+
+    return locations
+
+
+def parse_url_list(value):
+    """
+    Parses URLs separated by commas, or a JSON list of URLs.
+    """
+
+    if isinstance(value, list):
+        return value
+    if value.strip().startswith("["):
+        return json.loads(value)
+    return [url.strip() for url in value.split(",") if url.strip()]
+
+
+def validate_locations(raw_locations):
+    """
+    Validates the locations to crawl.
+
+    Parameters:
+    - raw_locations (list): Location dicts with "store_number" and "zip_code" keys.
+
+    Returns:
+    list: Unique location dicts with "store_number" and "zip_code" keys, in config order.
+          Invalid entries are skipped, and the default location is used if none are valid.
+    """
+
+    locations = []
+    seen = set()
+
+    for raw_location in raw_locations:
+        if not isinstance(raw_location, dict):
+            logger.warning(f"Invalid location: {raw_location!r}. Skipping location.")
+            continue
+
+        store_number = str(raw_location.get("store_number") or "")
+        zip_code = str(raw_location.get("zip_code") or "")
+
+        if not store_number.isdigit() or len(store_number) != 4:
+            logger.warning(f"Invalid store number format: {store_number!r}. Skipping location.")
+            continue
+
+        if not zip_code.isdigit() or len(zip_code) != 5:
+            logger.warning(f"Invalid zip code format: {zip_code!r}. Skipping location.")
+            continue
+
+        if (store_number, zip_code) in seen:
+            continue
+
+        seen.add((store_number, zip_code))
+        locations.append({"store_number": store_number, "zip_code": zip_code})
+
+    if not locations:
+        logger.warning("No valid locations found in config. Using default.")
+        locations.append(dict(DEFAULT_LOCATION))
+
+    return locations
+
+
+def load_config(config_path=None, start_urls=None, locations=None, environ=None):
+    """
+    Loads and validates the crawl configuration, with the overrides of a run.
+
+    Parameters:
+    - config_path (str): Path of the config file. Defaults to $LOWES_CONFIG, then to config.json in the project folder.
+    - start_urls (str | list): Start URLs overriding the config file (comma separated or JSON list).
+    - locations (str): Locations overriding the config file, as "store_number:zip_code" pairs separated by commas.
+    - environ (dict): Environment variables, os.environ by default.
+
+    Returns:
+    dict: {"start_urls": list of str, "locations": list of location dicts}
+
+    Raises:
+    ConfigError: If the config file is malformed or the start URLs are not a list of URLs.
+
+    Notes:
+    - A single top-level store_number/zip_code pair is still accepted for older config files.
+    - The config file is optional when both the start URLs and the locations are overridden.
+    """
+
+    environ = os.environ if environ is None else environ
+
+    start_urls = start_urls or environ.get(START_URLS_ENV)
+    locations = locations or environ.get(LOCATIONS_ENV)
+    config_path = config_path or environ.get(CONFIG_ENV) or DEFAULT_CONFIG_PATH
+
+    if start_urls and locations and not os.path.exists(config_path):
+        config = {}
+    else:
+        config = read_config_file(config_path)
+
+    raw_start_urls = parse_url_list(start_urls) if start_urls else (config.get("start_urls") or [])
+    if not isinstance(raw_start_urls, list) or not all(isinstance(url, str) and url.startswith("http") for url in raw_start_urls):
+        raise ConfigError(f"start_urls must be a list of URLs, got {raw_start_urls!r}")
+
+    if locations:
+        raw_locations = parse_location_list(locations)
+    else:
+        raw_locations = config.get("locations")
+        if not raw_locations:
+            # Older config files only have a single store number and zip code
+            raw_locations = [{"store_number": config.get("store_number"), "zip_code": config.get("zip_code")}]
+
+    if not isinstance(raw_locations, list):
+        raise ConfigError(f"locations must be a list, got {raw_locations!r}")
+
+    return {"start_urls": raw_start_urls, "locations": validate_locations(raw_locations)}
+
+
+def feed_uri_params(params, spider):
+    """
+    FEED_URI_PARAMS function resolving the feed path parameters when the spider opens.
+
+    Adds:
+    - timestamp: Start time of the run, e.g. "2024-11-21_08-04-41".
+    - locations: Locations of the run, e.g. "0416-28278" or "0416-28278_1234-12345".
+    """
+
+    return {
+        **params,
+        "timestamp": spider.started_at.strftime("%Y-%m-%d_%H-%M-%S"),
+        "locations": "_".join(spider.get_location_key(location) for location in spider.locations),
+    }
@@ -0,0 +1,106 @@
+# Category tree discovery for whole-catalog crawls
+#
+# Starting from the department navigation, category pages (/c/... and /pl/...)
+# are walked breadth-first. A page that lists products is a leaf listing page
+# and is handed over to the spider's parse pagination. Other pages are category
+# nodes, whose links are followed up to a maximum depth.
+#
+# The discovered tree is cached in a JSON file, so following runs go straight to
+# the cached leaf listing pages and only re-walk nodes older than the cache TTL.
+
+from urllib.parse import urlparse
+import json
+import os
+import time
+
+CATEGORY_PATH_PREFIXES = ("/c/", "/pl/")
+
+
+def canonicalize_category_url(url):
+    """
+    Returns a category URL without its query string and fragment, or None if the URL is not a Lowe's category page.
+    """
+
+    parsed_url = urlparse(url)
+
+    if not parsed_url.netloc.endswith("lowes.com") or not parsed_url.path.startswith(CATEGORY_PATH_PREFIXES):
+        return None
+
+    return parsed_url._replace(scheme="https", query="", fragment="").geturl()
+
+
+def extract_category_links(response):
+    """
+    Extracts the unique category page links of a page, in page order.
+
+    Parameters:
+    - response (scrapy.http.Response): Response object for a category page.
+
+    Returns:
+    list: Canonical URLs of the linked category pages.
+    """
+
+    links = []
+    seen = set()
+
+    for href in response.css("a::attr(href)").getall():
+        url = canonicalize_category_url(response.urljoin(href))
+
+        if url and url not in seen and url != canonicalize_category_url(response.url):
+            seen.add(url)
+            links.append(url)
+
+    return links
+
+
+def get_category(url):
+    """
+    Returns the category of a listing page URL, i.e. its path (e.g. "/pl/fall-decorations/fall-wreaths-garland/1614047588").
+    """
+
+    return urlparse(url).path
+
+
+class CategoryTreeCache:
+    """
+    JSON cache of the category tree, keyed by canonical category URL.
+
+    Each node holds whether it is a leaf listing page, the URLs of its child categories, and when it was fetched.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.nodes = {}
+
+    def load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                self.nodes = json.load(file)
+
+    def save(self):
+        if not self.path:
+            return
+
+        folder_path = os.path.dirname(self.path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.nodes, file)
+
+        os.replace(temp_path, self.path)
+
+    def get_fresh(self, url):
+        """
+        Returns the cached node of a category URL, or None if it is not cached or older than the TTL.
+        """
+
+        node = self.nodes.get(url)
+        if node is None or time.time() - node["fetched_at"] > self.ttl:
+            return None
+        return node
+
+    def set_node(self, url, leaf, children=()):
+        self.nodes[url] = {"leaf": leaf, "children": list(children), "fetched_at": time.time()}
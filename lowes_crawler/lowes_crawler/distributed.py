@@ -0,0 +1,233 @@
+# Shared request queue for distributed crawls
+#
+# Several `scrapy crawl lowes` worker processes, on one or several machines,
+# share a single request queue and dupefilter. Every worker pushes the requests
+# its callbacks yield to the shared queue and pulls the next request from it,
+# so listing pages and product details are spread over all workers.
+#
+#     scrapy crawl lowes -s SCHEDULER=lowes_crawler.distributed.SharedQueueScheduler \
+#                        -s SHARED_QUEUE_URL=sqlite:///data/lowes/queue.db
+#
+# The backend is chosen by the scheme of SHARED_QUEUE_URL:
+# - sqlite:///path/to/queue.db - a file-backed queue, for workers on a single machine
+# - redis://host:port/db - a Redis server, for workers on several machines (requires the redis package)
+
+from collections import deque
+from urllib.parse import urlparse
+import os
+import pickle
+import sqlite3
+import time
+
+from scrapy.core.scheduler import BaseScheduler
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+
+
+def is_distributed(settings):
+    """
+    Returns whether the crawl uses the shared queue scheduler, i.e. whether other workers share its requests.
+    """
+
+    scheduler = settings.get("SCHEDULER")
+    if isinstance(scheduler, str):
+        scheduler = load_object(scheduler)
+    # BaseScheduler's metaclass makes issubclass() true for any class with the scheduler methods, so the MRO is checked instead
+    return isinstance(scheduler, type) and SharedQueueScheduler in scheduler.__mro__
+
+
+class SQLiteQueueBackend:
+    """
+    Priority queue and fingerprint set stored in a SQLite database, shared by the processes of a machine.
+    """
+
+    def __init__(self, path):
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS queue (id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER, data BLOB)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS queue_order ON queue (priority DESC, id)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fingerprints (fingerprint TEXT PRIMARY KEY)")
+
+    def add_fingerprint(self, fingerprint):
+        """
+        Adds a request fingerprint. Returns True if it was not seen before by any worker.
+        """
+
+        cursor = self.connection.execute("INSERT OR IGNORE INTO fingerprints (fingerprint) VALUES (?)", (fingerprint,))
+        return cursor.rowcount == 1
+
+    def push(self, priority, data):
+        self.connection.execute("INSERT INTO queue (priority, data) VALUES (?, ?)", (priority, data))
+
+    def pop(self):
+        """
+        Removes and returns the data of the highest priority request, or None if the queue is empty.
+        """
+
+        # The write lock is taken before reading so that two workers never pop the same request
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.connection.execute("SELECT id, data FROM queue ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row is not None:
+                self.connection.execute("DELETE FROM queue WHERE id = ?", (row[0],))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+        return row[1] if row is not None else None
+
+    def has_requests(self):
+        return self.connection.execute("SELECT EXISTS (SELECT 1 FROM queue)").fetchone()[0] == 1
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class RedisQueueBackend:
+    """
+    Priority queue (sorted set) and fingerprint set stored in Redis, shared by workers on several machines.
+    """
+
+    def __init__(self, url, key_prefix):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis package is required for redis:// shared queues. Install it with: pip3 install redis")
+
+        self.client = redis.Redis.from_url(url)
+        self.queue_key = f"{key_prefix}:queue"
+        self.counter_key = f"{key_prefix}:counter"
+        self.fingerprints_key = f"{key_prefix}:fingerprints"
+
+    def add_fingerprint(self, fingerprint):
+        return self.client.sadd(self.fingerprints_key, fingerprint) == 1
+
+    def push(self, priority, data):
+        # The counter makes members unique and keeps FIFO order within a priority
+        sequence = self.client.incr(self.counter_key)
+        score = -priority * 1e12 + sequence
+        self.client.zadd(self.queue_key, {sequence.to_bytes(8, "big") + data: score})
+
+    def pop(self):
+        popped = self.client.zpopmin(self.queue_key)
+        if not popped:
+            return None
+        member, _ = popped[0]
+        return member[8:]
+
+    def has_requests(self):
+        return self.client.exists(self.queue_key) == 1
+
+    def __len__(self):
+        return self.client.zcard(self.queue_key)
+
+    def close(self):
+        self.client.close()
+
+
+def open_backend(url, key_prefix):
+    """
+    Opens the shared queue backend for a SHARED_QUEUE_URL.
+    """
+
+    parsed_url = urlparse(url)
+
+    if parsed_url.scheme == "sqlite":
+        # sqlite:///relative/path.db or sqlite:////absolute/path.db
+        return SQLiteQueueBackend(url[len("sqlite:///"):])
+    if parsed_url.scheme in ("redis", "rediss"):
+        return RedisQueueBackend(url, key_prefix)
+
+    raise ValueError(f"Unsupported SHARED_QUEUE_URL: {url}. Use sqlite:///path or redis://host:port/db.")
+
+
+class SharedQueueScheduler(BaseScheduler):
+    """
+    Scheduler that stores requests in a queue and dupefilter shared by all worker processes.
+
+    Settings:
+    - SHARED_QUEUE_URL (str): Backend of the shared queue (see module documentation).
+    - SHARED_QUEUE_IDLE_TIMEOUT (float): Seconds a worker keeps polling an empty queue before closing,
+      since other workers may still be adding requests to it.
+
+    Notes:
+    - Requests that are not HTTP (e.g. data: requests used internally by the spider) are kept in a local queue,
+      because they rely on the state of the worker that created them.
+    - Request callbacks must be spider methods, so that requests can be serialized.
+    - Each worker only knows the items it crawled itself, so removed items detection (tombstones) and cart price
+      resolution, which hold per worker state, are disabled by the spider in distributed crawls.
+    """
+
+    def __init__(self, crawler, url, idle_timeout):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.url = url
+        self.key_prefix = f"lowes:{crawler.spidercls.name}"
+        self.idle_timeout = idle_timeout
+
+        self.backend = None
+        self.local_queue = deque()
+        self.spider = None
+        self.last_activity = time.time()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler,
+            url=crawler.settings.get("SHARED_QUEUE_URL"),
+            idle_timeout=crawler.settings.getfloat("SHARED_QUEUE_IDLE_TIMEOUT"),
+        )
+
+    def open(self, spider):
+        self.spider = spider
+        self.backend = open_backend(self.url, self.key_prefix)
+        spider.logger.info(f"Using shared request queue: {self.url} ({len(self.backend)} pending requests)")
+
+    def close(self, reason):
+        if self.backend is not None:
+            self.backend.close()
+
+    def has_pending_requests(self):
+        if self.local_queue or self.backend.has_requests():
+            self.last_activity = time.time()
+            return True
+
+        # Other workers may still add requests, so keep polling for a while before letting the spider close
+        return time.time() - self.last_activity < self.idle_timeout
+
+    def enqueue_request(self, request):
+        if not request.url.startswith("http"):
+            self.local_queue.append(request)
+            return True
+
+        if not request.dont_filter:
+            fingerprint = self.crawler.request_fingerprinter.fingerprint(request).hex()
+
+            if not self.backend.add_fingerprint(fingerprint):
+                self.stats.inc_value("dupefilter/filtered")
+                return False
+
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        self.backend.push(request.priority, data)
+        self.stats.inc_value("scheduler/enqueued/shared")
+        return True
+
+    def next_request(self):
+        if self.local_queue:
+            return self.local_queue.popleft()
+
+        data = self.backend.pop()
+        if data is None:
+            return None
+
+        self.last_activity = time.time()
+        self.stats.inc_value("scheduler/dequeued/shared")
+        return request_from_dict(pickle.loads(data), spider=self.spider)
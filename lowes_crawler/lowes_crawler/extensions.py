@@ -0,0 +1,245 @@
+# Define here your extensions
+#
+# Don't forget to add your extension to the EXTENSIONS setting
+# See: https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from bisect import bisect_left
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from .request_types import get_request_type
+
+
+class LatencyHistogram:
+    """
+    Cumulative histogram of download latencies, in seconds.
+    """
+
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)  # Last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """
+        Returns the (upper bound, cumulative count) of every bucket, ending with ("+Inf", count).
+        """
+
+        total = 0
+        buckets = []
+        for bound, count in zip(self.BUCKETS + ("+Inf",), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+    def quantile(self, q):
+        """
+        Estimates a quantile as the upper bound of the bucket it falls in.
+        """
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        for bound, total in self.cumulative_counts():
+            if total >= rank:
+                return bound
+        return "+Inf"
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {str(bound): total for bound, total in self.cumulative_counts()},
+        }
+
+
+class MetricsResource(Resource):
+    """
+    Serves the crawl metrics in the Prometheus text format.
+    """
+
+    isLeaf = True
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4; charset=utf-8")
+        return self.metrics.render_prometheus().encode("utf-8")
+
+
+class CrawlMetrics:
+    """
+    Collects metrics on where the crawl time goes, per request type (listing vs product detail).
+
+    - Download latency histograms and response counts per status, per request type.
+    - CPU time per spider callback (from CallbackTimingMiddleware).
+    - Retry counts per reason (from the retry middleware).
+    - Items scraped and items/sec, overall and over the last interval.
+
+    Metrics are stored in the Scrapy stats under metrics/ as they are collected, served in the Prometheus text format on
+    http://127.0.0.1:<METRICS_PORT>/metrics while the crawl runs, and logged as a summary when the spider closes.
+
+    Settings:
+    - METRICS_ENABLED (bool): Enables the extension.
+    - METRICS_PORT (int): Port of the metrics endpoint, or 0 to disable it.
+    - METRICS_INTERVAL (float): Seconds between updates of the items/sec rate.
+    """
+
+    def __init__(self, crawler):
+        self.stats = crawler.stats
+        self.port = crawler.settings.getint("METRICS_PORT")
+        self.interval = crawler.settings.getfloat("METRICS_INTERVAL")
+
+        self.histograms = {}  # Request type -> LatencyHistogram
+        self.responses = {}  # (request type, status) -> count
+        self.items = 0
+        self.started = None
+        self.items_per_sec = 0.0
+
+        self.rate_items = 0
+        self.rate_task = None
+        self.listening_port = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+
+        ext = cls(crawler)
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        return ext
+
+    def spider_opened(self, spider):
+        self.started = time.time()
+
+        self.rate_task = task.LoopingCall(self.update_rate)
+        self.rate_task.start(self.interval, now=False)
+
+        if self.port:
+            from twisted.internet import reactor
+
+            self.listening_port = reactor.listenTCP(self.port, Site(MetricsResource(self)), interface="127.0.0.1")
+            spider.logger.info(f"Metrics available on http://127.0.0.1:{self.port}/metrics")
+
+    def response_received(self, response, request, spider):
+        request_type = get_request_type(request)
+
+        key = (request_type, response.status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+        self.stats.inc_value(f"metrics/responses/{request_type}/{response.status}")
+
+        latency = request.meta.get("download_latency")
+        if latency is not None and "cached" not in response.flags:
+            histogram = self.histograms.setdefault(request_type, LatencyHistogram())
+            histogram.observe(latency)
+            self.stats.set_value(f"metrics/latency/{request_type}", histogram.to_dict())
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+
+    def update_rate(self):
+        """
+        Updates the items/sec rate over the last interval.
+        """
+
+        self.items_per_sec = (self.items - self.rate_items) / self.interval
+        self.rate_items = self.items
+        self.stats.set_value("metrics/items_per_sec", round(self.items_per_sec, 2))
+
+    def get_callback_cpu(self):
+        """
+        Returns {callback name: (CPU seconds, calls)} from the stats of CallbackTimingMiddleware.
+        """
+
+        stats = self.stats.get_stats()
+        return {
+            key.split("/", 1)[1]: (value, stats.get(f"callback_calls/{key.split('/', 1)[1]}", 0))
+            for key, value in stats.items()
+            if key.startswith("callback_cpu/")
+        }
+
+    def get_retries(self):
+        """
+        Returns {reason: count} from the stats of the retry middleware (e.g. "403 Forbidden").
+        """
+
+        return {
+            key[len("retry/reason_count/"):]: value
+            for key, value in self.stats.get_stats().items()
+            if key.startswith("retry/reason_count/")
+        }
+
+    def render_prometheus(self):
+        """
+        Renders the current metrics in the Prometheus text exposition format.
+        """
+
+        lines = ["# TYPE lowes_request_latency_seconds histogram"]
+        for request_type, histogram in sorted(self.histograms.items()):
+            for bound, total in histogram.cumulative_counts():
+                lines.append(f'lowes_request_latency_seconds_bucket{{request_type="{request_type}",le="{bound}"}} {total}')
+            lines.append(f'lowes_request_latency_seconds_sum{{request_type="{request_type}"}} {histogram.sum}')
+            lines.append(f'lowes_request_latency_seconds_count{{request_type="{request_type}"}} {histogram.count}')
+
+        lines.append("# TYPE lowes_responses_total counter")
+        for (request_type, status), count in sorted(self.responses.items()):
+            lines.append(f'lowes_responses_total{{request_type="{request_type}",status="{status}"}} {count}')
+
+        lines.append("# TYPE lowes_callback_cpu_seconds_total counter")
+        for callback_name, (cpu, _) in sorted(self.get_callback_cpu().items()):
+            lines.append(f'lowes_callback_cpu_seconds_total{{callback="{callback_name}"}} {cpu}')
+
+        lines.append("# TYPE lowes_retries_total counter")
+        for reason, count in sorted(self.get_retries().items()):
+            lines.append(f'lowes_retries_total{{reason="{reason}"}} {count}')
+
+        lines.append("# TYPE lowes_items_scraped_total counter")
+        lines.append(f"lowes_items_scraped_total {self.items}")
+        lines.append("# TYPE lowes_items_per_second gauge")
+        lines.append(f"lowes_items_per_second {self.items_per_sec}")
+
+        return "\n".join(lines) + "\n"
+
+    def spider_closed(self, spider, reason):
+        if self.rate_task and self.rate_task.running:
+            self.rate_task.stop()
+
+        if self.listening_port:
+            self.listening_port.stopListening()
+
+        elapsed = time.time() - self.started if self.started else 0
+        overall_items_per_sec = self.items / elapsed if elapsed else 0
+
+        self.stats.set_value("metrics/items_per_sec", round(overall_items_per_sec, 2))
+
+        # Final summary
+        lines = [f"Crawl metrics summary ({elapsed:.0f}s, {self.items} items, {overall_items_per_sec:.2f} items/sec):"]
+        for request_type, histogram in sorted(self.histograms.items()):
+            mean = histogram.sum / histogram.count
+            lines.append(f"  {request_type}: {histogram.count} downloads | mean {mean:.2f}s | p50 <= {histogram.quantile(0.5)}s | p95 <= {histogram.quantile(0.95)}s")
+        for callback_name, (cpu, calls) in sorted(self.get_callback_cpu().items()):
+            lines.append(f"  {callback_name}: {cpu:.2f}s CPU over {calls} responses")
+        for reason, count in sorted(self.get_retries().items()):
+            lines.append(f"  retries ({reason}): {count}")
+
+        spider.logger.info("\n".join(lines))
@@ -0,0 +1,213 @@
+# Archive of failure artifacts (failed URLs, listing page HTML, product data)
+#
+# Failures are handed to a background thread through a bounded queue, so the
+# crawl loop never blocks on disk. The thread appends every failure as its own
+# gzip member to the current archive file, and records where it is in a JSON
+# lines index next to it:
+#
+#     failures/failures-00001.gz          concatenated gzip members
+#     failures/failures-00001.index.jl    {"kind", "key", "time", "offset", "length"} per failure
+#
+# Archives are rotated once they reach a maximum size, and the oldest ones are
+# deleted to keep a maximum number of archives. A failure can be read back on
+# its own with read_failure, or the whole archive with `zcat`.
+
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+
+ARCHIVE_PREFIX = "failures-"
+INDEX_SUFFIX = ".index.jl"
+
+# Kinds of failure artifacts
+FAILED_URL = "url"
+FAILED_HTML = "html"
+FAILED_PRODUCT_DATA = "product_data"
+
+
+class FailureArchive:
+    """
+    Background writer of failure artifacts into rotating, size-capped gzip archives with an index.
+
+    Parameters:
+    - folder (str): Folder of the archives.
+    - max_file_size (int): Size in bytes after which a new archive is started.
+    - max_files (int): Number of archives kept, the oldest ones are deleted.
+    - queue_size (int): Number of failures buffered for the writer thread. Failures are dropped (and counted) when it is full.
+    """
+
+    def __init__(self, folder, max_file_size, max_files, queue_size):
+        self.folder = folder
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.dropped = 0
+        self.written = 0
+
+        self.archive_file = None
+        self.index_file = None
+
+    def start(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self.thread = threading.Thread(target=self._run, name="FailureArchive", daemon=True)
+        self.thread.start()
+
+    def close(self, timeout=30.0):
+        """
+        Writes the buffered failures and stops the writer thread.
+
+        Parameters:
+        - timeout (float): Maximum number of seconds to wait for the writer thread, so a dead or stuck writer can't hang shutdown.
+
+        Returns:
+        bool: True if the writer thread stopped, False if it died or didn't finish within the timeout (the failures still
+        buffered are lost).
+        """
+
+        if self.thread is None:
+            return True
+
+        thread, self.thread = self.thread, None
+
+        if not thread.is_alive():
+            return False
+
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return False
+
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def put(self, kind, key, data):
+        """
+        Queues a failure artifact for writing. Never blocks.
+
+        Parameters:
+        - kind (str): Kind of artifact (FAILED_URL, FAILED_HTML or FAILED_PRODUCT_DATA).
+        - key (str): What failed, e.g. the URL or the item ID.
+        - data (bytes): Content of the artifact.
+
+        Returns:
+        bool: True if the failure was queued, False if it was dropped because the writer is behind.
+        """
+
+        try:
+            self.queue.put_nowait((kind, key, time.time(), data))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        stopping = False
+
+        while not stopping:
+            records = [self.queue.get()]
+
+            # Write everything that is already buffered in one go, with a single flush
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in records:
+                stopping = True
+                records = [record for record in records if record is not None]
+
+            for record in records:
+                self._write(*record)
+
+            if self.archive_file is not None:
+                self.archive_file.flush()
+                self.index_file.flush()
+
+        if self.archive_file is not None:
+            self.archive_file.close()
+            self.index_file.close()
+
+    def _write(self, kind, key, timestamp, data):
+        if self.archive_file is None or self.archive_file.tell() >= self.max_file_size:
+            self._rotate()
+
+        member = gzip.compress(data, compresslevel=6, mtime=0)
+        offset = self.archive_file.tell()
+        self.archive_file.write(member)
+
+        self.index_file.write(json.dumps({"kind": kind, "key": key, "time": timestamp, "offset": offset, "length": len(member)}) + "\n")
+        self.written += 1
+
+    def _rotate(self):
+        if self.archive_file is not None:
+            self.archive_file.close()
+            self.index_file.close()
+
+        archive_paths = list_archives(self.folder)
+        number = int(os.path.basename(archive_paths[-1])[len(ARCHIVE_PREFIX):-3]) + 1 if archive_paths else 1
+
+        # Keep max_files archives, including the new one
+        for archive_path in archive_paths[:max(0, len(archive_paths) - self.max_files + 1)]:
+            os.remove(archive_path)
+            if os.path.exists(archive_path[:-3] + INDEX_SUFFIX):
+                os.remove(archive_path[:-3] + INDEX_SUFFIX)
+
+        archive_path = os.path.join(self.folder, f"{ARCHIVE_PREFIX}{number:05d}.gz")
+        self.archive_file = open(archive_path, "ab")
+        self.index_file = open(archive_path[:-3] + INDEX_SUFFIX, "a")
+
+
+def list_archives(folder):
+    """
+    Returns the paths of the archives of a folder, oldest first.
+    """
+
+    if not os.path.isdir(folder):
+        return []
+
+    names = sorted(name for name in os.listdir(folder) if name.startswith(ARCHIVE_PREFIX) and name.endswith(".gz"))
+    return [os.path.join(folder, name) for name in names]
+
+
+def iter_failures(folder, kind=None):
+    """
+    Yields the failures stored in the archives of a folder, oldest first.
+
+    Parameters:
+    - folder (str): Folder of the archives.
+    - kind (str): Only yield failures of this kind.
+
+    Yields:
+    tuple: (index entry dict, data bytes)
+    """
+
+    for archive_path in list_archives(folder):
+        index_path = archive_path[:-3] + INDEX_SUFFIX
+        if not os.path.exists(index_path):
+            continue
+
+        with open(index_path, "r") as index_file, open(archive_path, "rb") as archive_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Incomplete last line of an interrupted run
+
+                if kind is None or entry["kind"] == kind:
+                    yield entry, read_failure(archive_file, entry)
+
+
+def read_failure(archive_file, entry):
+    """
+    Reads the data of a single failure from an open archive file, using its index entry.
+    """
+
+    archive_file.seek(entry["offset"])
+    return gzip.decompress(archive_file.read(entry["length"]))
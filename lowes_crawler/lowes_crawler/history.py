@@ -0,0 +1,278 @@
+# Price history of every item at every location, across runs
+#
+# Only change points are stored: a row is added when the price of an
+# (item_id, store_number, zip_code) differs from its previous price, so daily
+# runs of an unchanged catalog add nothing. The latest price of every key is
+# kept in a separate table, so change detection is a single primary key lookup.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m lowes_crawler.history ingest data/lowes/*.json           # backfill from feed files, oldest first
+#     python -m lowes_crawler.history item 1000123456                    # price history across all stores
+#     python -m lowes_crawler.history drops --days 7 --min-drop 0.1      # items whose price dropped by 10% or more this week
+
+from datetime import datetime, timedelta
+import argparse
+import json
+import os
+import sqlite3
+
+
+class PriceHistoryStore:
+    """
+    SQLite store of the price change points of each item at each location.
+
+    Parameters:
+    - path (str): Path of the database, created with its folder if it doesn't exist.
+    """
+
+    COMMIT_INTERVAL = 1000  # Number of writes between commits
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.pending_writes = 0
+
+    def open(self):
+        folder_path = os.path.dirname(self.path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.connection = sqlite3.connect(self.path)
+        # WAL lets the alerts pipeline read previous prices while the history pipeline has pending writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS price_changes (
+                item_id TEXT NOT NULL,
+                store_number TEXT NOT NULL,
+                zip_code TEXT NOT NULL,
+                date TEXT NOT NULL,
+                price REAL,
+                price_hidden_in_cart INTEGER,
+                PRIMARY KEY (item_id, store_number, zip_code, date)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS price_changes_date ON price_changes (date);
+            CREATE TABLE IF NOT EXISTS latest_prices (
+                item_id TEXT NOT NULL,
+                store_number TEXT NOT NULL,
+                zip_code TEXT NOT NULL,
+                date TEXT NOT NULL,
+                price REAL,
+                price_hidden_in_cart INTEGER,
+                last_seen TEXT NOT NULL,
+                PRIMARY KEY (item_id, store_number, zip_code)
+            ) WITHOUT ROWID;
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _written(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.COMMIT_INTERVAL:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def add(self, item_id, store_number, zip_code, date, price, price_hidden_in_cart=None):
+        """
+        Adds an observed price, storing a change point only if it differs from the latest price of the key.
+
+        Parameters:
+        - item_id (str): omniItemId of the product.
+        - store_number (str): Store number of the location.
+        - zip_code (str): Zip code of the location.
+        - date (str): ISO 8601 date the price was observed at.
+        - price (float): Observed price, None if unknown.
+        - price_hidden_in_cart (bool): Whether the price is hidden in the cart.
+
+        Returns:
+        bool: True if a change point was stored, False if the price didn't change or the observation is older than the latest one.
+        """
+
+        key = (item_id, store_number, zip_code)
+        hidden = None if price_hidden_in_cart is None else int(bool(price_hidden_in_cart))
+
+        latest = self.connection.execute(
+            "SELECT date, price, price_hidden_in_cart FROM latest_prices WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            key,
+        ).fetchone()
+
+        if latest is not None:
+            latest_date, latest_price, latest_hidden = latest
+
+            # Observations are expected in chronological order, older ones can't be placed without rewriting the change points
+            if date < latest_date:
+                return False
+
+            if latest_price == price and latest_hidden == hidden:
+                self.connection.execute(
+                    "UPDATE latest_prices SET last_seen = ? WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+                    (date, *key),
+                )
+                self._written()
+                return False
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO price_changes (item_id, store_number, zip_code, date, price, price_hidden_in_cart) VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, date, price, hidden),
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO latest_prices (item_id, store_number, zip_code, date, price, price_hidden_in_cart, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (*key, date, price, hidden, date),
+        )
+        self._written()
+        return True
+
+    def add_item(self, item):
+        """
+        Adds the price of a LowesProductItem (or any mapping with the same fields).
+
+        Returns:
+        bool: True if a change point was stored. Removed items and items without a price field are ignored.
+        """
+
+        if "price" not in item or item.get("change_type") == "removed" or not item.get("item_id") or not item.get("date"):
+            return False
+
+        return self.add(item["item_id"], item["store_number"], item["zip_code"], item["date"], item["price"], item.get("price_hidden_in_cart"))
+
+    def get_previous_price(self, item_id, store_number, zip_code):
+        """
+        Returns the latest stored (date, price) of an item at a location, or None if it was never stored.
+        """
+
+        return self.connection.execute(
+            "SELECT date, price FROM latest_prices WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (item_id, store_number, zip_code),
+        ).fetchone()
+
+    def get_history(self, item_id, store_number=None):
+        """
+        Returns the price change points of an item, at every location or at a single store.
+
+        Returns:
+        list: Dicts with store_number, zip_code, date, price and price_hidden_in_cart, ordered by location and date.
+        """
+
+        query = "SELECT store_number, zip_code, date, price, price_hidden_in_cart FROM price_changes WHERE item_id = ?"
+        params = [item_id]
+
+        if store_number is not None:
+            query += " AND store_number = ?"
+            params.append(store_number)
+
+        rows = self.connection.execute(query + " ORDER BY store_number, zip_code, date", params).fetchall()
+        keys = ("store_number", "zip_code", "date", "price", "price_hidden_in_cart")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_price_drops(self, since, min_drop):
+        """
+        Finds the items whose latest price is lower than their price at a date by a minimum fraction.
+
+        Only the keys with a change point after the date can have dropped, so they are found through the date index
+        instead of scanning every key.
+
+        Parameters:
+        - since (str): ISO 8601 date to compare the latest prices with.
+        - min_drop (float): Minimum drop, as a fraction of the price at `since` (e.g. 0.1 for 10%).
+
+        Returns:
+        list: Dicts with item_id, store_number, zip_code, previous_price, price and drop, largest drops first.
+        """
+
+        rows = self.connection.execute(
+            """
+            SELECT changed.item_id, changed.store_number, changed.zip_code, previous.price, latest.price
+            FROM (SELECT DISTINCT item_id, store_number, zip_code FROM price_changes WHERE date > ?) AS changed
+            JOIN latest_prices AS latest USING (item_id, store_number, zip_code)
+            JOIN price_changes AS previous ON previous.item_id = changed.item_id
+                AND previous.store_number = changed.store_number
+                AND previous.zip_code = changed.zip_code
+                AND previous.date = (
+                    SELECT MAX(date) FROM price_changes
+                    WHERE item_id = changed.item_id AND store_number = changed.store_number AND zip_code = changed.zip_code AND date <= ?
+                )
+            WHERE previous.price > 0 AND latest.price IS NOT NULL AND latest.price <= previous.price * (1 - ?)
+            """,
+            (since, since, min_drop),
+        ).fetchall()
+
+        drops = [
+            {
+                "item_id": item_id,
+                "store_number": store_number,
+                "zip_code": zip_code,
+                "previous_price": previous_price,
+                "price": price,
+                "drop": (previous_price - price) / previous_price,
+            }
+            for item_id, store_number, zip_code, previous_price, price in rows
+        ]
+        return sorted(drops, key=lambda drop: drop["drop"], reverse=True)
+
+
+def iter_feed_items(path):
+    """
+    Yields the items of a JSON feed file (a list of items) or JSON lines file (one item per line).
+    """
+
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".jl", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Price history of the crawled items.")
+    parser.add_argument("--db", default="data/lowes/price_history.db", help="Path of the price history database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Add the items of feed files (.json or .jl), oldest first")
+    ingest_parser.add_argument("paths", nargs="+")
+
+    item_parser = subparsers.add_parser("item", help="Price history of an item across all stores")
+    item_parser.add_argument("item_id")
+    item_parser.add_argument("--store", help="Only show this store number")
+
+    drops_parser = subparsers.add_parser("drops", help="Items whose price dropped since a number of days ago")
+    drops_parser.add_argument("--days", type=float, default=7)
+    drops_parser.add_argument("--min-drop", type=float, default=0.1, help="Minimum drop as a fraction (default: 0.1)")
+
+    args = parser.parse_args()
+
+    store = PriceHistoryStore(args.db)
+    store.open()
+
+    try:
+        if args.command == "ingest":
+            # Feed file names are timestamped, so sorting them puts them in chronological order
+            for path in sorted(args.paths):
+                items = changes = 0
+                for item in iter_feed_items(path):
+                    items += 1
+                    changes += store.add_item(item)
+                print(f"{path}: {items} items, {changes} price changes")
+
+        elif args.command == "item":
+            for point in store.get_history(args.item_id, args.store):
+                hidden = " (hidden in cart)" if point["price_hidden_in_cart"] else ""
+                print(f"{point['store_number']} {point['zip_code']} {point['date']} {point['price']}{hidden}")
+
+        elif args.command == "drops":
+            since = (datetime.utcnow() - timedelta(days=args.days)).isoformat() + "Z"
+            for drop in store.get_price_drops(since, args.min_drop):
+                print(f"{drop['item_id']} {drop['store_number']} {drop['zip_code']} {drop['previous_price']} -> {drop['price']} (-{drop['drop']:.1%})")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# HTTP cache storage that knows the spider's request types
+#
+# Used as HTTPCACHE_STORAGE, so repeated and debugging runs are served from
+# disk instead of lowes.com:
+#
+#     scrapy crawl lowes -s HTTPCACHE_ENABLED=True
+#
+# Cache keys only hold what changes the response:
+# - listing and category pages: canonical URL + the "sn" store cookie, since
+#   results depend on the store but not on the dbidv2 session
+# - product details: item id(s), store number and zip code from the URL
+# Each type has its own TTL, and other requests (cart, internal) are never cached.
+#
+# Entries are zlib compressed in a SQLite database and evicted least recently
+# used first once the cache exceeds its maximum size.
+
+import json
+import os
+import re
+import sqlite3
+import time
+import zlib
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.url import canonicalize_url
+
+from .request_types import DISCOVERY, LISTING, PRODUCT_DETAIL, get_request_type
+
+PRODUCT_DETAIL_PATTERN = re.compile(r"/wpd/([^/]+)/productdetail/([^/]+)/[^/]+/([^/?#]+)")
+
+
+def get_cache_key(request, request_type):
+    """
+    Returns the cache key of a request, or None if requests of its type are not cached.
+    """
+
+    if request_type == PRODUCT_DETAIL:
+        match = PRODUCT_DETAIL_PATTERN.search(request.url)
+        if match:
+            item_ids, store_number, zip_code = match.groups()
+            return f"{PRODUCT_DETAIL}:{item_ids}:{store_number}:{zip_code}"
+        return None
+
+    if request_type in (LISTING, DISCOVERY):
+        cookies = request.cookies if isinstance(request.cookies, dict) else {}
+        return f"{request_type}:{canonicalize_url(request.url)}|sn={cookies.get('sn', '')}"
+
+    return None
+
+
+class RequestTypeCacheStorage:
+    """
+    HTTP cache storage with per request type keys and TTLs, compressed entries and LRU eviction.
+
+    Settings:
+    - HTTPCACHE_DIR (str): Folder of the cache database, relative to the project data folder (.scrapy).
+    - HTTPCACHE_LISTING_TTL (float): Seconds listing pages are cached for.
+    - HTTPCACHE_DISCOVERY_TTL (float): Seconds category tree pages are cached for.
+    - HTTPCACHE_PRODUCT_DETAIL_TTL (float): Seconds product details are cached for.
+    - HTTPCACHE_MAX_SIZE (int): Maximum size in bytes of the compressed entries, the least recently used ones are evicted beyond it.
+    """
+
+    COMMIT_INTERVAL = 100  # Number of writes between commits
+
+    def __init__(self, settings):
+        self.cache_dir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.ttls = {
+            LISTING: settings.getfloat("HTTPCACHE_LISTING_TTL"),
+            DISCOVERY: settings.getfloat("HTTPCACHE_DISCOVERY_TTL"),
+            PRODUCT_DETAIL: settings.getfloat("HTTPCACHE_PRODUCT_DETAIL_TTL"),
+        }
+        self.max_size = settings.getint("HTTPCACHE_MAX_SIZE")
+        self.connection = None
+        self.total_size = 0
+        self.pending_writes = 0
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cache_dir, f"{spider.name}.db")
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+            """
+        )
+        self.connection.commit()
+        self.total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        spider.logger.info(f"HTTP cache: {path} ({self.total_size / 1024 / 1024:.1f} MB)")
+
+    def close_spider(self, spider):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def _written(self):
+        self.pending_writes += 1
+        if self.pending_writes >= self.COMMIT_INTERVAL:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def retrieve_response(self, spider, request):
+        """
+        Returns the cached response of a request, or None if it is not cached, expired, or not cacheable.
+        """
+
+        request_type = get_request_type(request)
+        key = get_cache_key(request, request_type)
+        if key is None:
+            return None
+
+        row = self.connection.execute("SELECT url, status, headers, body, size, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body, size, stored_at = row
+        now = time.time()
+
+        if now - stored_at > self.ttls[request_type]:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.total_size -= size
+            self._written()
+            return None
+
+        self.connection.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        self._written()
+
+        body = zlib.decompress(body)
+        headers = Headers(json.loads(headers))
+        response_class = responsetypes.from_args(headers=headers, url=url, body=body)
+        return response_class(url=url, status=status, headers=headers, body=body)
+
+    def store_response(self, spider, request, response):
+        """
+        Stores the response of a cacheable request, evicting the least recently used entries if the cache is full.
+        """
+
+        request_type = get_request_type(request)
+        key = get_cache_key(request, request_type)
+        if key is None:
+            return
+
+        headers = {key.decode("latin-1"): [value.decode("latin-1") for value in values] for key, values in response.headers.items()}
+        body = zlib.compress(response.body, 6)
+        size = len(body)
+        now = time.time()
+
+        previous = self.connection.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            self.total_size -= previous[0]
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO entries (key, url, status, headers, body, size, stored_at, last_access) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, response.url, response.status, json.dumps(headers), body, size, now, now),
+        )
+        self.total_size += size
+        self._written()
+
+        if self.total_size > self.max_size:
+            self.evict(spider)
+
+    def evict(self, spider):
+        """
+        Deletes the least recently used entries until the cache is under 90% of its maximum size.
+        """
+
+        target_size = self.max_size * 0.9
+        evicted = 0
+
+        while self.total_size > target_size:
+            rows = self.connection.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT 500").fetchall()
+            if not rows:
+                self.total_size = 0
+                break
+
+            for key, size in rows:
+                self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_size -= size
+                evicted += 1
+
+                if self.total_size <= target_size:
+                    break
+
+        self.connection.commit()
+        self.pending_writes = 0
+        spider.logger.info(f"Evicted {evicted} HTTP cache entries")
@@ -3,6 +3,11 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+from dataclasses import dataclass
+import math
+from typing import Optional
+from urllib.parse import urlparse
+
 import scrapy
 
 class LowesProductItem(scrapy.Item):
@@ -19,9 +24,127 @@ class LowesProductItem(scrapy.Item):
     price_hidden_in_cart = scrapy.Field()  # Whether the price is hidden until added to the cart
     store_number = scrapy.Field() # Store number of a Lowe's location
     zip_code = scrapy.Field() # Zipcode of location for shipping or delivery purposes
+    category = scrapy.Field()  # Path of the listing page the product was found in
     date = scrapy.Field()  # Date and time when the product data was scraped
+    change_type = scrapy.Field()  # Incremental recrawls only - "new", "changed" or "removed" since the last run
 
     def __repr__(self):
         """Define a custom string representation for the item."""
-        return f"<LowesProductItem(item_id={self['item_id']}, model_number={self['model_number']}, brand={self['brand']}, price={self['price']})>"
+        return f"<LowesProductItem(item_id={self.get('item_id')}, model_number={self.get('model_number')}, brand={self.get('brand')}, price={self.get('price')})>"
+
+
+
+CHANGE_TYPES = (None, "new", "changed", "removed")
+
+
+def normalize_price(value):
+    """
+    Converts a price from the API (number, numeric string like "$1,299.00", or None) to a float rounded to cents.
+
+    Raises:
+    ValueError: If the price is not a number.
+    """
+
+    if value is None or value == "":
+        return None
+
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        if isinstance(value, str):
+            value = value.strip().lstrip("$").replace(",", "")
+        return round(float(value), 2)
+    except (TypeError, ValueError):
+        raise ValueError(f"price: invalid value {value!r}")
+
+
+def canonicalize_product_url(url):
+    """
+    Returns the canonical URL of a product page: https://www.lowes.com/pd/..., without query string or fragment.
+    """
+
+    if not url:
+        return None
+
+    parsed_url = urlparse(url)
+    return parsed_url._replace(scheme="https", netloc="www.lowes.com", query="", fragment="").geturl()
+
+
+def normalize_text(value):
+    """
+    Returns a stripped string, or None for missing and empty values.
+    """
+
+    if value is None:
+        return None
+
+    value = str(value).strip()
+    return value or None
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    """
+    Typed and normalized representation of a scraped product, built by the spider and validated by ValidationPipeline.
+
+    Null policy: every field is always present. Missing or empty text is None, an unknown price is None, and
+    price_hidden_in_cart is always a bool (False unless the price was hidden in the cart).
+    """
+
+    item_id: str
+    url: Optional[str]
+    model_number: Optional[str]
+    brand: Optional[str]
+    price: Optional[float]
+    price_hidden_in_cart: bool
+    store_number: str
+    zip_code: str
+    category: Optional[str]
+    date: str
+    change_type: Optional[str]
+
+    @classmethod
+    def from_item(cls, item):
+        """
+        Builds a normalized record from a LowesProductItem (or any mapping with the same fields).
+
+        Raises:
+        ValueError: If the price is not a number.
+        """
+
+        return cls(
+            item_id=normalize_text(item.get("item_id")),
+            url=canonicalize_product_url(item.get("url")),
+            model_number=normalize_text(item.get("model_number")),
+            brand=normalize_text(item.get("brand")),
+            price=normalize_price(item.get("price")),
+            price_hidden_in_cart=bool(item.get("price_hidden_in_cart")),
+            store_number=normalize_text(item.get("store_number")),
+            zip_code=normalize_text(item.get("zip_code")),
+            category=normalize_text(item.get("category")),
+            date=normalize_text(item.get("date")),
+            change_type=normalize_text(item.get("change_type")),
+        )
+
+    def validate(self):
+        """
+        Checks the record against the schema.
+
+        Raises:
+        ValueError: On the first invalid field, with its name in the message.
+        """
 
+        if not self.item_id or not self.item_id.isdigit():
+            raise ValueError(f"item_id: invalid value {self.item_id!r}")
+        if not self.store_number or not self.store_number.isdigit() or len(self.store_number) != 4:
+            raise ValueError(f"store_number: invalid value {self.store_number!r}")
+        if not self.zip_code or not self.zip_code.isdigit() or len(self.zip_code) != 5:
+            raise ValueError(f"zip_code: invalid value {self.zip_code!r}")
+        if not self.date:
+            raise ValueError("date: missing")
+        if self.change_type not in CHANGE_TYPES:
+            raise ValueError(f"change_type: invalid value {self.change_type!r}")
+        if self.change_type == "removed":
+            return  # Removed items only have their keys
+        if self.price is not None and (not math.isfinite(self.price) or self.price < 0):
+            raise ValueError(f"price: invalid value {self.price!r}")
@@ -0,0 +1,145 @@
+# Helpers to extract product data from Lowe's listing pages
+#
+# Listing pages embed their data as a large JSON object assigned to
+# window['__PRELOADED_STATE__'] in a <script> tag. The spider only needs the
+# itemList from it, so instead of decoding every script and the whole state,
+# these helpers search the raw response body for the marker and decode only the
+# itemList array: its end is found by bracket matching on the raw bytes, so only
+# the array itself is ever decoded.
+
+import json
+import re
+
+PRELOADED_STATE_MARKER = b"window['__PRELOADED_STATE__']"
+ITEM_LIST_KEY = b'"itemList"'
+SCRIPT_END = b"</script>"
+
+RESULTS_COUNT_PATTERN = re.compile(rb'<p[^>]*class="[^"]*\bresults\b[^"]*"[^>]*>([^<]*)<')
+# A JSON string (skipped as a whole, so brackets inside it don't count) or a bracket
+ARRAY_TOKEN_PATTERN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.DOTALL)
+WHITESPACE = b" \t\r\n"
+
+
+def find_preloaded_state(body):
+    """
+    Finds the bounds of the preloaded state assignment in a listing page.
+
+    Parameters:
+    - body (bytes): Raw body of the listing page.
+
+    Returns:
+    tuple: (start, end) byte offsets of the preloaded state script, or None if the marker is not in the page.
+    """
+
+    start = body.find(PRELOADED_STATE_MARKER)
+    if start == -1:
+        return None
+
+    end = body.find(SCRIPT_END, start)
+    if end == -1:
+        end = len(body)
+
+    return start, end
+
+
+def find_array_end(body, start, end):
+    """
+    Finds the end of the JSON array starting at body[start] by matching brackets, skipping the contents of strings.
+
+    Returns:
+    int: Offset just after the closing bracket of the array, or -1 if it doesn't end before `end`.
+    """
+
+    depth = 0
+
+    for match in ARRAY_TOKEN_PATTERN.finditer(body, start, end):
+        token = match.group()
+
+        if token in (b"[", b"{"):
+            depth += 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+            if depth == 0:
+                return match.end()
+
+    return -1
+
+
+def extract_item_list(body, bounds=None):
+    """
+    Decodes only the itemList array of the preloaded state.
+
+    Parameters:
+    - body (bytes): Raw body of the listing page.
+    - bounds (tuple): Optional (start, end) offsets returned by find_preloaded_state.
+
+    Returns:
+    list: The decoded itemList entries, or None if the preloaded state has no itemList.
+
+    Raises:
+    json.JSONDecodeError: If the itemList is not valid JSON.
+    """
+
+    if bounds is None:
+        bounds = find_preloaded_state(body)
+        if bounds is None:
+            return None
+
+    start, end = bounds
+    position = body.find(ITEM_LIST_KEY, start, end)
+
+    while position != -1:
+        colon = body.find(b":", position + len(ITEM_LIST_KEY), end)
+        if colon == -1:
+            return None
+
+        array_start = colon + 1
+        while array_start < end and body[array_start] in WHITESPACE:
+            array_start += 1
+
+        # Nested objects may also have an itemList key, only a list of products is the one we want
+        if body[array_start:array_start + 1] == b"[":
+            array_end = find_array_end(body, array_start, end)
+            if array_end == -1:
+                raise json.JSONDecodeError("Unterminated itemList array", body[array_start:end].decode("utf-8", "replace"), 0)
+
+            item_list = json.loads(body[array_start:array_end])
+            if all(isinstance(item, dict) and "product" in item for item in item_list):
+                return item_list
+
+        position = body.find(ITEM_LIST_KEY, colon, end)
+
+    return None
+
+
+def iter_item_ids(item_list):
+    """
+    Yields the omniItemId of every product in an itemList.
+    """
+
+    for item in item_list:
+        item_id = (item.get("product") or {}).get("omniItemId")
+        if item_id:
+            yield item_id
+
+
+def extract_results_count(body):
+    """
+    Extracts the total number of products from the results text (e.g. "123 results") of a listing page.
+
+    Parameters:
+    - body (bytes): Raw body of the listing page.
+
+    Returns:
+    int: Total number of products in the category, or None if the results text is not found.
+    """
+
+    match = RESULTS_COUNT_PATTERN.search(body)
+    if not match:
+        return None
+
+    digits = re.sub(rb"\D", b"", match.group(1))
+    if not digits:
+        return None
+
+    return int(digits)
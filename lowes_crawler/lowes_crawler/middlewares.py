@@ -3,11 +3,22 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+from collections import deque
+import itertools
+import random
+import time
+import uuid
+
 from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, NotConfigured
+from scrapy.http import Request
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from .distributed import is_distributed
+from .request_types import CART, PAGINATION, PRODUCT_DETAIL, get_request_class, get_request_type
+
 
 class LowesCrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -56,6 +67,175 @@ class LowesCrawlerSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
+class CallbackTimingMiddleware:
+    """
+    Measures the CPU time spent in each spider callback (e.g. parse, parse_product_data).
+
+    The callback code runs while its output is iterated, so the time of every step of the iteration is added to the
+    callback_cpu/<callback> stat, in seconds. The CPU time of the reactor thread is measured (time.thread_time), so
+    work of other threads (e.g. DNS resolution, feed storage, the metrics endpoint) is not counted. The number of responses of each callback is counted in callback_calls/<callback>.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats)
+
+    def process_spider_output(self, response, result, spider):
+        callback = response.request.callback if response.request is not None else None
+        callback_name = getattr(callback, "__name__", "parse")
+
+        self.stats.inc_value(f"callback_calls/{callback_name}")
+
+        iterator = iter(result)
+        while True:
+            started = time.thread_time()
+            try:
+                output = next(iterator)
+            except StopIteration:
+                self.stats.inc_value(f"callback_cpu/{callback_name}", time.thread_time() - started)
+                return
+
+            self.stats.inc_value(f"callback_cpu/{callback_name}", time.thread_time() - started)
+            yield output
+
+
+class RequestSchedulingMiddleware:
+    """
+    Schedules the spider's requests by class (discovery, listing, pagination, product detail, cart).
+
+    - Priority: the priority offset of its class is added to every request, so product details drain ahead of deep pagination.
+    - Concurrency: requests of a class with a "lowes-<class>" entry in DOWNLOAD_SLOTS are sent through that download slot,
+      which caps the concurrency of the class. Each slot has its own delay, so the slot delays must split the overall
+      request rate between the classes rather than each use DOWNLOAD_DELAY.
+    - Backpressure: while more than REQUEST_PRODUCT_BACKLOG_LIMIT product detail requests are pending, pagination requests
+      are held back, and released once the backlog is down to half the limit.
+
+    Settings:
+    - REQUEST_CLASS_PRIORITY (dict): Priority offset per request class.
+    - REQUEST_PRODUCT_BACKLOG_LIMIT (int): Pending product detail requests above which pagination is paused, 0 to disable.
+    - DOWNLOAD_SLOTS (dict): Concurrency and delay of the "lowes-<class>" download slots.
+
+    Notes:
+    - The backlog is the number of product detail requests output by the spider that were not dropped, downloaded or
+      failed yet. Each request is tracked by a token in its meta, so outcomes reported by several signals (e.g. a
+      response that left the downloader and was received) only count once. Retries made by downloader middlewares
+      are not part of the backlog, since their original request already left the downloader.
+    - Backpressure is disabled with the shared queue scheduler, since requests scheduled by a worker are downloaded by
+      any worker and the backlog of a single worker can't be measured.
+    - Retried requests keep the priority of their class, adjusted by RETRY_PRIORITY_ADJUST.
+    """
+
+    SLOT_PREFIX = "lowes-"
+
+    def __init__(self, crawler, priorities, backlog_limit, slots):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.priorities = priorities
+        self.backlog_limit = backlog_limit
+        self.slot_classes = {key[len(self.SLOT_PREFIX):] for key in slots if key.startswith(self.SLOT_PREFIX)}
+
+        self.pending_products = set()  # Backlog tokens of the pending product detail requests
+        self.tokens = itertools.count()
+        self.held = deque()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        backlog_limit = crawler.settings.getint("REQUEST_PRODUCT_BACKLOG_LIMIT")
+        if is_distributed(crawler.settings):
+            backlog_limit = 0
+
+        s = cls(
+            crawler,
+            priorities=crawler.settings.getdict("REQUEST_CLASS_PRIORITY"),
+            backlog_limit=backlog_limit,
+            slots=crawler.settings.getdict("DOWNLOAD_SLOTS"),
+        )
+        crawler.signals.connect(s.request_done, signal=signals.request_dropped)
+        crawler.signals.connect(s.request_done, signal=signals.request_left_downloader)
+        crawler.signals.connect(s.response_received, signal=signals.response_received)
+        crawler.signals.connect(s.spider_idle, signal=signals.spider_idle)
+        return s
+
+    @property
+    def product_backlog(self):
+        return len(self.pending_products)
+
+    def process_spider_output(self, response, result, spider):
+        for output in result:
+            if isinstance(output, Request) and not self.schedule(output):
+                continue
+            yield output
+
+        yield from self.release()
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            if self.schedule(request):
+                yield request
+
+        yield from self.release()
+
+    def schedule(self, request):
+        """
+        Applies the priority and download slot of a request's class.
+
+        Returns:
+        bool: False if the request is held back by the backpressure limit.
+        """
+
+        request_class = get_request_class(request)
+
+        # Retries yielded by the spider already have the priority of their original request
+        if not request.meta.get("retry_times"):
+            request.priority += self.priorities.get(request_class, 0)
+        if request_class in self.slot_classes and "download_slot" not in request.meta:
+            request.meta["download_slot"] = f"{self.SLOT_PREFIX}{request_class}"
+
+        if request_class == PRODUCT_DETAIL:
+            request.meta["backlog_token"] = next(self.tokens)
+            self.pending_products.add(request.meta["backlog_token"])
+        elif request_class == PAGINATION and self.backlog_limit and self.product_backlog > self.backlog_limit:
+            self.held.append(request)
+            self.stats.inc_value("scheduling/held_pagination")
+            self.stats.max_value("scheduling/max_held_pagination", len(self.held))
+            return False
+
+        self.stats.inc_value(f"scheduling/{request_class}")
+        return True
+
+    def release(self):
+        """
+        Yields the held pagination requests once the product detail backlog is down to half the limit.
+        """
+
+        if not self.held or self.product_backlog > self.backlog_limit // 2:
+            return
+
+        while self.held and self.product_backlog <= self.backlog_limit:
+            yield self.held.popleft()
+
+    def request_done(self, request, spider):
+        # Dropped by the scheduler, or downloaded (successfully or not)
+        self.pending_products.discard(request.meta.get("backlog_token"))
+
+    def response_received(self, response, request, spider):
+        # Responses served by downloader middlewares (e.g. the HTTP cache) never reach the downloader
+        self.pending_products.discard(request.meta.get("backlog_token"))
+
+    def spider_idle(self, spider):
+        # Requests ignored before reaching the downloader are never reported, so the backlog is reset once the crawl is idle
+        self.pending_products.clear()
+
+        if self.held:
+            spider.logger.info(f"Releasing {len(self.held)} held pagination requests")
+            while self.held:
+                self.crawler.engine.crawl(self.held.popleft())
+            raise DontCloseSpider
+
+
 class LowesCrawlerDownloaderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
@@ -101,3 +281,324 @@ class LowesCrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class AdaptiveConcurrencyMiddleware:
+    """
+    Adjusts the concurrency and delay of each download slot based on its recent block rate and latency.
+
+    A sliding window of the last responses of every slot is kept. Each time half of the window has been refreshed:
+    - If the rate of 403/429 responses is above the threshold, concurrency is cut multiplicatively and the delay is doubled.
+    - If the rate of 5xx responses/download errors is above the threshold, or latency is above its target, concurrency is decreased by one.
+    - Otherwise concurrency is increased by one and the delay is reduced.
+
+    Slots configured in DOWNLOAD_SLOTS (e.g. the request class slots) never go above their configured concurrency.
+
+    The current target of each slot is exposed in the stats under adaptive_concurrency/<slot>/.
+    """
+
+    BLOCK_CODES = (403, 429)
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window_size = settings.getint("ADAPTIVE_CONCURRENCY_WINDOW")
+        self.min_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MIN")
+        self.max_concurrency = settings.getint("ADAPTIVE_CONCURRENCY_MAX") or settings.getint("CONCURRENT_REQUESTS")
+        self.slot_max_concurrency = {
+            key: slot_settings["concurrency"]
+            for key, slot_settings in settings.getdict("DOWNLOAD_SLOTS").items()
+            if "concurrency" in slot_settings
+        }
+        self.block_rate_threshold = settings.getfloat("ADAPTIVE_CONCURRENCY_BLOCK_RATE")
+        self.backoff_factor = settings.getfloat("ADAPTIVE_CONCURRENCY_BACKOFF")
+        self.target_latency = settings.getfloat("ADAPTIVE_CONCURRENCY_TARGET_LATENCY")
+        # The slot delay is only the starting delay, a slot sends one request per delay whatever its concurrency
+        self.min_delay = settings.getfloat("ADAPTIVE_CONCURRENCY_MIN_DELAY")
+        self.max_delay = settings.getfloat("ADAPTIVE_CONCURRENCY_MAX_DELAY")
+
+        self.windows = {}  # Slot key -> deque of (blocked, failed, latency)
+        self.responses_since_adjust = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("ADAPTIVE_CONCURRENCY_ENABLED"):
+            raise NotConfigured
+
+        return cls(crawler)
+
+    def process_response(self, request, response, spider):
+        # Cached responses say nothing about the server
+        if "cached" not in response.flags:
+            self.record(request, spider, blocked=response.status in self.BLOCK_CODES, failed=response.status >= 500)
+
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self.record(request, spider, blocked=False, failed=True)
+
+    def get_slot(self, request):
+        """
+        Returns the key and downloader slot of a request, or (key, None) if the slot no longer exists.
+        """
+
+        downloader = self.crawler.engine.downloader
+        key = downloader.get_slot_key(request)
+        return key, downloader.slots.get(key)
+
+    def record(self, request, spider, blocked, failed):
+        """
+        Adds a download outcome to the window of its slot and adjusts the slot once half of the window has been refreshed.
+        """
+
+        key, slot = self.get_slot(request)
+        if slot is None:
+            return
+
+        window = self.windows.setdefault(key, deque(maxlen=self.window_size))
+        window.append((blocked, failed, request.meta.get("download_latency", 0.0)))
+
+        self.responses_since_adjust[key] = self.responses_since_adjust.get(key, 0) + 1
+        if len(window) < self.window_size or self.responses_since_adjust[key] < self.window_size // 2:
+            return
+
+        self.responses_since_adjust[key] = 0
+        self.adjust(key, slot, window, spider)
+
+    def adjust(self, key, slot, window, spider):
+        """
+        Updates the concurrency and delay of a slot from the block rate, failure rate and latency of its window.
+        """
+
+        block_rate = sum(blocked for blocked, _, _ in window) / len(window)
+        failure_rate = sum(failed for _, failed, _ in window) / len(window)
+        latency = sum(latency for _, _, latency in window) / len(window)
+
+        concurrency = slot.concurrency
+        delay = slot.delay
+
+        if block_rate > self.block_rate_threshold:
+            # Back off hard, and start measuring again with the new settings
+            concurrency = max(self.min_concurrency, int(concurrency * self.backoff_factor))
+            delay = min(self.max_delay, max(delay * 2, self.min_delay, 0.5))
+            window.clear()
+            spider.logger.warning(f"Block rate of {block_rate:.0%} on {key}. Concurrency: {concurrency} | Delay: {delay:.2f}s")
+        elif failure_rate > self.block_rate_threshold or latency > self.target_latency:
+            concurrency = max(self.min_concurrency, concurrency - 1)
+        else:
+            concurrency = min(self.slot_max_concurrency.get(key, self.max_concurrency), concurrency + 1)
+            delay = max(self.min_delay, delay * 0.75)
+            if delay < 0.05:
+                delay = self.min_delay
+
+        slot.concurrency = concurrency
+        slot.delay = delay
+
+        self.stats.set_value(f"adaptive_concurrency/{key}/target", concurrency)
+        self.stats.set_value(f"adaptive_concurrency/{key}/delay", round(delay, 3))
+        self.stats.set_value(f"adaptive_concurrency/{key}/block_rate", round(block_rate, 3))
+        self.stats.set_value(f"adaptive_concurrency/{key}/latency", round(latency, 3))
+
+
+class ProxySession:
+    """
+    A proxy of the pool, with its own dbidv2 cookie session and health score.
+    """
+
+    def __init__(self, index, proxy):
+        self.index = index
+        self.proxy = proxy
+        self.name = f"proxy{index}"  # Used in logs and stats instead of the proxy URL, which may contain credentials
+        self.dbidv2 = str(uuid.uuid4())
+        self.generation = 0
+        self.score = 1.0
+        self.quarantined_until = 0.0
+
+    def is_available(self, now):
+        return self.quarantined_until <= now
+
+    def rotate(self):
+        """
+        Starts a new session on the proxy: a new dbidv2 cookie and new (empty) cookie jars.
+        """
+
+        self.dbidv2 = str(uuid.uuid4())
+        self.generation += 1
+
+    def get_cookiejar(self, base_cookiejar):
+        if self.generation:
+            return f"{base_cookiejar}@{self.name}~{self.generation}"
+        return f"{base_cookiejar}@{self.name}"
+
+
+class ProxyPoolMiddleware:
+    """
+    Sends requests through a pool of rotating proxies loaded from a file (one proxy URL per line).
+
+    - Each proxy has its own dbidv2 cookie and cookie jar, so a flagged session only affects one exit.
+    - Requests of the same cookie jar (e.g. the same location) stick to the same proxy while it is healthy.
+    - The health score of a proxy is an exponential moving average of its successful responses. Proxies below the
+      minimum score are quarantined for a cooldown period.
+    - Blocked requests (403/429) are retried right away on a different proxy, before the retry middleware sees them.
+    - Requests with the "rotate_proxy_session" meta key (set by BlockRecoveryMiddleware) start a new session on their
+      proxy, unless it was already rotated since they were sent.
+    - Cart requests keep the cookies and cookie jar of their cart session, stick to one proxy and are never moved to
+      another exit when blocked, since their cart only exists in their session.
+    """
+
+    BLOCK_CODES = (403, 429)
+
+    def __init__(self, crawler, proxies):
+        settings = crawler.settings
+
+        self.stats = crawler.stats
+        self.sessions = [ProxySession(index, proxy) for index, proxy in enumerate(proxies)]
+        self.sessions_by_name = {session.name: session for session in self.sessions}
+        self.sticky = {}  # Cookie jar -> proxy session name
+
+        self.min_score = settings.getfloat("PROXY_POOL_MIN_SCORE")
+        self.score_decay = settings.getfloat("PROXY_POOL_SCORE_DECAY")
+        self.quarantine_time = settings.getfloat("PROXY_POOL_QUARANTINE_TIME")
+        self.max_retries = settings.getint("PROXY_POOL_RETRY_TIMES")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        file_path = crawler.settings.get("PROXY_POOL_FILE")
+        if not file_path:
+            raise NotConfigured
+
+        with open(file_path, "r") as file:
+            proxies = [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+        if not proxies:
+            raise NotConfigured(f"No proxies found in {file_path}")
+
+        s = cls(crawler, proxies)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        return s
+
+    def spider_opened(self, spider):
+        spider.logger.info(f"Proxy pool loaded with {len(self.sessions)} proxies")
+        self.stats.set_value("proxy_pool/size", len(self.sessions))
+
+    def process_request(self, request, spider):
+        if request.meta.get("dont_proxy") or not request.url.startswith("http"):
+            return None
+
+        if get_request_type(request) == CART:
+            session = self.choose_session(request)
+            request.meta["proxy"] = session.proxy
+            request.meta["proxy_session"] = session.name
+            return None
+
+        session = self.sessions_by_name.get(request.meta.get("proxy_session"))
+        if session is None or not session.is_available(time.time()):
+            session = self.choose_session(request)
+
+        # The original cookie jar is kept so that the request can be moved to another proxy
+        base_cookiejar = request.meta.setdefault("proxy_base_cookiejar", request.meta.get("cookiejar", "default"))
+
+        # A request moved to another proxy starts on that proxy's current session anyway
+        rotate = request.meta.pop("rotate_proxy_session", False) and request.meta.get("proxy_session") == session.name
+        if rotate and request.meta.get("proxy_session_generation") == session.generation:
+            session.rotate()
+            self.stats.inc_value("proxy_pool/rotated_sessions")
+
+        request.meta["proxy"] = session.proxy
+        request.meta["proxy_session"] = session.name
+        request.meta["proxy_session_generation"] = session.generation
+        request.meta["cookiejar"] = session.get_cookiejar(base_cookiejar)
+
+        if isinstance(request.cookies, dict):
+            request.cookies["dbidv2"] = session.dbidv2
+
+        return None
+
+    def process_response(self, request, response, spider):
+        session = self.sessions_by_name.get(request.meta.get("proxy_session"))
+        if session is None:
+            return response
+
+        blocked = response.status in self.BLOCK_CODES
+        self.update_score(session, success=not blocked and response.status < 500, spider=spider)
+
+        if not blocked:
+            return response
+
+        self.stats.inc_value(f"proxy_pool/blocked/{session.name}")
+
+        # Retry on a different exit
+        if get_request_type(request) == CART:
+            return response
+
+        retry_times = request.meta.get("proxy_retry_times", 0) + 1
+        if retry_times > self.max_retries:
+            return response
+
+        self.stats.inc_value("proxy_pool/retried_on_new_exit")
+
+        retry_request = request.copy()
+        retry_request.meta["proxy_retry_times"] = retry_times
+        retry_request.meta["proxy_excluded"] = request.meta.get("proxy_excluded", []) + [session.name]
+        retry_request.meta.pop("proxy_session", None)
+        retry_request.meta.pop("proxy", None)
+        retry_request.dont_filter = True
+        return retry_request
+
+    def process_exception(self, request, exception, spider):
+        session = self.sessions_by_name.get(request.meta.get("proxy_session"))
+        if session is not None:
+            self.update_score(session, success=False, spider=spider)
+
+    def choose_session(self, request):
+        """
+        Picks the proxy session of a request: its sticky proxy if it's still healthy, otherwise a healthy proxy
+        chosen at random weighted by health score.
+        """
+
+        now = time.time()
+        sticky_key = request.meta.get("proxy_base_cookiejar", request.meta.get("cookiejar", "default"))
+        excluded = request.meta.get("proxy_excluded", [])
+
+        session = self.sessions_by_name.get(self.sticky.get(sticky_key))
+        if session is not None and session.is_available(now) and session.name not in excluded:
+            return session
+
+        available = [session for session in self.sessions if session.is_available(now) and session.name not in excluded]
+        if not available:
+            available = [session for session in self.sessions if session.is_available(now)]
+
+        if available:
+            session = self.pick_session(available)
+        else:
+            # Every proxy is quarantined, use the one that will be released first
+            session = min(self.sessions, key=lambda session: session.quarantined_until)
+
+        self.sticky[sticky_key] = session.name
+        return session
+
+    def pick_session(self, available):
+        """
+        Picks one of the available proxy sessions, at random weighted by health score. Subclasses may override it
+        to pick differently (e.g. in a fixed order).
+        """
+
+        return random.choices(available, weights=[max(session.score, 0.01) for session in available])[0]
+
+    def update_score(self, session, success, spider):
+        """
+        Updates the health score of a proxy and quarantines it if the score drops below the minimum.
+        """
+
+        session.score = session.score * self.score_decay + (1 - self.score_decay) * (1.0 if success else 0.0)
+
+        if session.score < self.min_score and session.is_available(time.time()):
+            spider.logger.warning(f"Quarantining {session.name} for {self.quarantine_time}s. Health score: {session.score:.2f}")
+            self.stats.inc_value("proxy_pool/quarantined")
+
+            session.quarantined_until = time.time() + self.quarantine_time
+            # Start over with a fresh session and a neutral score when the proxy is released
+            session.rotate()
+            session.score = (self.min_score + 1.0) / 2
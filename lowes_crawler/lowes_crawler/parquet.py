@@ -0,0 +1,118 @@
+# Parquet dataset of scraped products
+#
+# Items are written as Parquet files partitioned by crawl date and store number:
+#
+#     data/lowes/parquet/crawl_date=2024-11-21/store_number=0416/part-<run>-<n>.parquet
+#
+# so analysis only has to read the partitions and columns it needs.
+
+from datetime import datetime
+import os
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Typed columns of the Parquet files. The partition columns are stored in the folder names, not in the files.
+SCHEMA = pa.schema([
+    ("item_id", pa.string()),
+    ("zip_code", pa.string()),
+    ("category", pa.string()),
+    ("date", pa.timestamp("us", tz="UTC")),
+    ("url", pa.string()),
+    ("model_number", pa.string()),
+    ("brand", pa.string()),
+    ("price", pa.float64()),
+    ("price_hidden_in_cart", pa.bool_()),
+    ("change_type", pa.string()),
+])
+
+# Partition columns are read back as strings so store numbers keep their leading zeros
+PARTITIONING = ds.partitioning(
+    pa.schema([("crawl_date", pa.string()), ("store_number", pa.string())]),
+    flavor="hive",
+)
+
+
+def to_row(adapter):
+    """
+    Converts a scraped item to a row of the Parquet schema.
+
+    Parameters:
+    - adapter (ItemAdapter): Adapter of the scraped item.
+
+    Returns:
+    dict: Row with typed values for every column of SCHEMA. Missing fields are None.
+    """
+
+    date = adapter.get("date")
+    price = adapter.get("price")
+    price_hidden_in_cart = adapter.get("price_hidden_in_cart")
+
+    return {
+        "item_id": adapter.get("item_id"),
+        "zip_code": adapter.get("zip_code"),
+        "category": adapter.get("category"),
+        "date": datetime.fromisoformat(date) if date else None,
+        "url": adapter.get("url"),
+        "model_number": adapter.get("model_number"),
+        "brand": adapter.get("brand"),
+        "price": float(price) if price is not None else None,
+        "price_hidden_in_cart": bool(price_hidden_in_cart) if price_hidden_in_cart is not None else None,
+        "change_type": adapter.get("change_type"),
+    }
+
+
+def write_partition(base_path, crawl_date, store_number, file_name, rows):
+    """
+    Writes a batch of rows to a new Parquet file in its partition folder.
+
+    Returns:
+    str: Path of the written file.
+    """
+
+    table = pa.Table.from_pylist(rows, schema=SCHEMA)
+    folder_path = os.path.join(base_path, f"crawl_date={crawl_date}", f"store_number={store_number}")
+    if not os.path.exists(folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+
+    file_path = os.path.join(folder_path, file_name)
+    pq.write_table(table, file_path, compression="zstd")
+
+    return file_path
+
+
+def dataset(base_path):
+    """
+    Opens the partitioned Parquet dataset, e.g. to build a filtered scanner.
+    """
+
+    return ds.dataset(base_path, format="parquet", partitioning=PARTITIONING)
+
+
+def read_items(base_path, columns=None, crawl_dates=None, store_numbers=None):
+    """
+    Reads items from the partitioned Parquet dataset into a pandas DataFrame.
+
+    Only the requested columns are read, and partitions that don't match the filters are skipped without being opened.
+
+    Parameters:
+    - base_path (str): Root folder of the dataset, e.g. "lowes_crawler/data/lowes/parquet".
+    - columns (list): Columns to read (partition columns included), or None for all columns.
+    - crawl_dates (list): Crawl dates ("YYYY-MM-DD") to read, or None for all dates.
+    - store_numbers (list): Store numbers to read, or None for all stores.
+
+    Returns:
+    pandas.DataFrame: The matching items.
+    """
+
+    expression = None
+
+    if crawl_dates:
+        expression = ds.field("crawl_date").isin(list(crawl_dates))
+
+    if store_numbers:
+        store_filter = ds.field("store_number").isin(list(store_numbers))
+        expression = store_filter if expression is None else expression & store_filter
+
+    return dataset(base_path).to_table(columns=columns, filter=expression).to_pandas()
@@ -4,10 +4,234 @@
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
 
+from collections import defaultdict
+from datetime import datetime
+import json
+import os
+import socket
+
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem, NotConfigured
+
+from .alerts import PriceAlertDetector
+from .history import PriceHistoryStore
+from .items import ProductRecord
+from .parquet import to_row, write_partition
 
 
 class LowesCrawlerPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class ValidationPipeline:
+    """
+    Validates the ProductRecords built by the spider and drops the ones that don't match the schema. Other items (e.g.
+    LowesProductItems) are converted to normalized ProductRecords first.
+
+    It runs first, so the following pipelines and the feed exports only get typed records with every field set:
+    prices as floats rounded to cents, canonical product URLs and None for missing values. Dropped products are marked
+    as failed in the spider's checkpoint, when checkpoints are enabled.
+    """
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+
+        try:
+            record = item if isinstance(item, ProductRecord) else ProductRecord.from_item(adapter)
+            record.validate()
+        except ValueError as e:
+            field = str(e).split(":", 1)[0]
+            spider.crawler.stats.inc_value(f"validation/dropped/{field}")
+
+            checkpoint = getattr(spider, "checkpoint", None)
+            if checkpoint is not None:
+                checkpoint.fail_product(adapter.get("item_id"), adapter.get("store_number"), adapter.get("zip_code"))
+
+            raise DropItem(f"Invalid item {item!r}: {e}")
+
+        return record
+
+
+class ParquetPartitionPipeline:
+    """
+    Batches scraped items and writes them to Parquet files partitioned by crawl date and store number.
+
+    Each batch is written to a new file, so runs only ever add files to the dataset and never rewrite existing ones.
+    File names include the host name and process id, so several workers of a distributed crawl can share the dataset.
+
+    Settings:
+    - PARQUET_BASE_PATH (str): Root folder of the dataset, may contain %(name)s for the spider name.
+    - PARQUET_BATCH_SIZE (int): Number of items of a partition buffered before they are written to a file.
+    """
+
+    def __init__(self, base_path, batch_size):
+        self.base_path = base_path
+        self.batch_size = batch_size
+        self.batches = defaultdict(list)
+        self.file_counts = defaultdict(int)
+        self.run_id = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            base_path=crawler.settings.get("PARQUET_BASE_PATH"),
+            batch_size=crawler.settings.getint("PARQUET_BATCH_SIZE"),
+        )
+
+    def open_spider(self, spider):
+        self.base_path = self.base_path % {"name": spider.name}
+        self.run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{socket.gethostname()}-{os.getpid()}"
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+
+        # Partition by the date part of the ISO 8601 scrape date
+        crawl_date = (adapter.get("date") or "")[:10] or datetime.utcnow().strftime("%Y-%m-%d")
+        partition = (crawl_date, adapter.get("store_number"))
+
+        self.batches[partition].append(to_row(adapter))
+
+        if len(self.batches[partition]) >= self.batch_size:
+            self.flush(partition, spider)
+
+        return item
+
+    def close_spider(self, spider):
+        for partition in list(self.batches):
+            self.flush(partition, spider)
+
+    def flush(self, partition, spider):
+        """
+        Writes the buffered items of a partition to a new Parquet file.
+        """
+
+        rows = self.batches.pop(partition, None)
+        if not rows:
+            return
+
+        crawl_date, store_number = partition
+        self.file_counts[partition] += 1
+        file_name = f"part-{self.run_id}-{self.file_counts[partition]:05d}.parquet"
+
+        file_path = write_partition(self.base_path, crawl_date, store_number, file_name, rows)
+        spider.logger.info(f"Stored {len(rows)} items in {file_path}")
+
+
+class PriceAlertsPipeline:
+    """
+    Writes alerts for large price changes, outliers and pricing errors to a separate JSON lines feed while the crawl runs
+    (see PriceAlertDetector).
+
+    It runs before PriceHistoryPipeline, so the previous price of an item is read before its new price is stored.
+
+    Settings:
+    - ALERTS_PATH (str): Path of the alerts feed, may contain %(name)s and %(timestamp)s. Alerts are disabled if empty.
+    - ALERTS_MIN_CHANGE (float): Minimum change from the previous price raising an alert, as a fraction.
+    - ALERTS_MAX_SCORE (float): Number of standard deviations from the brand or category prices above which a price is an outlier.
+    - ALERTS_MIN_SAMPLES (int): Number of prices of a brand or category needed before its outliers are reported.
+    - ALERTS_EWMA_ALPHA (float): Weight of each new price in the running brand and category statistics.
+    - ALERTS_MAX_GROUPS (int): Maximum number of brands and of categories with running statistics.
+    - PRICE_HISTORY_PATH (str): Path of the price history database the previous prices are read from.
+    """
+
+    def __init__(self, path, history_path, detector):
+        self.path = path
+        self.history_path = history_path
+        self.detector = detector
+        self.store = None
+        self.file = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get("ALERTS_PATH")
+        if not path:
+            raise NotConfigured("ALERTS_PATH is not set")
+
+        detector = PriceAlertDetector(
+            min_change=crawler.settings.getfloat("ALERTS_MIN_CHANGE"),
+            max_score=crawler.settings.getfloat("ALERTS_MAX_SCORE"),
+            min_samples=crawler.settings.getint("ALERTS_MIN_SAMPLES"),
+            alpha=crawler.settings.getfloat("ALERTS_EWMA_ALPHA"),
+            max_groups=crawler.settings.getint("ALERTS_MAX_GROUPS"),
+        )
+        return cls(path, crawler.settings.get("PRICE_HISTORY_PATH"), detector)
+
+    def open_spider(self, spider):
+        if self.history_path:
+            self.store = PriceHistoryStore(self.history_path % {"name": spider.name})
+            self.store.open()
+
+        started_at = getattr(spider, "started_at", None) or datetime.now()
+        path = self.path % {"name": spider.name, "timestamp": started_at.strftime("%Y-%m-%d_%H-%M-%S")}
+
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.file = open(path, "a", encoding="utf-8")
+        spider.logger.info(f"Writing price alerts to {path}")
+
+    def close_spider(self, spider):
+        if self.store is not None:
+            self.store.close()
+        self.file.close()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+
+        previous = None
+        if self.store is not None and adapter.get("price") is not None:
+            previous = self.store.get_previous_price(adapter.get("item_id"), adapter.get("store_number"), adapter.get("zip_code"))
+
+        for alert in self.detector.check(adapter, previous):
+            self.file.write(json.dumps(alert) + "\n")
+            spider.crawler.stats.inc_value(f"alerts/{alert['type']}")
+
+        return item
+
+
+class PriceHistoryPipeline:
+    """
+    Adds the price of every scraped item to the price history store, which only keeps price change points (see PriceHistoryStore).
+
+    Settings:
+    - PRICE_HISTORY_PATH (str): Path of the price history database, may contain %(name)s for the spider name.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(path=crawler.settings.get("PRICE_HISTORY_PATH"))
+
+    def open_spider(self, spider):
+        self.store = PriceHistoryStore(self.path % {"name": spider.name})
+        self.store.open()
+
+    def close_spider(self, spider):
+        self.store.close()
+
+    def process_item(self, item, spider):
+        if self.store.add_item(ItemAdapter(item)):
+            spider.crawler.stats.inc_value("price_history/changes")
+
+        return item
+
+
+class CheckpointPipeline:
+    """
+    Writes items to the crash-safe items file of the spider's checkpoint, when checkpoints are enabled (see CrawlCheckpoint).
+
+    It runs after the other pipelines, so that only the items that made it through them are marked as completed.
+    """
+
+    def process_item(self, item, spider):
+        checkpoint = getattr(spider, "checkpoint", None)
+        if checkpoint is not None:
+            checkpoint.write_item(item)
+
+        return item
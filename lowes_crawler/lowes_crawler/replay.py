@@ -0,0 +1,154 @@
+# Record/replay of HTTP responses
+#
+# In record mode, every response downloaded from lowes.com is stored in a local
+# archive. In replay mode, responses are served from the archive instead of the
+# network, so the whole spider can be run offline, e.g. to benchmark it.
+#
+#     scrapy crawl lowes -s REPLAY_MODE=record -s REPLAY_ARCHIVE=data/lowes/replay.db
+#     scrapy crawl lowes -s REPLAY_MODE=replay -s REPLAY_ARCHIVE=data/lowes/replay.db
+#     scrapy benchreplay data/lowes/replay.db
+
+import json
+import os
+import sqlite3
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.url import canonicalize_url
+
+
+class ReplayArchive:
+    """
+    SQLite archive of responses, keyed by canonical URL.
+    """
+
+    COMMIT_INTERVAL = 100  # Number of stored responses between commits
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.pending_writes = 0
+
+    def open(self):
+        folder_path = os.path.dirname(self.path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, status INTEGER, headers TEXT, body BLOB)"
+        )
+        self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def get(self, url):
+        """
+        Returns the (status, headers, body) stored for a URL, or None if it wasn't recorded.
+        """
+
+        row = self.connection.execute(
+            "SELECT status, headers, body FROM responses WHERE url = ?", (canonicalize_url(url),)
+        ).fetchone()
+        if row is None:
+            return None
+
+        status, headers, body = row
+        return status, json.loads(headers), body
+
+    def put(self, url, status, headers, body):
+        """
+        Stores a response, replacing any previous response of the same URL.
+
+        Parameters:
+        - url (str): URL of the request.
+        - status (int): HTTP status of the response.
+        - headers (dict): Response headers, as lists of str values.
+        - body (bytes): Response body.
+        """
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO responses (url, status, headers, body) VALUES (?, ?, ?, ?)",
+            (canonicalize_url(url), status, json.dumps(headers), body),
+        )
+
+        self.pending_writes += 1
+        if self.pending_writes >= self.COMMIT_INTERVAL:
+            self.connection.commit()
+            self.pending_writes = 0
+
+
+class RecordReplayMiddleware:
+    """
+    Downloader middleware that records responses to, or replays them from, a ReplayArchive.
+
+    Settings:
+    - REPLAY_MODE (str): "record", "replay", or None to disable the middleware.
+    - REPLAY_ARCHIVE (str): Path of the archive.
+
+    Notes:
+    - In replay mode, requests that are not in the archive are ignored and counted in the replay/missing stat.
+    - Non HTTP requests (e.g. data: URLs used internally by the spider) are never recorded nor replayed.
+    """
+
+    def __init__(self, crawler, mode, path):
+        self.stats = crawler.stats
+        self.mode = mode
+        self.archive = ReplayArchive(path)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mode = crawler.settings.get("REPLAY_MODE")
+        if not mode:
+            raise NotConfigured
+
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Invalid REPLAY_MODE: {mode}. Use 'record' or 'replay'.")
+
+        path = crawler.settings.get("REPLAY_ARCHIVE")
+        if mode == "replay" and not os.path.exists(path):
+            raise ValueError(f"Replay archive not found: {path}")
+
+        s = cls(crawler, mode, path)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    def spider_opened(self, spider):
+        self.archive.open()
+        spider.logger.info(f"Replay mode: {self.mode} | Archive: {self.archive.path}")
+
+    def spider_closed(self, spider):
+        self.archive.close()
+
+    def process_request(self, request, spider):
+        if self.mode != "replay" or not request.url.startswith("http"):
+            return None
+
+        recorded = self.archive.get(request.url)
+        if recorded is None:
+            self.stats.inc_value("replay/missing")
+            raise IgnoreRequest(f"Response not found in replay archive: {request.url}")
+
+        status, headers, body = recorded
+        headers = Headers(headers)
+        response_class = responsetypes.from_args(headers=headers, url=request.url, body=body)
+
+        self.stats.inc_value("replay/replayed")
+        return response_class(url=request.url, status=status, headers=headers, body=body, request=request, flags=["replayed"])
+
+    def process_response(self, request, response, spider):
+        if self.mode != "record" or not request.url.startswith("http") or "cached" in response.flags:
+            return response
+
+        headers = {key.decode("latin-1"): [value.decode("latin-1") for value in values] for key, values in response.headers.items()}
+        self.archive.put(request.url, response.status, headers, response.body)
+        self.stats.inc_value("replay/recorded")
+
+        return response
@@ -0,0 +1,46 @@
+# Types of the requests sent by the spider
+#
+# Used to group metrics, cache entries and scheduling by what a request is for.
+# The type is taken from the request_type meta key when the spider sets it,
+# otherwise it is inferred from the URL.
+
+DISCOVERY = "discovery"  # Category tree pages walked to find listing pages
+LISTING = "listing"  # Category listing pages (/pl/...)
+PAGINATION = "pagination"  # Remaining pages of a category listing, only used as a scheduling class
+PRODUCT_DETAIL = "product_detail"  # Product details API (/wpd/{item_id}/productdetail/...)
+CART = "cart"  # Cart requests resolving hidden prices
+OTHER = "other"
+
+
+def get_request_type(request):
+    """
+    Returns the type of a request.
+
+    Parameters:
+    - request (scrapy.Request): Request to classify.
+
+    Returns:
+    str: The request_type meta value if set, otherwise a type inferred from the URL.
+    """
+
+    request_type = request.meta.get("request_type")
+    if request_type:
+        return request_type
+
+    if "/productdetail/" in request.url:
+        return PRODUCT_DETAIL
+    if "/pl/" in request.url:
+        return LISTING
+    return OTHER
+
+
+def get_request_class(request):
+    """
+    Returns the scheduling class of a request: its type, with the remaining pages of a listing split from its first page.
+    """
+
+    request_type = get_request_type(request)
+
+    if request_type == LISTING and request.meta.get("paginated"):
+        return PAGINATION
+    return request_type
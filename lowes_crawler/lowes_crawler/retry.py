@@ -0,0 +1,251 @@
+# Retry and block recovery
+#
+# Replaces Scrapy's RetryMiddleware, which retried a blocked request up to
+# RETRY_TIMES times with the same dbidv2 cookie, cookie jar and user agent, so a
+# flagged session burned every retry. Failures are classified first:
+#
+# - blocked (403/429, e.g. Akamai flagging the session): the session of the
+#   request's cookie jar is rotated (new dbidv2, empty cookie jar, new user
+#   agent) and the request is retried after a backoff
+# - invalid store (404 of product details): never retried, the spider's
+#   errback records it
+# - server errors (5xx) and network errors: retried after a backoff
+# - JSON decode errors: detected by the spider, which retries the request with
+#   a rotated session, since an unexpected body is usually a challenge page
+#
+# Backoffs are exponential with full jitter. Requests that still fail once
+# their retries are exhausted are handed to the spider, which retries them
+# once more when the rest of the crawl is done (see LowesSpider.defer_retry).
+
+import random
+import uuid
+
+from scrapy import signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.response import response_status_message
+from twisted.internet.task import deferLater
+
+from .request_types import CART, PRODUCT_DETAIL, get_request_type
+
+BLOCKED = "blocked"
+INVALID_STORE = "invalid_store"
+SERVER_ERROR = "server_error"
+NETWORK_ERROR = "network_error"
+JSON_DECODE_ERROR = "json_decode_error"
+
+
+def classify_response(request, response):
+    """
+    Returns the failure type of a response, or None if it is not a failure.
+    """
+
+    if response.status in (403, 429):
+        return BLOCKED
+    if response.status == 404 and get_request_type(request) == PRODUCT_DETAIL:
+        return INVALID_STORE
+    if response.status >= 500:
+        return SERVER_ERROR
+    return None
+
+
+def get_backoff_delay(retry_times, base, maximum):
+    """
+    Returns a random delay between 0 and base * 2^(retry_times - 1) seconds, capped at `maximum` (exponential backoff with full jitter).
+    """
+
+    if retry_times <= 0:
+        return 0.0
+    return random.uniform(0, min(maximum, base * 2 ** (retry_times - 1)))
+
+
+def get_wasted_requests(request):
+    """
+    Returns the number of failed attempts made before a request, across retries, proxy retries and deferred retries.
+    """
+
+    return request.meta.get("retry_times", 0) + request.meta.get("proxy_retry_times", 0) + request.meta.get("deferred_wasted", 0)
+
+
+def record_recovery(stats, request):
+    """
+    Counts a request that succeeded after failed attempts, with the number of attempts it wasted.
+    """
+
+    wasted_requests = get_wasted_requests(request)
+    if wasted_requests:
+        stats.inc_value("block_recovery/recovered")
+        stats.inc_value("block_recovery/wasted_requests", wasted_requests)
+
+
+def build_deferred_request(request):
+    """
+    Returns a copy of a request whose retries are exhausted, with a fresh retry budget and a rotated session.
+    """
+
+    deferred_request = request.replace(dont_filter=True)
+    deferred_request.meta["deferred_wasted"] = get_wasted_requests(request) + 1
+    deferred_request.meta["deferred_retry"] = True
+    deferred_request.meta["rotate_session"] = True
+    deferred_request.meta.pop("retry_times", None)
+    deferred_request.meta.pop("proxy_retry_times", None)
+    deferred_request.meta.pop("retry_backoff", None)
+    return deferred_request
+
+
+class RecoverySession:
+    """
+    Rotated session of a cookie jar: its generation, dbidv2 cookie and user agent.
+    """
+
+    def __init__(self, generation, user_agent):
+        self.generation = generation
+        self.dbidv2 = str(uuid.uuid4())
+        self.user_agent = user_agent
+
+
+class BlockRecoveryMiddleware(RetryMiddleware):
+    """
+    Retries failed requests by failure type, rotating the session of blocked cookie jars and backing off exponentially.
+
+    - Sessions are rotated per cookie jar (e.g. per location): every following request of the jar gets the new dbidv2
+      cookie, user agent and cookie jar, not only the retried one. A jar is only rotated once per generation, so a
+      burst of blocked requests doesn't rotate it again and again.
+    - The backoff happens before the retried request reaches its download slot. It still counts towards
+      CONCURRENT_REQUESTS, so the crawl slows down while many requests are backing off.
+    - Requests whose retries are exhausted are deferred to the end of the crawl when the spider supports it
+      (defer_retry), otherwise their failure goes to their errback as usual.
+    - With a proxy pool, blocked requests are first retried on other proxies. Sessions belong to the proxies then, so
+      rotating a session starts a new session on the request's proxy instead (see ProxyPoolMiddleware).
+
+    Settings:
+    - RETRY_TIMES, RETRY_HTTP_CODES, RETRY_PRIORITY_ADJUST: As for Scrapy's RetryMiddleware.
+    - RETRY_BACKOFF_BASE (float): Maximum backoff in seconds of the first retry, doubled for every following retry.
+    - RETRY_BACKOFF_MAX (float): Maximum backoff in seconds.
+    - RETRY_USER_AGENTS (list): User agents rotated sessions pick from.
+    """
+
+    def __init__(self, crawler):
+        super().__init__(crawler.settings)
+
+        self.stats = crawler.stats
+        self.backoff_base = crawler.settings.getfloat("RETRY_BACKOFF_BASE")
+        self.backoff_max = crawler.settings.getfloat("RETRY_BACKOFF_MAX")
+        self.user_agents = crawler.settings.getlist("RETRY_USER_AGENTS")
+        self.sessions = {}  # Base cookie jar -> RecoverySession
+        self.proxy_sessions = bool(crawler.settings.get("PROXY_POOL_FILE"))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        s = cls(crawler)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        return s
+
+    async def process_request(self, request, spider):
+        if request.meta.pop("retry_backoff", False):
+            delay = get_backoff_delay(request.meta.get("retry_times", 0), self.backoff_base, self.backoff_max)
+            if delay > 0:
+                from twisted.internet import reactor
+
+                await maybe_deferred_to_future(deferLater(reactor, delay, lambda: None))
+
+        # Cart sessions hold a cart, so they are never rotated
+        if "cookiejar" not in request.meta or get_request_type(request) == CART:
+            return None
+
+        if self.proxy_sessions:
+            if request.meta.pop("rotate_session", False):
+                request.meta["rotate_proxy_session"] = True
+            return None
+
+        base_cookiejar = request.meta.setdefault("session_base_cookiejar", request.meta["cookiejar"])
+        session = self.sessions.get(base_cookiejar)
+
+        if request.meta.pop("rotate_session", False):
+            generation = session.generation if session is not None else 0
+            if request.meta.get("session_generation", 0) == generation:
+                session = self.rotate_session(base_cookiejar, generation + 1, spider)
+
+        if session is not None:
+            request.meta["cookiejar"] = f"{base_cookiejar}~{session.generation}"
+            request.meta["session_generation"] = session.generation
+            if isinstance(request.cookies, dict) and "dbidv2" in request.cookies:
+                request.cookies["dbidv2"] = session.dbidv2
+            if session.user_agent:
+                request.headers["User-Agent"] = session.user_agent
+
+        return None
+
+    def process_response(self, request, response, spider):
+        failure_type = classify_response(request, response)
+
+        if failure_type is None:
+            # A product details response can still be a challenge page, so the spider counts them once extracted
+            if response.status < 400 and get_request_type(request) != PRODUCT_DETAIL:
+                record_recovery(self.stats, request)
+            return response
+
+        self.stats.inc_value(f"block_recovery/{failure_type}")
+
+        if request.meta.get("dont_retry", False) or response.status not in self.retry_http_codes:
+            return response
+
+        retry_request = self._retry(request, response_status_message(response.status), spider)
+        if retry_request is None:
+            self.defer(request, spider)
+            return response
+
+        retry_request.meta["retry_backoff"] = True
+        if failure_type == BLOCKED:
+            retry_request.meta["rotate_session"] = True
+        return retry_request
+
+    def process_exception(self, request, exception, spider):
+        if not isinstance(exception, self.exceptions_to_retry) or request.meta.get("dont_retry", False):
+            return None
+
+        self.stats.inc_value(f"block_recovery/{NETWORK_ERROR}")
+
+        retry_request = self._retry(request, exception, spider)
+        if retry_request is None:
+            self.defer(request, spider)
+            return None
+
+        retry_request.meta["retry_backoff"] = True
+        return retry_request
+
+    def defer(self, request, spider):
+        """
+        Hands a request whose retries are exhausted to the spider's deferred retries.
+
+        Raises:
+        IgnoreRequest: If the request was deferred, so its errback knows (meta "retry_deferred") and skips it.
+        """
+
+        defer_retry = getattr(spider, "defer_retry", None)
+        if defer_retry is not None and defer_retry(request):
+            request.meta["retry_deferred"] = True
+            raise IgnoreRequest(f"Retries exhausted, deferred to the end of the crawl: {request.url}")
+
+        self.stats.inc_value("block_recovery/gave_up")
+
+    def rotate_session(self, base_cookiejar, generation, spider):
+        """
+        Starts a new session for a cookie jar, with a new dbidv2 cookie, an empty cookie jar and a different user agent.
+        """
+
+        previous = self.sessions.get(base_cookiejar)
+        user_agents = [user_agent for user_agent in self.user_agents if previous is None or user_agent != previous.user_agent]
+        session = RecoverySession(generation, random.choice(user_agents) if user_agents else None)
+
+        self.sessions[base_cookiejar] = session
+        self.stats.inc_value("block_recovery/rotated_sessions")
+        spider.logger.info(f"Rotated session of cookie jar {base_cookiejar} (generation {generation})")
+        return session
+
+    def spider_closed(self, spider):
+        recovered = self.stats.get_value("block_recovery/recovered", 0)
+        if recovered:
+            wasted_requests = self.stats.get_value("block_recovery/wasted_requests", 0)
+            self.stats.set_value("block_recovery/wasted_requests_per_recovered", round(wasted_requests / recovered, 2))
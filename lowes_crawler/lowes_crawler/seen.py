@@ -0,0 +1,105 @@
+# Compact seen-set of the (item_id, store_number, zip_code) keys already requested
+#
+# The same product is listed under several categories and listing pages, so the
+# spider checks this filter before scheduling its product details. A Bloom
+# filter keeps memory bounded (a few MB for millions of keys) at the cost of a
+# small, configurable false positive rate, and can be persisted between runs.
+
+import hashlib
+import math
+import os
+import struct
+
+HEADER = struct.Struct("<QQQ")  # Number of bits, number of hashes, number of added keys
+
+
+class BloomFilter:
+    """
+    Bloom filter of string keys, sized for a capacity and a false positive rate.
+
+    Parameters:
+    - capacity (int): Expected number of keys.
+    - error_rate (float): False positive rate once the filter holds `capacity` keys.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.bit_count / 8))
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: the k positions are derived from two 64-bit halves of a single digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        """
+        Adds a key to the filter.
+
+        Returns:
+        bool: True if the key was not in the filter yet, False if it was (or is a false positive).
+        """
+
+        added = False
+
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+
+        if added:
+            self.count += 1
+
+        return added
+
+    def save(self, path):
+        """
+        Saves the filter to a file, atomically replacing any previous version.
+        """
+
+        folder_path = os.path.dirname(path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(self.bit_count, self.hash_count, self.count))
+            f.write(self.bits)
+
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a filter saved with save().
+        """
+
+        with open(path, "rb") as f:
+            bit_count, hash_count, count = HEADER.unpack(f.read(HEADER.size))
+            bits = bytearray(f.read())
+
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.bit_count = bit_count
+        bloom_filter.hash_count = hash_count
+        bloom_filter.bits = bits
+        bloom_filter.count = count
+        return bloom_filter
+
+
+def get_seen_key(item_id, location):
+    """
+    Returns the seen-set key of an item at a location.
+    """
+
+    return f"{item_id}:{location['store_number']}:{location['zip_code']}"
@@ -1,23 +1,36 @@
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, quote
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 from datetime import datetime
 from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.downloadermiddlewares.retry import get_retry_request
+from scrapy import signals
+from itemadapter import ItemAdapter
 import scrapy
 import json
-import math
 import uuid
-import time
-import re
 import os
 
-from ..items import LowesProductItem
-
-class LowesSpider(scrapy.Spider):
+from ..cart import CartPriceMixin
+from ..checkpoint import CrawlCheckpoint
+from ..config import load_config
+from ..discovery import CategoryTreeCache, canonicalize_category_url, extract_category_links, get_category
+from ..distributed import is_distributed
+from ..failures import FAILED_HTML, FAILED_PRODUCT_DATA, FAILED_URL, FailureArchive
+from ..items import ProductRecord
+from ..listing import extract_item_list, extract_results_count, find_preloaded_state
+from ..seen import BloomFilter, get_seen_key
+from ..request_types import CART, DISCOVERY, get_request_type
+from ..retry import JSON_DECODE_ERROR, build_deferred_request, record_recovery
+from ..state import ItemStateStore
+
+class LowesSpider(CartPriceMixin, scrapy.Spider):
     """
     Scrapy spider to scrape product details from Lowe's website.
 
     This spider extracts product information (such as url, model number, brand, and price)
     for items from Lowe's product listings. It handles pagination and retries for
-    pages that may have been blocked with a 403 response.
+    pages that may have been blocked with a 403 response. Prices hidden in the cart can be resolved
+    through the cart once the crawl is done (see CartPriceMixin).
     """
 
     name = "lowes"
@@ -25,47 +38,202 @@ class LowesSpider(scrapy.Spider):
 
     products_per_page = 24
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, config=None, start_urls=None, locations=None, **kwargs):
         """
-        Initialize the spider with configuration values loaded from config.json.
+        Initialize the spider with the crawl configuration (see lowes_crawler.config).
 
         Parameters:
-        - start_urls (list): List of URLs to start scraping from.
-        - store_number (str): Store number of a Lowe's location.
-        - zip_code (str): Zipcode of location for shipping or delivery purposes
+        - config (str): Path of the config file, config.json in the project folder by default.
+        - start_urls (str): Start URLs overriding the config file, separated by commas.
+        - locations (str): Locations overriding the config file, as "store_number:zip_code" pairs separated by commas.
+
+        Notes:
+        - The parameters are passed on the command line, e.g. `scrapy crawl lowes -a locations=0416:28278`.
         """
 
         super().__init__(*args, **kwargs)
 
-        # Load the config file
-        with open("config.json", "r") as file:
-            config = json.load(file)
+        config = load_config(config, start_urls=start_urls, locations=locations)
 
-        # Set start_urls from config
-        self.start_urls = config.get("start_urls")
-        if not self.start_urls:
-            self.logger.warning("No start URLs found in config.json. Exiting.")
-            raise ValueError("start_urls is required.")
+        # Start URLs are only optional when the category tree is discovered (see from_crawler)
+        self.start_urls = config["start_urls"]
 
         # Log loaded start_urls
         self.logger.info(f"Loaded start_urls: {self.start_urls}")
 
-        # Store Number and Zipcode for a Lowe's Location
-        self.store_number = config.get("store_number")
-        if not self.store_number.isdigit() or len(self.store_number) != 4:
-            self.logger.warning("Invalid store number format. Using default.")
-            self.store_number = "0416"
+        # Store Numbers and Zipcodes of the Lowe's Locations to price
+        self.locations = config["locations"]
+
+        for location in self.locations:
+            self.logger.info(f"Store Number: {location['store_number']} | Zipcode: {location['zip_code']}")
+
+        # Start time of the run, used in the feed paths (see feed_uri_params)
+        self.started_at = datetime.now()
 
-        self.zip_code = config.get("zip_code")
-        if not self.zip_code.isdigit() or len(self.zip_code) != 5:
-            self.logger.warning("Invalid zip code format. Using default.")
-            self.zip_code = "28278"
+        # Listing pages are location independent for discovery, so they are only crawled with the first location
+        self.listing_location = self.locations[0]
 
-        self.logger.info(f"Store Number: {self.store_number} | Zipcode: {self.zip_code}")
+        # (item_id, store_number, zip_code) keys already requested, set up in from_crawler
+        self.seen_filter = None
+
+        # Keys of the products completed (output or unchanged), saved to SEEN_FILTER_PATH instead of the seen filter,
+        # so failed products are requested again by later runs (see from_crawler)
+        self.completed_filter = None
+
+        # (item_id, store_number, zip_code) keys listed during this run, for removed items detection (see from_crawler)
+        self.listed_filter = None
 
         # Generate UUID to use as dbidv2 cookie in requests to avoid 403s and load correct # of results
         self.dbidv2 = str(uuid.uuid4())
 
+        # Whether the product details endpoint accepts several item IDs, unknown until the first batch response
+        self.batch_supported = None
+        self.batch_probe_in_flight = False
+        self.batch_waiting = []
+
+        # Persistent item state, only used for incremental recrawls (see from_crawler)
+        self.state_store = None
+        self.item_validators = {}  # (item_id, store_number, zip_code) -> (etag, last_modified) of items not recorded yet
+        self.failed_listing_urls = set()
+        self.tombstones_scheduled = False
+
+        # Crawl frontier and crash-safe output, only used when checkpoints are enabled (see from_crawler)
+        self.checkpoint = None
+        self.resuming = False
+
+        # Requests whose retries were exhausted, retried once more when the crawl is otherwise done (see defer_retry)
+        self.deferred_retries = []
+        self.deferred_retry_enabled = False
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """
+        Creates the spider and opens the persistent item state store if incremental recrawls are enabled.
+
+        Settings:
+        - DISCOVERY_ENABLED (bool): Walk the category tree from DISCOVERY_START_URL to find the listing pages to crawl.
+        - DISCOVERY_START_URL (str): Top-level department navigation page.
+        - DISCOVERY_MAX_DEPTH (int): Maximum depth of category nodes followed from the start URL.
+        - DISCOVERY_PRIORITY (int): Priority of the start URL's request, decreased by one per level.
+        - DISCOVERY_CACHE_PATH (str): JSON file caching the category tree between runs.
+        - DISCOVERY_CACHE_TTL (float): Seconds before a cached category node is walked again.
+        - LISTING_ONLY_ENABLED (bool): Build items of the listing location from the listing pages when they are complete.
+        - PRODUCT_DETAIL_BATCH_SIZE (int): Number of items per product details request, 1 to disable batching.
+        - PRODUCT_DETAIL_BATCH_URL (str): URL template of batched product details requests, None to disable batching.
+        - SEEN_FILTER_CAPACITY (int): Expected number of (item, location) keys of the run, sizes the Bloom filter.
+        - SEEN_FILTER_ERROR_RATE (float): False positive rate of the Bloom filter at capacity.
+        - SEEN_FILTER_PATH (str): File the Bloom filter is loaded from and saved to, to skip items seen in previous runs.
+        - INCREMENTAL_ENABLED (bool): Send conditional requests and only emit new, changed or removed items.
+        - INCREMENTAL_STATE_PATH (str): Path of the SQLite database holding the item state between runs.
+        - FAILURES_DIR (str): Folder of the failure archives (failed URLs, listing page HTML and product data).
+        - FAILURES_MAX_FILE_SIZE (int): Size in bytes after which a new failure archive is started.
+        - FAILURES_MAX_FILES (int): Number of failure archives kept.
+        - FAILURES_QUEUE_SIZE (int): Number of failures buffered for the background writer.
+        - CHECKPOINT_DIR (str): Folder of the crawl checkpoint, checkpoints are disabled if not set.
+        - CHECKPOINT_INTERVAL (float): Minimum seconds between two checkpoints.
+        - CHECKPOINT_RESUME (bool): Continue the crawl of the checkpoint in CHECKPOINT_DIR, set by `scrapy resume`.
+        - RETRY_DEFERRED_ENABLED (bool): Retry the requests whose retries were exhausted once more at the end of the crawl.
+        """
+
+        spider = super().from_crawler(crawler, *args, **kwargs)
+
+        spider.discovery_enabled = crawler.settings.getbool("DISCOVERY_ENABLED")
+        if not spider.start_urls and not spider.discovery_enabled:
+            spider.logger.warning("No start URLs found in config. Exiting.")
+            raise ValueError("start_urls is required.")
+
+        if spider.discovery_enabled:
+            spider.discovery_start_url = crawler.settings.get("DISCOVERY_START_URL")
+            spider.discovery_max_depth = crawler.settings.getint("DISCOVERY_MAX_DEPTH")
+            spider.discovery_priority = crawler.settings.getint("DISCOVERY_PRIORITY")
+            spider.category_tree = CategoryTreeCache(crawler.settings.get("DISCOVERY_CACHE_PATH"), crawler.settings.getfloat("DISCOVERY_CACHE_TTL"))
+            spider.category_tree.load()
+            spider.discovered_categories = set()
+
+        if crawler.settings.getbool("INCREMENTAL_ENABLED"):
+            spider.state_store = ItemStateStore(crawler.settings.get("INCREMENTAL_STATE_PATH"))
+            spider.state_store.open()
+            spider.logger.info(f"Incremental recrawl enabled. Item state: {spider.state_store.path}")
+
+        spider.listing_only = crawler.settings.getbool("LISTING_ONLY_ENABLED")
+        spider.product_batch_url = crawler.settings.get("PRODUCT_DETAIL_BATCH_URL")
+        spider.product_batch_size = max(1, crawler.settings.getint("PRODUCT_DETAIL_BATCH_SIZE")) if spider.product_batch_url else 1
+
+        if spider.product_batch_size > 1:
+            spider.logger.info(f"Product details batching enabled: {spider.product_batch_size} items per request")
+
+        spider.setup_cart(crawler.settings)
+
+        # Workers of a distributed crawl only see part of the items, and cart sessions would be split between workers
+        spider.distributed = is_distributed(crawler.settings)
+        if spider.distributed:
+            if spider.state_store:
+                spider.logger.warning("Removed items detection is disabled in distributed crawls.")
+            if spider.cart_enabled:
+                spider.logger.warning("Cart price resolution is disabled in distributed crawls.")
+                spider.cart_enabled = False
+
+        spider.seen_filter_path = crawler.settings.get("SEEN_FILTER_PATH")
+        if spider.seen_filter_path and os.path.exists(spider.seen_filter_path):
+            spider.seen_filter = BloomFilter.load(spider.seen_filter_path)
+            spider.completed_filter = BloomFilter.load(spider.seen_filter_path)
+            spider.logger.info(f"Loaded {len(spider.seen_filter)} seen items from {spider.seen_filter_path}")
+        else:
+            spider.seen_filter = BloomFilter(crawler.settings.getint("SEEN_FILTER_CAPACITY"), crawler.settings.getfloat("SEEN_FILTER_ERROR_RATE"))
+            if spider.seen_filter_path:
+                spider.completed_filter = BloomFilter(crawler.settings.getint("SEEN_FILTER_CAPACITY"), crawler.settings.getfloat("SEEN_FILTER_ERROR_RATE"))
+
+        if spider.state_store:
+            # The seen filter may hold the items of previous runs (SEEN_FILTER_PATH), so items listed by this run are kept apart
+            spider.listed_filter = BloomFilter(crawler.settings.getint("SEEN_FILTER_CAPACITY"), crawler.settings.getfloat("SEEN_FILTER_ERROR_RATE"))
+
+        spider.failure_archive = FailureArchive(
+            crawler.settings.get("FAILURES_DIR"),
+            max_file_size=crawler.settings.getint("FAILURES_MAX_FILE_SIZE"),
+            max_files=crawler.settings.getint("FAILURES_MAX_FILES"),
+            queue_size=crawler.settings.getint("FAILURES_QUEUE_SIZE"),
+        )
+        spider.failure_archive.start()
+
+        checkpoint_dir = crawler.settings.get("CHECKPOINT_DIR")
+        if checkpoint_dir:
+            spider.resuming = crawler.settings.getbool("CHECKPOINT_RESUME")
+            spider.checkpoint = CrawlCheckpoint(checkpoint_dir, crawler.settings.getfloat("CHECKPOINT_INTERVAL"))
+            spider.checkpoint.open(resume=spider.resuming)
+            if not spider.resuming:
+                spider.checkpoint.set_spider_args(kwargs)
+            spider.logger.info(f"{'Resuming' if spider.resuming else 'Checkpointing'} crawl in {checkpoint_dir}")
+
+            if spider.state_store:
+                # The item state must never be ahead of the items written to the checkpoint
+                spider.state_store.commit_interval = None
+                spider.checkpoint.commit_hooks.append(spider.state_store.commit)
+
+        spider.deferred_retry_enabled = crawler.settings.getbool("RETRY_DEFERRED_ENABLED")
+
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+
+        if spider.state_store or spider.completed_filter is not None:
+            crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        if spider.state_store:
+            crawler.signals.connect(spider.item_dropped, signal=signals.item_dropped)
+
+        return spider
+
+    def get_location_key(self, location):
+        """
+        Returns a stable key for a location, used to keep a separate cookie jar per location.
+        """
+
+        return f"{location['store_number']}-{location['zip_code']}"
+
+    def get_location_cookies(self, location):
+        """
+        Returns the cookies required to request pages for a location.
+        """
+
+        return {"dbidv2": self.dbidv2, "sn": location["store_number"]}
+
     def start_requests(self):
         """
         Send requests to start_urls with required cookies.
@@ -75,10 +243,164 @@ class LowesSpider(scrapy.Spider):
 
         Notes:
         - The method uses the store number and dbidv2 as cookies to avoid 403 errors when requesting pages.
+        - Listing pages are only requested for the first location, product details are requested for every location.
+        - When discovery is enabled, the listing pages found in the category tree are crawled as well.
+        - When a checkpointed crawl is resumed, only its pending pages and products are requested.
         """
 
+        if self.resuming:
+            yield from self.resume_requests()
+            return
+
+        if self.discovery_enabled:
+            yield from self.start_discovery()
+
         for url in self.start_urls:
-            yield scrapy.Request(url, cookies={"dbidv2": self.dbidv2, "sn": self.store_number}, errback=self.handle_404_error)
+            yield self.build_listing_request(url)
+
+    def build_listing_request(self, url, callback=None, meta=None, priority=0):
+        """
+        Builds a request for a listing or category page, with the cookies of the listing location.
+
+        Parameters:
+        - url (str): URL of the page.
+        - callback (callable): Callback of the request, parse by default.
+        - meta (dict): Additional request metadata.
+        - priority (int): Priority of the request.
+
+        Returns:
+        scrapy.Request: Request for the page.
+        """
+
+        callback = callback or self.parse
+        meta = meta or {}
+
+        if self.checkpoint:
+            self.checkpoint.add_page(url, callback.__name__, priority, meta)
+            meta = {**meta, "checkpoint_url": url}
+
+        return scrapy.Request(
+            url,
+            cookies=self.get_location_cookies(self.listing_location),
+            callback=callback,
+            errback=self.handle_404_error,
+            priority=priority,
+            meta={"cookiejar": self.get_location_key(self.listing_location), **meta},
+        )
+
+    def resume_requests(self):
+        """
+        Rebuilds the requests of the pages and products that were pending when the checkpointed crawl stopped.
+
+        Yields:
+        scrapy.Request: Requests for the pending listing and category pages, and for the pending product details.
+        """
+
+        page_count = product_count = 0
+
+        for url, callback, priority, meta in self.checkpoint.iter_pending_pages():
+            page_count += 1
+            yield self.build_listing_request(url, callback=getattr(self, callback), meta=meta, priority=priority)
+
+        for location, category, item_ids in self.checkpoint.iter_pending_products():
+            product_count += len(item_ids)
+
+            for i in range(0, len(item_ids), self.product_batch_size):
+                yield from self.build_product_detail_requests(item_ids[i:i + self.product_batch_size], location, category)
+
+        self.logger.info(f"Resumed {page_count} pending pages and {product_count} pending products")
+
+    def complete_page(self, response):
+        """
+        Marks the page of a response as completed in the checkpoint, once all its requests were scheduled.
+        """
+
+        if self.checkpoint and "checkpoint_url" in response.meta:
+            self.checkpoint.complete_page(response.meta["checkpoint_url"])
+
+    def start_discovery(self):
+        """
+        Starts the category tree discovery from the cached tree.
+
+        Yields:
+        scrapy.Request: Requests for the cached leaf listing pages, and for the category nodes that are missing from the cache or stale.
+
+        Notes:
+        - Cached nodes are walked breadth-first from the start URL, so a fresh cache requires no category requests at all.
+        """
+
+        queue = [(canonicalize_category_url(self.discovery_start_url) or self.discovery_start_url, 0)]
+
+        while queue:
+            url, depth = queue.pop(0)
+            if url in self.discovered_categories:
+                continue
+
+            self.discovered_categories.add(url)
+            node = self.category_tree.get_fresh(url)
+
+            if node is None:
+                yield self.build_category_request(url, depth)
+            elif node["leaf"]:
+                self.crawler.stats.inc_value("discovery/cached_leaves")
+                yield self.build_listing_request(url, meta={"category": get_category(url)})
+            elif depth < self.discovery_max_depth:
+                queue.extend((child, depth + 1) for child in node["children"])
+
+    def build_category_request(self, url, depth):
+        """
+        Builds a request for a category node of the tree. Deeper nodes have a lower priority, so the tree is walked breadth-first.
+        """
+
+        return self.build_listing_request(
+            url,
+            callback=self.parse_category,
+            meta={"depth": depth, "request_type": DISCOVERY},
+            priority=self.discovery_priority - depth,
+        )
+
+    def parse_category(self, response):
+        """
+        Parse a page of the category tree.
+
+        Parameters:
+        - response (scrapy.http.Response): Response object for the category page.
+
+        Yields:
+        scrapy.Request: Requests for the child categories, if the page is a category node.
+        scrapy.Request, ProductRecord: Output of parse, if the page is a leaf listing page.
+
+        Notes:
+        - A page that lists products in its preloaded state is a leaf listing page.
+        """
+
+        url = canonicalize_category_url(response.url) or response.url
+        depth = response.meta.get("depth", 0)
+
+        bounds = find_preloaded_state(response.body)
+        try:
+            item_list = extract_item_list(response.body, bounds) if bounds else None
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            item_list = None
+
+        if item_list:
+            self.crawler.stats.inc_value("discovery/leaves")
+            self.category_tree.set_node(url, leaf=True)
+            response.meta["category"] = get_category(url)
+            yield from self.parse(response)
+            return
+
+        children = extract_category_links(response)
+        self.category_tree.set_node(url, leaf=False, children=children)
+        self.crawler.stats.inc_value("discovery/nodes")
+
+        if depth < self.discovery_max_depth:
+            for child in children:
+                if child not in self.discovered_categories:
+                    self.discovered_categories.add(child)
+                    yield self.build_category_request(child, depth + 1)
+
+        self.complete_page(response)
 
     def handle_404_error(self, failure):
         """
@@ -87,6 +409,14 @@ class LowesSpider(scrapy.Spider):
         Parameters:
         - failure (scrapy.Failure): Contains the details of the error.
         """
+
+        if failure.check(IgnoreRequest) and failure.request.meta.get("retry_deferred"):
+            return  # Retried again at the end of the crawl
+
+        if "item_id" not in failure.request.meta:
+            # Items of a failed listing page are unknown, so none of them can be considered removed
+            self.failed_listing_urls.add(failure.request.url)
+
         if failure.check(HttpError):
             response = failure.value.response
             if response.status == 404:
@@ -99,31 +429,138 @@ class LowesSpider(scrapy.Spider):
         else:
             self.logger.error(f"Request failed: {failure}")
 
-    def build_product_url(self, item_id):
+    def build_product_url(self, item_id, location):
         """
-        Builds the product URL using the item ID, store number, and zip code.
+        Builds the product URL using the item ID and the location's store number and zip code.
         """
 
         if item_id:
-            return f"https://www.lowes.com/wpd/{item_id}/productdetail/{self.store_number}/Guest/{self.zip_code}"
+            return f"https://www.lowes.com/wpd/{item_id}/productdetail/{location['store_number']}/Guest/{location['zip_code']}"
         else:
             self.logger.error("Cannot build URL without item ID.")
             return None
 
-    def has_query_params(self, url):
+    def build_product_request(self, item_id, location, category=None):
         """
-        Checks if a given URL contains query parameters.
+        Builds the product details request of an item for a location.
 
         Parameters:
-        url (str): URL to be checked.
+        - item_id (str): omniItemId of the product.
+        - location (dict): Location with the store_number and zip_code to request the product details for.
+        - category (str): Category the product was listed under.
 
         Returns:
-        bool:
-            - True if the URL contains query parameters.
-            - False if no query parameters are present.
+        scrapy.Request: Request for the product details, or None if the URL can't be built.
+
+        Notes:
+        - On incremental recrawls, the ETag and Last-Modified values of the last response are sent as conditional headers.
         """
-        parsed_url = urlparse(url)
-        return bool(parsed_url.query)
+
+        item_url = self.build_product_url(item_id, location)
+        if not item_url:
+            return None
+
+        headers = {}
+        if self.state_store:
+            state = self.state_store.get(item_id, location["store_number"], location["zip_code"])
+
+            if state and not state["removed"]:
+                if state["etag"]:
+                    headers["If-None-Match"] = state["etag"]
+                if state["last_modified"]:
+                    headers["If-Modified-Since"] = state["last_modified"]
+
+        return scrapy.Request(
+            item_url,
+            headers=headers,
+            cookies=self.get_location_cookies(location),
+            callback=self.parse_product_data,
+            errback=self.handle_product_error,
+            meta={"item_id": item_id, "location": location, "category": category, "cookiejar": self.get_location_key(location), "handle_httpstatus_list": [304]},
+        )
+
+    def build_product_detail_requests(self, item_ids, location, category=None):
+        """
+        Builds the requests for the product details of several items at a location, batched when possible.
+
+        Parameters:
+        - item_ids (list): omniItemIds of the products, at most PRODUCT_DETAIL_BATCH_SIZE.
+        - location (dict): Location with the store_number and zip_code to request the product details for.
+        - category (str): Category the products were listed under.
+
+        Yields:
+        scrapy.Request: A single batch request for all items, or one request per item.
+
+        Notes:
+        - Whether the product details endpoint supports batches is unknown until the first batch response.
+          Only that first batch is sent while the others wait, and they are released once batching is confirmed or ruled out.
+        - On incremental recrawls, items with a stored ETag or Last-Modified value are never batched, since batch
+          requests can't be conditional.
+        """
+
+        if self.state_store and self.product_batch_size > 1:
+            conditional_item_ids = [item_id for item_id in item_ids if self.has_validators(item_id, location)]
+
+            for item_id in conditional_item_ids:
+                product_request = self.build_product_request(item_id, location, category)
+
+                if product_request:
+                    yield product_request
+
+            item_ids = [item_id for item_id in item_ids if item_id not in conditional_item_ids]
+            if not item_ids:
+                return
+
+        if self.product_batch_size <= 1 or self.batch_supported is False or len(item_ids) == 1:
+            for item_id in item_ids:
+                product_request = self.build_product_request(item_id, location, category)
+
+                if product_request:
+                    yield product_request
+            return
+
+        if self.batch_supported is None:
+            if self.batch_probe_in_flight:
+                self.batch_waiting.append((item_ids, location, category))
+                return
+
+            self.batch_probe_in_flight = True
+
+        yield scrapy.Request(
+            self.product_batch_url.format(item_ids=",".join(item_ids), store_number=location["store_number"], zip_code=location["zip_code"]),
+            cookies=self.get_location_cookies(location),
+            callback=self.parse_product_batch,
+            errback=self.handle_product_batch_error,
+            meta={"item_ids": item_ids, "location": location, "category": category, "cookiejar": self.get_location_key(location)},
+        )
+
+    def has_validators(self, item_id, location):
+        """
+        Returns whether the stored state of an item at a location has an ETag or Last-Modified value for conditional requests.
+        """
+
+        state = self.state_store.get(item_id, location["store_number"], location["zip_code"])
+        return bool(state and not state["removed"] and (state["etag"] or state["last_modified"]))
+
+    def resolve_batch_support(self, supported):
+        """
+        Records whether the product details endpoint supports batches, and releases the batches waiting for it.
+
+        Yields:
+        scrapy.Request: Requests for the waiting batches.
+        """
+
+        if self.batch_supported is None:
+            self.batch_supported = supported
+            self.logger.info(f"Batched product details requests {'are' if supported else 'are not'} supported.")
+
+        self.batch_probe_in_flight = False
+
+        waiting = self.batch_waiting
+        self.batch_waiting = []
+
+        for item_ids, location, category in waiting:
+            yield from self.build_product_detail_requests(item_ids, location, category)
 
     def parse(self, response):
         """
@@ -133,122 +570,357 @@ class LowesSpider(scrapy.Spider):
         - response (scrapy.http.Response): Response object for the current page.
 
         Yields:
-        scrapy.Request: Request for each product page found in the preloaded state data.
-        scrapy.Request: Request for the next page if available, or a calculated next page URL.
+        scrapy.Request: Request for each product page found in the preloaded state data, for every configured location.
+        scrapy.Request: Requests for all remaining pages when parsing the first page of a category.
 
         Notes:
-        - If the next page link is available, a request for the next page is yielded.
-        - If no next page link is found, the method calculates the next page URL based on the current page's offset.
+        - The remaining page URLs are calculated from the number of results and the current page's offset, and are all scheduled at once.
+        - If the number of results can't be found, the next page link is followed instead.
+        - Items that shift between pages while they are crawled are only requested once.
         """
 
-        # Extract all script tags
-        scripts = response.css("script::text").getall()
+        # Find window['__PRELOADED_STATE__'] in the raw body instead of decoding every script tag
+        preloaded_state_bounds = find_preloaded_state(response.body)
 
-        if not scripts:
-            self.logger.warning("No scripts found in response. Storing HTML for debugging.")
+        if not preloaded_state_bounds:
+            self.logger.error("Preloaded state data not found in response. Storing HTML for debugging.")
+            self.failed_listing_urls.add(response.url)
             self.store_failed_html(response)
             return
 
-        # Search for script containing window['__PRELOADED_STATE__'] and extract JSON
-        for script in scripts:
-            match = re.search(r"window\['__PRELOADED_STATE__'\]\s*=\s*({.*})", script, re.DOTALL)
-            if match:
-                # Extract JSON from regex match
-                preloaded_state_json = match.group(1)
-
-                try:
-                    # Parse JSON into dictionary
-                    preloaded_state = json.loads(preloaded_state_json)
-                    self.logger.info("Successfully extracted and parsed __PRELOADED_STATE__ data.")
-
-                    if "itemList" not in preloaded_state:
-                        self.logger.error("itemList not found in preloaded state.")
-                        self.store_failed_html(response)
-                        return
-
-                    item_list = preloaded_state.get("itemList", [])
-
-                    for item in item_list:
-                        item_id = item["product"]["omniItemId"]
-                        item_url = self.build_product_url(item_id)
-
-                        if item_url:
-                            yield scrapy.Request(item_url, cookies={"dbidv2": self.dbidv2, "sn": self.store_number}, callback=self.parse_product_data, meta={"item_id": item_id})
-                except json.JSONDecodeError:
-                    self.logger.error("Error decoding JSON data.")
-                    self.store_failed_html(response)
-                    return
-                break
-
-        if not preloaded_state_json:
-            self.logger.error("Preloaded state data not found in response. Storing HTML for debugging.")
+        try:
+            # Only the itemList is decoded, the rest of the preloaded state is never parsed
+            item_list = extract_item_list(response.body, preloaded_state_bounds)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self.logger.error("Error decoding JSON data.")
+            self.failed_listing_urls.add(response.url)
+            self.store_failed_html(response)
+            return
+
+        if item_list is None:
+            self.logger.error("itemList not found in preloaded state.")
+            self.failed_listing_urls.add(response.url)
             self.store_failed_html(response)
             return
 
-         # Extract URL of next page
-        next_page_url = response.css('link[rel="next"]::attr(href)').get()
+        self.logger.info("Successfully extracted __PRELOADED_STATE__ itemList data.")
 
-        # Calculate next page url if current url has parameters
-        # There are cases where the next page url
-        # doesn't include the query parameters of the starter url
-        # which causes a redirect to a different page
-        if not self.has_query_params(response.url) and next_page_url:
-            yield scrapy.Request(next_page_url, cookies={"dbidv2": self.dbidv2, "sn": self.store_number}, callback=self.parse)
-        else:
-            """If next page url is unable to be extracted from HTML, build the url by calculating the next offset based on # of results"""
+        category = response.meta.get("category") or get_category(response.url)
+
+        new_item_ids = {self.get_location_key(location): [] for location in self.locations}
+        listing_items = []
+
+        for listing_entry in item_list:
+            item_id = (listing_entry.get("product") or {}).get("omniItemId")
+            if not item_id:
+                continue
+
+            if self.listed_filter is not None:
+                for location in self.locations:
+                    self.listed_filter.add(get_seen_key(item_id, location))
+
+            # Items are listed under several categories, and can shift between pages that are crawled concurrently,
+            # so only the locations the item wasn't requested for yet are kept
+            item_locations = [location for location in self.locations if self.seen_filter.add(get_seen_key(item_id, location))]
 
-            # Extract number of results
-            results_text = response.css("p.results::text").get()
-            total_products = int("".join(filter(str.isdigit, results_text)))
+            if self.checkpoint:
+                # Skip the products already scheduled by the run that is resumed
+                item_locations = [location for location in item_locations if self.checkpoint.add_product(item_id, location, category)]
 
-            # Calculate how many pages of products exist
-            total_pages = math.ceil(total_products / self.products_per_page)
+            if not item_locations:
+                self.crawler.stats.inc_value("lowes/duplicate_listed_items")
+                continue
 
-            # Extract current offset from URL
-            parsed_url = urlparse(response.url)
-            query_params = parse_qs(parsed_url.query, keep_blank_values=True)
-            current_offset = int(query_params.get("offset", [0])[0]) or 0
+            for location in item_locations:
+                if self.listing_only and location is self.listing_location:
+                    item = self.item_from_listing(response, listing_entry, category)
+                    if item:
+                        listing_items.append(item)
+                        continue
 
-            # Determine if there are more pages
-            if current_offset + self.products_per_page < total_products:
-                next_offset = current_offset + self.products_per_page
+                new_item_ids[self.get_location_key(location)].append(item_id)
+
+        # In listing only mode, complete items of the listing location don't need their product details
+        for item in listing_items:
+            self.crawler.stats.inc_value("lowes/listing_only_items")
+            yield from self.emit_item(item, self.listing_location)
+
+        # Fan out the discovered items to every location
+        for location in self.locations:
+            item_ids = new_item_ids[self.get_location_key(location)]
+
+            for i in range(0, len(item_ids), self.product_batch_size):
+                yield from self.build_product_detail_requests(item_ids[i:i + self.product_batch_size], location, category)
+
+        # The remaining pages of a category are all scheduled from its first page
+        if response.meta.get("paginated"):
+            self.complete_page(response)
+            return
 
-                # Update query parameters with new offset
-                query_params.update({ "offset": next_offset })
+        total_products = extract_results_count(response.body)
 
-                # Rebuild URL with updated offset
-                next_page_url = parsed_url._replace(query=urlencode(query_params, doseq=True)).geturl()
+        if total_products is None:
+            # Without the number of results the offsets can't be calculated, so follow the next page link instead
+            next_page_url = response.css('link[rel="next"]::attr(href)').get()
 
-                yield scrapy.Request(next_page_url, cookies={"dbidv2": self.dbidv2, "sn": self.store_number}, callback=self.parse)
+            if next_page_url:
+                self.logger.warning("Number of results not found. Following next page link.")
+                yield self.build_listing_request(next_page_url, meta={"category": category})
             else:
                 self.logger.warning("No 'next' page URL found. This may be the last page.")
-                return
+        else:
+            yield from self.build_page_requests(response.url, total_products, category)
 
-    def parse_product_data(self, response):
+        self.complete_page(response)
+
+    def build_page_requests(self, url, total_products, category=None):
         """
-        Parse the product details API response and extract product information.
+        Builds requests for every remaining page of a category at once, so pages are fetched concurrently instead of one after another.
 
-        Extracts the url, model number, brand, price, and if there is a price restriction that prevents the price from being in the response data (e.g., "View Lower Price in Cart").
+        Parameters:
+        - url (str): URL of the first crawled page of the category.
+        - total_products (int): Total number of products in the category.
+        - category (str): Category of the listing pages.
+
+        Yields:
+        scrapy.Request: Request for each remaining page, built by updating the offset query parameter of the URL.
+
+        Notes:
+        - The next page link in the HTML is not used because it doesn't always include the query parameters of the start URL,
+          which causes a redirect to a different page.
+        """
+
+        # Extract current offset from URL
+        parsed_url = urlparse(url)
+        query_params = parse_qs(parsed_url.query, keep_blank_values=True)
+        current_offset = int(query_params.get("offset", [0])[0]) or 0
+
+        # Calculate offsets of the remaining pages based on # of results
+        next_offsets = range(current_offset + self.products_per_page, total_products, self.products_per_page)
+
+        if not next_offsets:
+            self.logger.warning("No more pages found. This is the last page.")
+            return
+
+        self.logger.info(f"Scheduling {len(next_offsets)} more pages for {total_products} products of {url}")
+
+        for next_offset in next_offsets:
+            # Update query parameters with new offset
+            query_params.update({ "offset": next_offset })
+
+            # Rebuild URL with updated offset
+            next_page_url = parsed_url._replace(query=urlencode(query_params, doseq=True)).geturl()
+
+            yield self.build_listing_request(next_page_url, meta={"paginated": True, "category": category})
+
+    def parse_product_data(self, response):
+        """
+        Parse the product details API response of a single item and extract product information.
 
         Parameters:
         response (scrapy.http.Response): Response object for the product page.
 
         Yields:
-        LowesProductItem: A `LowesProductItem` containing the extracted product information such as item_id, url, model_number, brand, price, price_hidden_in_cart, store_number, zip_code, and date.
-
-        Raises:
-        Exception: If there is an error parsing the product details, the product data is stored in a json file in the failed_parses folder.
+        ProductRecord: A `ProductRecord` containing the extracted product information (see extract_product_item).
         """
 
         item_id = response.meta.get("item_id") # Retrieve item_id set in request metadata
+        location = response.meta.get("location", self.listing_location) # Location the product details were requested for
+
+        if response.status == 304:
+            # Product details didn't change since the last incremental recrawl
+            self.state_store.touch(item_id, location["store_number"], location["zip_code"], self.get_current_datetime_iso8601())
+            self.crawler.stats.inc_value("incremental/not_modified")
+            record_recovery(self.crawler.stats, response.request)
+            self.complete_product(item_id, location)
+            return
 
-        data = response.json()
+        try:
+            data = response.json()
+        except (ValueError, AttributeError):
+            yield from self.retry_product_data(response)
+            return
 
-        item = LowesProductItem()
+        etag = response.headers.get("ETag", b"").decode() or None
+        last_modified = response.headers.get("Last-Modified", b"").decode() or None
+
+        if (yield from self.extract_product_item(response, item_id, location, data, etag, last_modified)):
+            record_recovery(self.crawler.stats, response.request)
+
+    def retry_product_data(self, response):
+        """
+        Retries a product details request whose response is not JSON, with a new session.
+
+        Yields:
+        scrapy.Request: The retried request, unless its retries are exhausted.
+
+        Notes:
+        - An unexpected body is usually a bot challenge page, so the session of the location is rotated (see BlockRecoveryMiddleware).
+        - Once the retries are exhausted, the request is deferred to the end of the crawl, then its response is stored as a failure.
+        """
+
+        self.crawler.stats.inc_value(f"block_recovery/{JSON_DECODE_ERROR}")
+
+        retry_request = get_retry_request(response.request, spider=self, reason=JSON_DECODE_ERROR)
+        if retry_request is not None:
+            retry_request.meta["rotate_session"] = True
+            retry_request.meta["retry_backoff"] = True
+            yield retry_request
+            return
+
+        if self.defer_retry(response.request):
+            return
+
+        self.logger.error(f"Unable to decode product details of item {response.meta.get('item_id')}: {response.url}")
+        self.store_failed_html(response)
+        self.fail_product(response.meta.get("item_id"), response.meta.get("location", self.listing_location))
+
+    def handle_product_error(self, failure):
+        """
+        Handles failed product details requests: 404s (invalid store number or zip code) and requests whose retries are exhausted.
+
+        Parameters:
+        - failure (scrapy.Failure): Contains the details of the error.
+        """
+
+        if failure.check(IgnoreRequest) and failure.request.meta.get("retry_deferred"):
+            return  # Retried again at the end of the crawl
+
+        item_id = failure.request.meta.get("item_id")
+        location = failure.request.meta.get("location", self.listing_location)
+
+        if failure.check(HttpError):
+            response = failure.value.response
+            if response.status == 404:
+                self.logger.warning(f"404 Not Found for item {item_id} at store {location['store_number']} ({location['zip_code']}). Store number or zipcode may be invalid.")
+            else:
+                self.logger.error(f"HTTP Error {response.status} for item {item_id}: {response.url}")
+            self.store_failed_url(response.url, response.status)
+        else:
+            self.logger.error(f"Product details request failed for item {item_id}: {failure.value}")
+            self.store_failed_url(failure.request.url, failure.type.__name__)
+
+        self.fail_product(item_id, location)
+
+    def fail_product(self, item_id, location):
+        """
+        Marks a product that can't be output as failed in the checkpoint, so a resumed crawl doesn't request it again.
+        """
+
+        if self.checkpoint:
+            self.checkpoint.fail_product(item_id, location["store_number"], location["zip_code"])
+
+    def defer_retry(self, request):
+        """
+        Queues a request whose retries are exhausted, to retry it once more when the rest of the crawl is done.
+
+        Returns:
+        bool: False if deferred retries are disabled, or the request is a deferred retry, a batch or a cart request.
+        Failed batches fall back to single item requests instead, and failed cart requests release their batch.
+        """
+
+        if not self.deferred_retry_enabled or request.meta.get("deferred_retry") or "item_ids" in request.meta:
+            return False
+        if get_request_type(request) == CART:
+            return False
+
+        self.deferred_retries.append(build_deferred_request(request))
+        self.crawler.stats.inc_value("block_recovery/deferred")
+        return True
+
+    def parse_product_batch(self, response):
+        """
+        Parse the product details API response of a batch of items and split it into one item per product.
+
+        Parameters:
+        response (scrapy.http.Response): Response object for the batch of products.
+
+        Yields:
+        ProductRecord: An item for each product of the batch found in the response.
+        scrapy.Request: A single item request for each product missing from the response, and for batches that were waiting.
+
+        Notes:
+        - Batching is considered supported only if the first batch response contains every requested product.
+        """
+
+        item_ids = response.meta["item_ids"]
+        location = response.meta["location"]
+
+        try:
+            data = response.json()
+            product_details = data.get("productDetails") or {}
+        except (ValueError, AttributeError):
+            self.logger.warning(f"Unable to decode batch product details response: {response.url}")
+            data, product_details = {}, {}
+
+        found_item_ids = [item_id for item_id in item_ids if item_id in product_details]
+        missing_item_ids = [item_id for item_id in item_ids if item_id not in product_details]
+
+        self.crawler.stats.inc_value("lowes/batched_product_details", len(found_item_ids))
+
+        yield from self.resolve_batch_support(not missing_item_ids)
+
+        extracted = False
+        for item_id in found_item_ids:
+            extracted |= yield from self.extract_product_item(response, item_id, location, data)
+
+        if extracted:
+            record_recovery(self.crawler.stats, response.request)
+
+        # Fall back to single item requests for the products the batch didn't return
+        for item_id in missing_item_ids:
+            product_request = self.build_product_request(item_id, location, response.meta.get("category"))
+
+            if product_request:
+                yield product_request
+
+    def handle_product_batch_error(self, failure):
+        """
+        Falls back to single item requests when a batch request fails.
+        """
+
+        self.logger.warning(f"Batch product details request failed: {failure.value}")
+
+        yield from self.resolve_batch_support(False)
+
+        location = failure.request.meta["location"]
+        for item_id in failure.request.meta["item_ids"]:
+            product_request = self.build_product_request(item_id, location, failure.request.meta.get("category"))
+
+            if product_request:
+                yield product_request
+
+    def extract_product_item(self, response, item_id, location, data, etag=None, last_modified=None):
+        """
+        Extract the product information of an item from a product details API response.
+
+        Extracts the url, model number, brand, price, and if there is a price restriction that prevents the price from being in the response data (e.g., "View Lower Price in Cart").
+
+        Parameters:
+        response (scrapy.http.Response): Response object for the product details.
+        item_id (str): omniItemId of the product.
+        location (dict): Location the product details were requested for.
+        data (dict): Decoded product details response, with the product under data["productDetails"][item_id].
+        etag (str): ETag of the response, stored on incremental recrawls.
+        last_modified (str): Last-Modified of the response, stored on incremental recrawls.
+
+        Yields:
+        ProductRecord: A `ProductRecord` containing the extracted product information such as item_id, url, model_number, brand, price, price_hidden_in_cart, store_number, zip_code, and date.
+
+        Returns:
+        bool: True if the product details could be extracted, False if they are stored as a failure.
+
+        Raises:
+        Exception: If there is an error parsing the product details, the product data is stored in the failure archive.
+        """
+
+        # Fields are collected first, the record is built once they are all known
+        item = {}
         item["item_id"] = item_id
-        item["store_number"] = self.store_number
-        item["zip_code"] = self.zip_code
+        item["store_number"] = location["store_number"]
+        item["zip_code"] = location["zip_code"]
         item["date"] = self.get_current_datetime_iso8601()
+        item["category"] = response.meta.get("category")
 
         try:
             product_details = data["productDetails"][item_id]
@@ -256,7 +928,8 @@ class LowesSpider(scrapy.Spider):
         except KeyError as e:
             self.logger.error(f"KeyError: Missing expected product details for item {item_id}. Error: {e}")
             self.store_failed_product_data(item_id, data)
-            return
+            self.fail_product(item_id, location)
+            return False
 
         try:
             product_url = product.get("pdURL", None)
@@ -278,7 +951,7 @@ class LowesSpider(scrapy.Spider):
                     map_price_msg = price_data.get("mapPriceMessage")
 
                     if map_price_msg is not None and map_price_msg == "View Lower Price In Cart":
-                        # TODO: add item to cart to get price
+                        # Price is resolved through the cart at the end of the crawl if enabled
                         item["price_hidden_in_cart"] = True
                         item["price"] = None
                     else:
@@ -291,96 +964,266 @@ class LowesSpider(scrapy.Spider):
                     self.logger.warning(f"No price data for item {item_id}. Setting price to None.")
                     item["price"] = None
 
-            yield item
+            yield from self.emit_item(ProductRecord.from_item(item), location, etag, last_modified)
         except Exception as e:
             self.logger.error(f"An error occurred extracting product data for item {item_id}... {e}")
             self.store_failed_product_data(item_id, data)
+            self.fail_product(item_id, location)
+            return False
 
-    def store_failed_url(self, url, status_code):
-        """
-        Stores the details of a failed request (URL and status code) in a file for later review.
+        return True
 
-        This method logs the failed URL and its corresponding HTTP status code to a file to keep track of failed requests.
-        The file is stored in the 'failed_requests' folder.
+    def item_from_listing(self, response, listing_entry, category=None):
+        """
+        Builds an item for the listing location directly from an itemList entry of a listing page.
 
         Parameters:
-        - url (str): The URL of the failed request.
-        - status_code (int): The HTTP status code returned for the failed request (e.g., 404, 500).
+        response (scrapy.http.Response): Response object for the listing page.
+        listing_entry (dict): Entry of the preloaded state itemList.
+        category (str): Category of the listing page.
 
         Returns:
-        - None: This method does not return anything, it only stores the failed URL and status code in a file.
+        ProductRecord: The item, or None if the entry doesn't have a url, model number and valid price,
+        or if its price is hidden in the cart. These items need their product details to be requested.
 
         Notes:
-        - The file is appended with each new failed URL. If the file doesn't exist, it will be created.
+        - Listing pages are requested with the store number of the listing location, so their prices are only valid for it.
         """
 
-        folder_path = "failed_requests"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
+        product = listing_entry.get("product") or {}
 
-        timestamp = int(time.time())
-        file_path = os.path.join(folder_path, f"failed_urls_{timestamp}.txt")
+        # Listing entries carry the same mfePrice structure as the product details
+        mfe_price = listing_entry.get("mfePrice")
+        price_data = mfe_price.get("price") if isinstance(mfe_price, dict) else None
+        if not price_data or price_data.get("mapPriceMessage") == "View Lower Price In Cart":
+            return None
 
-        with open(file_path, "w") as file:
-            file.write(f"{status_code} - {url}\n")
+        selling_price = (price_data.get("additionalData") or {}).get("sellingPrice")
+        if selling_price is None or not product.get("pdURL") or not product.get("modelId"):
+            return None
 
-        self.logger.info(f"Stored failed URL in {file_path}")
+        item = {}
+        item["item_id"] = product["omniItemId"]
+        item["store_number"] = self.listing_location["store_number"]
+        item["zip_code"] = self.listing_location["zip_code"]
+        item["date"] = self.get_current_datetime_iso8601()
+        item["category"] = category
+        item["url"] = response.urljoin(product["pdURL"])
+        item["model_number"] = product["modelId"]
+        item["brand"] = product.get("brand", None) # Not all products have a brand
+        item["price_hidden_in_cart"] = False
+        item["price"] = selling_price
 
-    def store_failed_html(self, response):
+        try:
+            return ProductRecord.from_item(item)
+        except ValueError:
+            return None
+
+    def emit_item(self, item, location, etag=None, last_modified=None):
+        """
+        Yields a scraped item, unless it is held for cart price resolution or unchanged on an incremental recrawl.
         """
-        Stores the HTML content of a page when parsing preloaded state JSON fails, for debugging purposes.
 
-        This method is used to store the raw HTML of a failed page in the 'failed_html' folder when
-        the spider encounters an error while attempting to parse preloaded state JSON.
+        if self.state_store and (etag or last_modified):
+            self.item_validators[(item.item_id, item.store_number, item.zip_code)] = (etag, last_modified)
 
-        Parameters:
-        - response (scrapy.http.Response): Response object containing the URL and HTML content
-        of the failed page.
+        # Held items are compared with their stored state once their price is resolved
+        if item.price_hidden_in_cart and self.hold_for_cart(item, location):
+            return
 
-        Returns:
-        - None: This method does not return anything. It stores the HTML content in a file.
+        yield from self.emit_changed_item(item, location)
+
+    def emit_changed_item(self, item, location):
+        """
+        Yields an item unless it is unchanged since the last run, on incremental recrawls.
+
+        Notes:
+        - Only unchanged items are recorded in the state store here. New and changed items are recorded once they
+          were exported (see item_scraped).
+        """
+
+        if not self.state_store:
+            yield item
+            return
+
+        change_type = self.state_store.get_change_type(ItemAdapter(item))
+        if not change_type:
+            etag, last_modified = self.item_validators.pop((item.item_id, item.store_number, item.zip_code), (None, None))
+            self.state_store.record(ItemAdapter(item), etag, last_modified, conditional=not item.price_hidden_in_cart)
+            self.crawler.stats.inc_value("incremental/unchanged")
+            self.complete_product(item.item_id, location)
+            return
+
+        self.crawler.stats.inc_value(f"incremental/{change_type}")
+        item.change_type = change_type
+        yield item
+
+    def complete_product(self, item_id, location):
+        """
+        Marks a product that doesn't need to be output (unchanged) as completed in the checkpoint and the persisted seen filter.
+        """
+
+        if self.checkpoint:
+            self.checkpoint.complete_product(item_id, location["store_number"], location["zip_code"])
+        if self.completed_filter is not None:
+            self.completed_filter.add(get_seen_key(item_id, location))
+
+    def item_scraped(self, item, response, spider):
+        """
+        Records an exported item in the persisted seen filter, and its state on incremental recrawls.
+        """
+
+        adapter = ItemAdapter(item)
+        key = (adapter.get("item_id"), adapter.get("store_number"), adapter.get("zip_code"))
+
+        if adapter.get("change_type") == "removed":
+            self.state_store.mark_removed(*key)
+            return
+
+        if self.completed_filter is not None:
+            self.completed_filter.add(get_seen_key(key[0], {"store_number": key[1], "zip_code": key[2]}))
+
+        if not self.state_store:
+            return
+
+        etag, last_modified = self.item_validators.pop(key, (None, None))
+        self.state_store.record(adapter, etag, last_modified, conditional=not adapter.get("price_hidden_in_cart"))
+
+    def item_dropped(self, item, response, exception, spider):
+        """
+        Forgets the validators of a dropped item, which isn't recorded so the next run outputs it again.
         """
 
-        MAX_FILENAME_LENGTH = 75
+        adapter = ItemAdapter(item)
+        self.item_validators.pop((adapter.get("item_id"), adapter.get("store_number"), adapter.get("zip_code")), None)
+
+    def spider_idle(self):
+        """
+        Runs the stages that start once all listing and product requests are done:
+        1. Retry the requests whose retries were exhausted (see defer_retry).
+        2. Resolve the prices hidden in the cart.
+        3. Emit the tombstones of removed items on incremental recrawls.
 
-        sanitized_url = quote(response.url, safe="")
-        sanitized_url = sanitized_url[:MAX_FILENAME_LENGTH]
+        Raises:
+        DontCloseSpider: When requests of a stage are scheduled, to keep the spider open until they are processed.
+        """
 
-        folder_path = "failed_html"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
+        if self.deferred_retries:
+            deferred_retries, self.deferred_retries = self.deferred_retries, []
+            self.logger.info(f"Retrying {len(deferred_retries)} deferred requests")
 
-        file_name = f"{sanitized_url}_{int(time.time())}.html"
-        file_path = os.path.join(folder_path, file_name)
+            for request in deferred_retries:
+                self.crawler.engine.crawl(request)
+            raise DontCloseSpider
 
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(response.text)
+        if self.start_cart_stage():
+            raise DontCloseSpider
+
+        if not self.state_store or self.distributed or self.tombstones_scheduled:
+            return
+
+        self.tombstones_scheduled = True
+
+        if self.failed_listing_urls:
+            self.logger.warning(f"{len(self.failed_listing_urls)} listing pages failed. Skipping removed items detection.")
+            return
+
+        # Items can't be yielded from a signal handler, so a local data: request is used to run emit_tombstones as a callback
+        self.crawler.engine.crawl(scrapy.Request("data:,", callback=self.emit_tombstones, dont_filter=True))
+        raise DontCloseSpider
+
+    def emit_tombstones(self, response):
+        """
+        Yields a tombstone item for every stored item that is no longer in the listing pages.
+
+        Yields:
+        ProductRecord: Item with only the item_id, store_number, zip_code, date and a "removed" change_type.
+        """
+
+        date = self.get_current_datetime_iso8601()
+
+        for location in self.locations:
+            # Items listed before a resumed run stopped are only in the checkpoint
+            is_listed = lambda item_id: get_seen_key(item_id, location) in self.listed_filter or (self.checkpoint is not None and self.checkpoint.has_product(item_id, location))
+            removed_item_ids = list(self.state_store.iter_unseen(location["store_number"], location["zip_code"], is_listed))
+
+            # Removed items are marked in the state store once their tombstone is exported (see item_scraped)
+            for item_id in removed_item_ids:
+                self.crawler.stats.inc_value("incremental/removed")
+
+                yield ProductRecord.from_item({
+                    "item_id": item_id,
+                    "store_number": location["store_number"],
+                    "zip_code": location["zip_code"],
+                    "date": date,
+                    "change_type": "removed",
+                })
+
+    def closed(self, reason):
+        """
+        Closes the persistent item state store, checkpoint and failure archive, and saves the seen filter and category tree if they are persisted, when the spider finishes.
+        """
+
+        if self.checkpoint:
+            self.checkpoint.close()
+
+        if not self.failure_archive.close():
+            self.logger.warning(f"Failure archive writer didn't stop, {self.failure_archive.queue.qsize()} buffered failures were not written.")
+
+        if self.completed_filter is not None:
+            self.completed_filter.save(self.seen_filter_path)
+
+        if self.discovery_enabled:
+            self.category_tree.save()
+
+        if self.state_store:
+            self.state_store.close()
+
+    def store_failed_url(self, url, status_code):
+        """
+        Stores the details of a failed request (URL and status code) in the failure archive for later review.
+
+        Parameters:
+        - url (str): The URL of the failed request.
+        - status_code (int): The HTTP status code returned for the failed request (e.g., 404, 500).
+        """
+
+        self.store_failure(FAILED_URL, url, f"{status_code} - {url}\n".encode("utf-8"))
+
+    def store_failed_html(self, response):
+        """
+        Stores the HTML content of a page when parsing preloaded state JSON fails, for debugging purposes.
+
+        Parameters:
+        - response (scrapy.http.Response): Response object containing the URL and HTML content
+        of the failed page.
+        """
+
+        # The raw body is archived as is, without decoding it
+        self.store_failure(FAILED_HTML, response.url, response.body)
 
     def store_failed_product_data(self, item_id, data):
         """
         Stores product data when parsing fails, for later analysis and debugging.
 
-        It saves the raw product data (JSON) to a file in the 'failed_parses' folder, with the file named using
-        the product's item ID and a timestamp.
-
         Parameters:
         - item_id (str): The unique identifier for the product.
         - data (dict): The raw product data (in JSON format) retrieved from the response before parsing
         failed.
-
-        Returns:
-        - None: This method does not return anything. It stores the product data in a file.
         """
 
-        folder_path = "failed_parses"
-        if not os.path.exists(folder_path):
-            os.makedirs(folder_path)
+        self.store_failure(FAILED_PRODUCT_DATA, item_id, json.dumps(data, separators=(",", ":")).encode("utf-8"))
 
-        file_name = f"item_{item_id}_{int(time.time())}.json"
-        file_path = os.path.join(folder_path, file_name)
+    def store_failure(self, kind, key, data):
+        """
+        Hands a failure artifact over to the background writer of the failure archive (see FailureArchive).
+        """
 
-        with open(file_path, "w") as f:
-            json.dump(data, f, indent=4)
+        if self.failure_archive.put(kind, key, data):
+            self.crawler.stats.inc_value(f"failures/{kind}")
+        else:
+            self.logger.warning(f"Failure archive queue is full. Dropped {kind} of {key}")
+            self.crawler.stats.inc_value("failures/dropped")
 
     @staticmethod
     def get_current_datetime_iso8601():
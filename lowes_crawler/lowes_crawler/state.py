@@ -0,0 +1,217 @@
+# Persistent per-item state used for incremental recrawls
+#
+# The state of every (item_id, store_number, zip_code) crawled is kept in a
+# local SQLite database between runs, so that the spider can send conditional
+# requests and only emit items that are new, changed or removed.
+#
+# The spider only compares items with their stored state while crawling. The
+# state of new, changed and removed items is recorded once they were exported
+# (item_scraped), so dropped items and items lost in a crash are still new or
+# changed on the next run. In checkpointed crawls the store is committed right
+# after each checkpoint, so it is never ahead of the checkpointed items.
+
+import hashlib
+import json
+import os
+import sqlite3
+
+# Fields of a ProductRecord that make up its content hash
+HASHED_FIELDS = ("url", "model_number", "brand", "price", "price_hidden_in_cart")
+
+
+def get_content_hash(item):
+    """
+    Returns a hash of the item fields that are tracked for changes.
+
+    Parameters:
+    - item (ItemAdapter): Item to hash.
+
+    Returns:
+    str: Hex digest of the tracked fields.
+    """
+
+    content = json.dumps([item.get(field) for field in HASHED_FIELDS], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class ItemStateStore:
+    """
+    SQLite store of the last known state of each item at each location.
+
+    Each row is keyed by (item_id, store_number, zip_code) and holds the last price, model number, brand,
+    content hash and the ETag/Last-Modified values of the last product detail response.
+
+    Parameters:
+    - path (str): Path of the SQLite database.
+    - commit_interval (int): Number of writes between commits, None to only commit when commit() is called.
+    """
+
+    COMMIT_INTERVAL = 500  # Number of writes between commits
+
+    def __init__(self, path, commit_interval=COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.connection = None
+        self.pending_writes = 0
+
+    def open(self):
+        """
+        Opens the database, creating it and its folder if they don't exist.
+        """
+
+        folder_path = os.path.dirname(self.path)
+        if folder_path and not os.path.exists(folder_path):
+            os.makedirs(folder_path)
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS item_state (
+                item_id TEXT NOT NULL,
+                store_number TEXT NOT NULL,
+                zip_code TEXT NOT NULL,
+                price REAL,
+                model_number TEXT,
+                brand TEXT,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                last_seen TEXT,
+                removed INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (item_id, store_number, zip_code)
+            )
+            """
+        )
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commits pending writes and closes the database.
+        """
+
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+    def commit(self):
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def _written(self):
+        self.pending_writes += 1
+        if self.commit_interval and self.pending_writes >= self.commit_interval:
+            self.commit()
+
+    def get(self, item_id, store_number, zip_code):
+        """
+        Returns the stored state of an item at a location as a dict, or None if it was never crawled.
+        """
+
+        cursor = self.connection.execute(
+            "SELECT price, model_number, brand, content_hash, etag, last_modified, last_seen, removed"
+            " FROM item_state WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (item_id, store_number, zip_code),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        keys = ("price", "model_number", "brand", "content_hash", "etag", "last_modified", "last_seen", "removed")
+        return dict(zip(keys, row))
+
+    def touch(self, item_id, store_number, zip_code, seen_at):
+        """
+        Marks an unchanged item as seen in the current run.
+        """
+
+        self.connection.execute(
+            "UPDATE item_state SET last_seen = ?, removed = 0 WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (seen_at, item_id, store_number, zip_code),
+        )
+        self._written()
+
+    def get_change_type(self, item):
+        """
+        Reports whether a crawled item changed since the last run, without storing it.
+
+        Parameters:
+        - item (ItemAdapter): Crawled item.
+
+        Returns:
+        str: "new" if the item was never crawled (or was removed), "changed" if its content changed, or None if it is unchanged.
+        """
+
+        previous = self.get(item["item_id"], item["store_number"], item["zip_code"])
+
+        if previous is None or previous["removed"]:
+            return "new"
+        if previous["content_hash"] != get_content_hash(item):
+            return "changed"
+        return None
+
+    def record(self, item, etag=None, last_modified=None, conditional=True):
+        """
+        Stores the state of a crawled item.
+
+        Parameters:
+        - item (ItemAdapter): Crawled item.
+        - etag (str): ETag header of the product detail response, if any. A stored ETag is kept if None.
+        - last_modified (str): Last-Modified header of the product detail response, if any. A stored value is kept if None.
+        - conditional (bool): Keep the validators for conditional requests. If False they are cleared, so the next run
+          requests the product details again (e.g. for prices hidden in the cart, which the validators don't cover).
+        """
+
+        key = (item["item_id"], item["store_number"], item["zip_code"])
+
+        self.connection.execute(
+            """
+            INSERT INTO item_state (item_id, store_number, zip_code, price, model_number, brand, content_hash, etag, last_modified, last_seen, removed)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)
+            ON CONFLICT (item_id, store_number, zip_code) DO UPDATE SET
+                price = excluded.price,
+                model_number = excluded.model_number,
+                brand = excluded.brand,
+                content_hash = excluded.content_hash,
+                etag = CASE WHEN ? THEN COALESCE(excluded.etag, item_state.etag) END,
+                last_modified = CASE WHEN ? THEN COALESCE(excluded.last_modified, item_state.last_modified) END,
+                last_seen = excluded.last_seen,
+                removed = 0
+            """,
+            (
+                *key, item.get("price"), item.get("model_number"), item.get("brand"), get_content_hash(item),
+                etag if conditional else None, last_modified if conditional else None, item.get("date"),
+                conditional, conditional,
+            ),
+        )
+        self._written()
+
+    def iter_unseen(self, store_number, zip_code, is_listed):
+        """
+        Yields the IDs of items at a location that are stored as present but were not listed in the current run.
+
+        Parameters:
+        - store_number (str): Store number of the location.
+        - zip_code (str): Zip code of the location.
+        - is_listed (callable): Returns whether an item ID was listed in the current run.
+        """
+
+        cursor = self.connection.execute(
+            "SELECT item_id FROM item_state WHERE store_number = ? AND zip_code = ? AND removed = 0",
+            (store_number, zip_code),
+        )
+
+        for (item_id,) in cursor.fetchall():
+            if not is_listed(item_id):
+                yield item_id
+
+    def mark_removed(self, item_id, store_number, zip_code):
+        """
+        Marks an item as removed from the listing at a location.
+        """
+
+        self.connection.execute(
+            "UPDATE item_state SET removed = 1 WHERE item_id = ? AND store_number = ? AND zip_code = ?",
+            (item_id, store_number, zip_code),
+        )
+        self._written()
@@ -0,0 +1,203 @@
+# Tests of ProxyPoolMiddleware against local HTTP proxies
+#
+# Three local servers act as the proxies of the pool: proxy0 blocks every
+# request with a 403, proxy1 and proxy2 answer normally. A single crawl runs
+# through the middleware (the Twisted reactor can only run once per process),
+# and the tests check what the proxies received. Proxies are picked in the
+# order of the pool instead of at random, so the first cookie jars start on
+# the blocking proxy.
+#
+# Usage (from the lowes_crawler folder):
+#     python -m pytest tests
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+
+import pytest
+import scrapy
+from scrapy.crawler import CrawlerProcess
+
+from lowes_crawler.middlewares import ProxyPoolMiddleware
+from lowes_crawler.request_types import CART
+
+PAGES_PER_JAR = 10
+COOKIEJARS = ("0416-28278", "1234-12345")
+CART_COOKIEJARS = ("cart-0416-28278-0", "cart-1234-12345-0")
+CART_DBIDV2 = "cart-session"
+BLOCKED_PROXY = 0
+
+
+class OrderedProxyPoolMiddleware(ProxyPoolMiddleware):
+    """
+    Picks the first available proxy of the pool, so the test doesn't depend on the random weighted pick.
+    """
+
+    def pick_session(self, available):
+        return available[0]
+
+
+class ProxyServer:
+    """
+    Local HTTP proxy recording the requests it receives, and blocking all of them if `blocked`.
+    """
+
+    def __init__(self, blocked):
+        self.blocked = blocked
+        self.requests = []  # (url, dbidv2 cookie)
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = re.search(r"dbidv2=([^;]+)", self.headers.get("Cookie", ""))
+                with server.lock:
+                    server.requests.append((self.path, match.group(1) if match else None))
+
+                body = json.dumps({"url": self.path}).encode()
+                self.send_response(403 if server.blocked else 200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ProxyTestSpider(scrapy.Spider):
+    name = "proxy_test"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.responses = []  # (url, status, cookiejar, proxy session name)
+        self.cart_responses = []  # (url, status, cookiejar)
+
+    def start_requests(self):
+        for cookiejar in COOKIEJARS:
+            for page in range(PAGES_PER_JAR):
+                yield scrapy.Request(
+                    f"http://www.example.test/{cookiejar}/{page}",
+                    cookies={"dbidv2": "original", "sn": cookiejar[:4]},
+                    meta={"cookiejar": cookiejar, "handle_httpstatus_all": True},
+                    dont_filter=True,
+                )
+
+        for cookiejar in CART_COOKIEJARS:
+            yield scrapy.Request(
+                f"http://www.example.test/cart/{cookiejar}",
+                callback=self.parse_cart,
+                cookies={"dbidv2": CART_DBIDV2},
+                meta={"cookiejar": cookiejar, "request_type": CART, "handle_httpstatus_all": True},
+                dont_filter=True,
+            )
+
+    def parse_cart(self, response):
+        self.cart_responses.append((response.url, response.status, response.meta["cookiejar"]))
+
+    def parse(self, response):
+        self.responses.append((response.url, response.status, response.meta["proxy_base_cookiejar"], response.meta["proxy_session"]))
+
+
+@pytest.fixture(scope="module")
+def crawl(tmp_path_factory):
+    servers = [ProxyServer(blocked=index == BLOCKED_PROXY) for index in range(3)]
+    for server in servers:
+        server.start()
+
+    proxy_file = tmp_path_factory.mktemp("proxies") / "proxies.txt"
+    proxy_file.write_text("".join(f"{server.url}\n" for server in servers))
+
+    process = CrawlerProcess({
+        "LOG_LEVEL": "WARNING",
+        "TELNETCONSOLE_ENABLED": False,
+        "ROBOTSTXT_OBEY": False,
+        "RETRY_ENABLED": False,
+        "CONCURRENT_REQUESTS": 4,
+        "DOWNLOADER_MIDDLEWARES": {OrderedProxyPoolMiddleware: 600},
+        "PROXY_POOL_FILE": str(proxy_file),
+        "PROXY_POOL_MIN_SCORE": 0.5,
+        "PROXY_POOL_SCORE_DECAY": 0.4,  # A single block quarantines a proxy
+        "PROXY_POOL_QUARANTINE_TIME": 300,
+        "PROXY_POOL_RETRY_TIMES": 3,
+    })
+    crawler = process.create_crawler(ProxyTestSpider)
+    process.crawl(crawler)
+    process.start()
+
+    for server in servers:
+        server.stop()
+
+    return crawler, servers
+
+
+def test_every_request_succeeds_through_a_healthy_proxy(crawl):
+    crawler, servers = crawl
+
+    responses = crawler.spider.responses
+    assert len(responses) == len(COOKIEJARS) * PAGES_PER_JAR
+    assert all(status == 200 for _, status, _, _ in responses)
+    assert all(proxy_session != f"proxy{BLOCKED_PROXY}" for _, _, _, proxy_session in responses)
+
+
+def test_requests_are_assigned_to_proxies_of_the_pool(crawl):
+    crawler, servers = crawl
+
+    received = sum(len(server.requests) for server in servers)
+    assert received == crawler.stats.get_value("downloader/request_count")
+    assert all(url.startswith("http://www.example.test/") for server in servers for url, _ in server.requests)
+    assert servers[BLOCKED_PROXY].requests
+
+
+def test_blocked_requests_are_retried_on_another_proxy_with_its_session(crawl):
+    crawler, servers = crawl
+
+    blocked_urls = {url for url, _ in servers[BLOCKED_PROXY].requests if "/cart/" not in url}
+    assert blocked_urls
+    assert crawler.stats.get_value("proxy_pool/retried_on_new_exit") == len(blocked_urls)
+
+    # Every proxy sends its own dbidv2 session instead of the spider's
+    blocked_sessions = {dbidv2 for url, dbidv2 in servers[BLOCKED_PROXY].requests if "/cart/" not in url}
+    healthy_sessions = {dbidv2 for server in servers[1:] for url, dbidv2 in server.requests if "/cart/" not in url}
+    assert "original" not in blocked_sessions | healthy_sessions
+    assert not blocked_sessions & healthy_sessions
+
+    retried_urls = {url for server in servers[1:] for url, _ in server.requests}
+    assert blocked_urls <= retried_urls
+
+
+def test_blocking_proxy_is_quarantined(crawl):
+    crawler, servers = crawl
+
+    assert crawler.stats.get_value("proxy_pool/quarantined") >= 1
+    assert crawler.stats.get_value(f"proxy_pool/blocked/proxy{BLOCKED_PROXY}") == len(servers[BLOCKED_PROXY].requests)
+
+
+def test_cookie_jars_stick_to_one_healthy_proxy(crawl):
+    crawler, servers = crawl
+
+    for cookiejar in COOKIEJARS:
+        proxy_sessions = {proxy_session for _, _, base_cookiejar, proxy_session in crawler.spider.responses if base_cookiejar == cookiejar}
+        assert len(proxy_sessions) == 1
+
+
+def test_cart_requests_keep_their_session_and_exit(crawl):
+    crawler, servers = crawl
+
+    cart_requests = [(url, dbidv2) for server in servers for url, dbidv2 in server.requests if "/cart/" in url]
+    assert sorted(url for url, _ in cart_requests) == sorted(f"http://www.example.test/cart/{cookiejar}" for cookiejar in CART_COOKIEJARS)
+    assert all(dbidv2 == CART_DBIDV2 for _, dbidv2 in cart_requests)
+    assert sorted(cookiejar for _, _, cookiejar in crawler.spider.cart_responses) == sorted(CART_COOKIEJARS)